@@ -0,0 +1,167 @@
+# This module provides the Python API of the processor, so GPS datasets can be validated and processed by other programs, e.g. many batch jobs in one long-running process.
+# Tables are given as Pandas dataframes or paths to data directories, reference data as a ReferenceData object; the results are returned as dataframes, dictionaries and reports.
+# The API neither writes any file nor exits the process: a halted processing raises ProcessingError, and validation errors are returned in ValidationReport.
+# Calls use the module-level state of the processing modules, so they should not run concurrently in multiple threads of the same process.
+
+
+import contextlib
+import logging
+import os
+import bin.config as config
+import bin.colorlog as colorlog
+import bin.table_io as table_io
+import bin.startup_profile as startup_profile
+
+
+np = startup_profile.lazy_import('numpy')
+validator = startup_profile.lazy_import('bin.validator')
+get_csv = startup_profile.lazy_import('bin.get_csv')
+get_json = startup_profile.lazy_import('bin.get_json')
+
+
+# Directory of the reference files of the processor
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+
+# Tables of a GPS dataset
+TABLES = ('table1.csv', 'table2.csv', 'table3.csv', 'table4.csv')
+
+# Fixes applied by validation, and the global set of the validator recording the tables each fix is applied to
+VALIDATION_FIXES = {
+    'lowercase': 'UPDATED_CASE',
+    'whitespace': 'STRIPPED_WHITESPACE',
+    'inserted_metadata': 'INSERTED_METADATA',
+    'no_of_genome': 'UPDATED_NO_OF_GENOME',
+    'duplicate': 'UPDATED_DUPLICATE'
+}
+
+
+# Raised when the processing is halted; messages contains all (level, message) logged before it is halted
+class ProcessingError(Exception):
+    def __init__(self, messages):
+        self.messages = messages
+        errors = [message for (level, message) in messages if level in ('ERROR', 'CRITICAL')]
+        super().__init__('\n'.join(errors) if errors else 'The processing is halted.')
+
+
+# Reference data loaded from the reference files in data_path (the 'data' directory of the processor by default)
+class ReferenceData:
+    def __init__(self, data_path=DATA_PATH):
+        self.data_path = os.path.abspath(data_path)
+        with config.use_reference({}):
+            config.set_reference_files(self.data_path)
+            self.files = {name: getattr(config, name) for name in config.REFERENCE_FILE_NAMES}
+            self.data = config.compile_reference_data()
+
+
+# Result of the validation of a GPS dataset
+class ValidationReport:
+    def __init__(self, version, tables, messages, found_errors, fixes, error_rows):
+        self.version = version
+        # Dictionary of table name: validated dataframe, with fixes (e.g. lowercase values) applied
+        self.tables = tables
+        # All (level, message) logged during the validation
+        self.messages = messages
+        self.errors = [message for (level, message) in messages if level in ('ERROR', 'CRITICAL')]
+        self.warnings = [message for (level, message) in messages if level == 'WARNING']
+        self.passed = not found_errors
+        # Dictionary of fix: sorted names of the tables the fix is applied to
+        self.fixes = fixes
+        # Dataframe of the rows failing validation rules, as saved to validator.ERRORS_FILE by the processor
+        self.error_rows = error_rows
+
+
+# Collect (level, message) of all log records
+class MessageCollector(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append((record.levelname, record.getMessage()))
+
+
+# Validate the tables of a GPS dataset of the version, given as a path to its data directory or a dictionary of table name ('table1.csv', 'table2.csv', 'table3.csv'): dataframe
+# Dataframes should have all values as strings, as read by table_io.read_csv; they are not modified, the validated tables with fixes applied are returned in ValidationReport
+def validate(tables, version, reference):
+    check_version(version)
+    df_index = get_tables(tables, TABLES[:3])
+
+    with processing(reference) as messages:
+        found_errors = validator.validate_tables(df_index, *TABLES[:3], version)
+
+    fixes = {fix: sorted(getattr(validator, global_name)) for fix, global_name in VALIDATION_FIXES.items() if getattr(validator, global_name)}
+    return ValidationReport(version, df_index, messages, found_errors, fixes, validator.get_error_rows())
+
+
+# Generate table4 of a GPS dataset, given as a path to its data directory or a dictionary of table name ('table1.csv', 'table3.csv'): dataframe; return table4 as a dataframe
+# Coordinates of new locations are not fetched, ProcessingError is raised if a location does not exist in the reference data
+def get_table4(tables, reference):
+    df_meta, df_analysis = (table_io.convert_default_na(df) for df in get_tables(tables, ('table1.csv', 'table3.csv')).values())
+
+    with processing(reference):
+        df_table4, _ = get_csv.get_table4_pandas(df_meta, df_analysis)
+
+    return df_table4
+
+
+# Generate Monocle table of GPS datasets, given as a list of (version, tables), where tables is a path to a data directory or a dictionary of table name ('table1.csv' to 'table4.csv'): dataframe
+# Return Monocle table as a dataframe, and the sorted list of the Public_name(s) of its published samples
+def get_monocle(datasets, reference):
+    for (version, _) in datasets:
+        check_version(version)
+    datasets = [(version, tables if isinstance(tables, (str, os.PathLike)) else f'dataset {i + 1}', get_tables(tables, TABLES)) for i, (version, tables) in enumerate(datasets)]
+
+    with processing(reference):
+        # Public_name(s) are indexed from table1 of each dataset in memory, as the key index of a data directory is kept in sync by the processor only
+        get_csv.check_public_name_collisions([(label, {('table1.csv', 'Public_name'): np.unique(np.asarray(dfs['table1.csv']['Public_name'], dtype=str))}) for (_, label, dfs) in datasets])
+
+        dfs = [get_csv.get_monocle_dataset_pandas(*(table_io.convert_default_na(dfs[table]) for table in TABLES), get_csv.get_monocle_drop_columns(version)) for (version, _, dfs) in datasets]
+        df = get_csv.get_monocle_table(dfs)
+
+    return df, get_csv.get_published_public_names(df).tolist()
+
+
+# Generate Data JSON of the GPS Database Overview from Monocle table (as returned by 'get_monocle'); return it as a dictionary
+def get_data(df_monocle, reference):
+    with processing(reference):
+        output, _ = get_json.get_data_pandas(df_monocle.copy())
+
+    return output
+
+
+# Get copies of the dataframes of the selected tables from a dictionary of table name: dataframe, or read them (uncompressed or compressed, e.g. table1.csv.gz) from a data directory
+def get_tables(tables, names):
+    if isinstance(tables, (str, os.PathLike)):
+        return {name: table_io.read_csv(table_io.find_table(os.fspath(tables), name)) for name in names}
+
+    if (missing := [name for name in names if name not in tables]):
+        raise ValueError(f'The following table(s) are required but not provided: {", ".join(missing)}')
+    return {name: tables[name].copy() for name in names}
+
+
+# Raise ValueError if the dataset version is not supported
+def check_version(version):
+    if version not in config.DATASET_VERSIONS:
+        raise ValueError(f'Unknown dataset version: {version}. Available version(s): {", ".join(map(str, config.DATASET_VERSIONS))}')
+
+
+# Run a processing with the reference data, collect all (level, message) logged into the list yielded, and raise ProcessingError if the processing is halted
+# Values in log messages are not truncated, as they are not saved to colorlog.VALUES_FILE
+@contextlib.contextmanager
+def processing(reference):
+    # The processor logs to the log initialised by config.init(); without it, the log has no handler of its own, and records are only propagated to the root logger
+    if not hasattr(config, 'LOG'):
+        config.LOG = logging.getLogger("Validator")
+        config.LOG.setLevel(logging.DEBUG)
+
+    collector = MessageCollector()
+    config.LOG.addHandler(collector)
+    values_file, colorlog.VALUES_FILE = colorlog.VALUES_FILE, None
+    try:
+        with config.use_reference({**reference.files, **reference.data}):
+            yield collector.messages
+    except SystemExit:
+        raise ProcessingError(collector.messages) from None
+    finally:
+        colorlog.VALUES_FILE = values_file
+        config.LOG.removeHandler(collector)
@@ -1,6 +1,22 @@
 # Create log with colors and print to the console.
+# Records are passed through a queue and emitted by a background thread, so logging does not block the processing;
+# optionally, records are also saved to a JSON Lines file.
 
 import logging
+import logging.handlers
+import atexit
+import json
+import multiprocessing
+import queue
+
+
+# Maximum number of values included in a log message by join_values, the full list is saved to VALUES_FILE; all values are included if VALUES_FILE is None
+# The count of saved entries is a plain counter, until worker processes are used: it is then moved to a shared value (see 'get_worker_log_queue' and 'log_to_queue'),
+# so entries of all processes are numbered in one sequence in one file
+MAX_VALUES = 20
+VALUES_FILE = 'log_values.txt'
+SPILLED_VALUES = 0
+SHARED_SPILLED_VALUES = None
 
 
 def get_log():
@@ -10,11 +26,85 @@ def get_log():
     console = logging.StreamHandler()
     console.setLevel(logging.DEBUG)
     console.setFormatter(Color_Formatter())
-    
-    log.addHandler(console)
+
+    # The listener emits the queued records to the handlers in a background thread, and emits all remaining records on exit
+    global LOG_QUEUE, LISTENER
+    LOG_QUEUE = queue.Queue()
+    LISTENER = logging.handlers.QueueListener(LOG_QUEUE, console, respect_handler_level=True)
+    LISTENER.start()
+    atexit.register(LISTENER.stop)
+
+    log.addHandler(logging.handlers.QueueHandler(LOG_QUEUE))
     return log
 
 
+# Also save all log records to a JSON Lines file, one JSON object per record
+def add_json_sink(path):
+    json_file = logging.FileHandler(path, mode='w', encoding='utf-8')
+    json_file.setLevel(logging.DEBUG)
+    json_file.setFormatter(JSON_Formatter())
+    LISTENER.handlers = (*LISTENER.handlers, json_file)
+
+
+# Get a queue for worker processes to send their log records to (see 'log_to_queue'), and the started listener which emits the records to the handlers of the log
+# The count of saved value lists is moved to a shared value on first use, which should be passed to 'log_to_queue' of the worker processes as SHARED_SPILLED_VALUES
+def get_worker_log_queue():
+    global SHARED_SPILLED_VALUES
+    if SHARED_SPILLED_VALUES is None:
+        SHARED_SPILLED_VALUES = multiprocessing.Value('i', SPILLED_VALUES)
+
+    worker_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(worker_queue, *logging.getLogger("Validator").handlers)
+    listener.start()
+    return worker_queue, listener
+
+
+# In a worker process, send all log records to the queue of the main process instead, and number saved value lists with the shared count of the main process
+def log_to_queue(worker_queue, shared_spilled_values):
+    global SHARED_SPILLED_VALUES
+    SHARED_SPILLED_VALUES = shared_spilled_values
+
+    log = logging.getLogger("Validator")
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    log.addHandler(logging.handlers.QueueHandler(worker_queue))
+
+
+# Wait until all queued records are emitted, e.g. before prompting for input on the console
+def flush():
+    LOG_QUEUE.join()
+
+
+# Join values for a log message; if there are more than MAX_VALUES values, only the first MAX_VALUES are included with the count of the rest,
+# and the full list is saved as a numbered entry in VALUES_FILE (which is overwritten by the first entry of each run)
+def join_values(values):
+    values = list(values)
+    if len(values) <= MAX_VALUES or VALUES_FILE is None:
+        return ", ".join(values)
+
+    global SPILLED_VALUES
+    if SHARED_SPILLED_VALUES is None:
+        SPILLED_VALUES += 1
+        entry = SPILLED_VALUES
+        save_values(entry, values)
+    else:
+        # The lock of the shared count is held while writing, so entries of different processes are not interleaved
+        with SHARED_SPILLED_VALUES.get_lock():
+            SHARED_SPILLED_VALUES.value += 1
+            entry = SHARED_SPILLED_VALUES.value
+            save_values(entry, values)
+
+    return f'{", ".join(values[:MAX_VALUES])}, ... and {len(values) - MAX_VALUES} more (all {len(values)} value(s) are saved as entry {entry} in {VALUES_FILE})'
+
+
+# Save the full list of values as a numbered entry in VALUES_FILE, overwriting the file with the first entry
+def save_values(entry, values):
+    with open(VALUES_FILE, 'w' if entry == 1 else 'a') as f:
+        f.write(f'# Entry {entry}: {len(values)} value(s)\n')
+        f.write('\n'.join(values))
+        f.write('\n')
+
+
 class Color_Formatter(logging.Formatter):
     green = "\x1b[32;20m"
     grey = "\x1b[38;20m"
@@ -32,7 +122,16 @@ class Color_Formatter(logging.Formatter):
         logging.CRITICAL: bold_red + format + reset
     }
 
+    # Formatters of all levels are created once and reused for every record
+    FORMATTERS = {level: logging.Formatter(log_fmt) for level, log_fmt in FORMATS.items()}
+
+    def format(self, record):
+        formatter = self.FORMATTERS.get(record.levelno)
+        if formatter is None:
+            formatter = self.FORMATTERS[record.levelno] = logging.Formatter(self.FORMATS.get(record.levelno))
+        return formatter.format(record)
+
+
+class JSON_Formatter(logging.Formatter):
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
\ No newline at end of file
+        return json.dumps({'time': self.formatTime(record), 'level': record.levelname, 'message': record.getMessage()})
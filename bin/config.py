@@ -2,13 +2,27 @@
 
 
 
+import contextlib
 import csv
 import configparser
 import sys
 import os
 from collections import defaultdict
-import geopy
 import bin.colorlog as colorlog
+import bin.reference_cache as reference_cache
+import bin.startup_profile as startup_profile
+
+
+# geopy is only needed for fetching coordinates in --location mode
+geopy = startup_profile.lazy_import('geopy')
+
+
+# Versions of GPS datasets, each with its own table schemas in validation and column handling in Monocle table generation
+DATASET_VERSIONS = (1, 2)
+
+# Names of the global paths to reference files, and of the global reference data structures compiled from them
+REFERENCE_FILE_NAMES = ('COORDINATES_FILE', 'NON_STANDARD_AGES_FILE', 'MANIFESTATIONS_FILE', 'PUBLISHED_PUBLIC_NAMES_FILE', 'PCV_INTRO_YEARS_FILE', 'PCV_VALENCY_FILE', 'ALPHA2_COUNTY_FILE')
+REFERENCE_DATA_NAMES = ('COORDINATES', 'NON_STANDARD_AGES', 'MANIFESTATIONS', 'PUBLISHED_PUBLIC_NAMES', 'PCV_INTRO_YEARS', 'PCV_VALENCY', 'COUNTRY_ALPHA2', 'ALPHA2_COUNTRY', 'COUNTRY_CONTINENT')
 
 
 def init():
@@ -19,45 +33,96 @@ def init():
     # Get processor.py path
     base_path = os.path.abspath(os.path.dirname(sys.argv[0]))
 
-    # Path to coordinates file and store content as global dictionary COORDINATES
+    # Paths to reference files in the data directory
+    set_reference_files(f'{base_path}/data')
+
+    # Path to compiled reference data cache, and load all reference data from it (or from the files above if any of them has changed)
+    global REFERENCE_CACHE_FILE
+    REFERENCE_CACHE_FILE = f'{base_path}/.cache/reference_data.pickle'
+    load_reference_data()
+
+    # Path to output cache, the fingerprints and outputs of the processing stages when they were last run
+    global OUTPUT_CACHE_FILE
+    OUTPUT_CACHE_FILE = f'{base_path}/.cache/output_cache.json'
+
+
+    # Path to locally saved configuration file with api keys
+    global API_KEYS_FILE
+    API_KEYS_FILE = f'{base_path}/config/api_keys.conf'
+    
+
+
+# Provide global paths to the reference files in data_path
+def set_reference_files(data_path):
+    # Path to coordinates file, content is stored as global dictionary COORDINATES
     global COORDINATES_FILE
-    COORDINATES_FILE = f'{base_path}/data/coordinates.csv'
-    read_coordinates()
+    COORDINATES_FILE = f'{data_path}/coordinates.csv'
 
-    # Path to non-standard ages file and store content as global dictionary NON_STANDARD_AGES
+    # Path to non-standard ages file, content is stored as global dictionary NON_STANDARD_AGES
     global NON_STANDARD_AGES_FILE
-    NON_STANDARD_AGES_FILE = f'{base_path}/data/non_standard_ages.csv'
-    read_non_standard_ages()
+    NON_STANDARD_AGES_FILE = f'{data_path}/non_standard_ages.csv'
 
-    # Path to manifestations file and store content as global dictionary MANIFESTATIONS
+    # Path to manifestations file, content is stored as global dictionary MANIFESTATIONS
     global MANIFESTATIONS_FILE
-    MANIFESTATIONS_FILE = f'{base_path}/data/manifestations.csv'
-    read_manifestations()
+    MANIFESTATIONS_FILE = f'{data_path}/manifestations.csv'
 
-    # Path to published public names file and store content as global set PUBLISHED_PUBLIC_NAMES
+    # Path to published public names file, content is stored as global set PUBLISHED_PUBLIC_NAMES
     global PUBLISHED_PUBLIC_NAMES_FILE
-    PUBLISHED_PUBLIC_NAMES_FILE = f'{base_path}/data/published_public_names.txt'
-    read_published_public_names()
+    PUBLISHED_PUBLIC_NAMES_FILE = f'{data_path}/published_public_names.txt'
 
-    # Path to vaccines introduction year file and store content as global dictionary PCV_INTRO_YEARS
+    # Path to vaccines introduction year file, content is stored as global dictionary PCV_INTRO_YEARS
     global PCV_INTRO_YEARS_FILE
-    PCV_INTRO_YEARS_FILE = f'{base_path}/data/pcv_introduction_year.csv'
-    read_pcv_intro_years()
+    PCV_INTRO_YEARS_FILE = f'{data_path}/pcv_introduction_year.csv'
 
-    # Path to vaccines valency file and store content as global dictionary PCV_VALENCY
-    pcv_valency_file = f'{base_path}/data/pcv_valency.csv'
-    read_pcv_valency(pcv_valency_file)
+    # Path to vaccines valency file, content is stored as global dictionary PCV_VALENCY
+    global PCV_VALENCY_FILE
+    PCV_VALENCY_FILE = f'{data_path}/pcv_valency.csv'
 
-    # Path to ISO 3166-1 alpha-2 code of countries file and store content as global dictionary COUNTRY_ALPHA2 and ALPHA2_COUNTRY
+    # Path to ISO 3166-1 alpha-2 code of countries file, content is stored as global dictionary COUNTRY_ALPHA2, ALPHA2_COUNTRY and COUNTRY_CONTINENT
     global ALPHA2_COUNTY_FILE
-    ALPHA2_COUNTY_FILE = f'{base_path}/data/alpha2_country.csv'
-    read_country_alpha2()
+    ALPHA2_COUNTY_FILE = f'{data_path}/alpha2_country.csv'
 
 
-    # Path to locally saved configuration file with api keys
-    global API_KEYS_FILE
-    API_KEYS_FILE = f'{base_path}/config/api_keys.conf'
-    
+# Temporarily replace the global paths to reference files and reference data structures with those in reference (dictionary of global name: value),
+# and restore them when the with-block ends; the reference files and data can then be loaded and used without affecting those of the processor
+@contextlib.contextmanager
+def use_reference(reference):
+    saved = {name: globals()[name] for name in REFERENCE_FILE_NAMES + REFERENCE_DATA_NAMES if name in globals()}
+    globals().update(reference)
+    try:
+        yield
+    finally:
+        for name in REFERENCE_FILE_NAMES + REFERENCE_DATA_NAMES:
+            globals().pop(name, None)
+        globals().update(saved)
+
+
+# Provide all global reference data structures, loaded from the compiled reference data cache if none of the reference files has changed since it was compiled
+def load_reference_data():
+    with startup_profile.timed('reference', 'all reference data'):
+        globals().update(reference_cache.load(REFERENCE_CACHE_FILE, get_reference_files(), compile_reference_data))
+
+
+# Get paths of all reference files
+def get_reference_files():
+    return (COORDINATES_FILE, NON_STANDARD_AGES_FILE, MANIFESTATIONS_FILE, PUBLISHED_PUBLIC_NAMES_FILE, PCV_INTRO_YEARS_FILE, PCV_VALENCY_FILE, ALPHA2_COUNTY_FILE)
+
+
+# Parse all reference files, return the resulting global reference data structures for caching
+def compile_reference_data():
+    for reference_file, read_func in (
+        (COORDINATES_FILE, read_coordinates),
+        (NON_STANDARD_AGES_FILE, read_non_standard_ages),
+        (MANIFESTATIONS_FILE, read_manifestations),
+        (PUBLISHED_PUBLIC_NAMES_FILE, read_published_public_names),
+        (PCV_INTRO_YEARS_FILE, read_pcv_intro_years),
+        (PCV_VALENCY_FILE, lambda: read_pcv_valency(PCV_VALENCY_FILE)),
+        (ALPHA2_COUNTY_FILE, read_country_alpha2)
+    ):
+        with startup_profile.timed('reference', os.path.basename(reference_file)):
+            read_func()
+
+    return {name: globals()[name] for name in REFERENCE_DATA_NAMES}
 
 
 # Provide global dictionary for acessing pre-existing coordinates
@@ -156,6 +221,7 @@ def get_geocoder():
     api_keys.read(API_KEYS_FILE)
     if 'mapbox' not in api_keys:
         LOG.warning('Please provide Mapbox API key below for Latitude and Longitude auto-assignment (it will be saved locally for future use).')
+        colorlog.flush()
         mapbox_api_key = input("Enter your Mapbox API key here: ")
         api_keys['mapbox'] = {}
     else:
@@ -168,6 +234,7 @@ def get_geocoder():
             MAPBOX_GEOCODER.geocode('United Kingdom,Cambridgeshire,Cambridge')
         except geopy.exc.GeocoderAuthenticationFailure:
             LOG.warning('The provided Mapbox API key is not valid, please enter a valid Mapbox API Key.')
+            colorlog.flush()
             mapbox_api_key = input("Enter your Mapbox API key here: ")
             continue
         else:
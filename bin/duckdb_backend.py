@@ -0,0 +1,158 @@
+# This module provides the optional DuckDB execution backend.
+# With the 'duckdb' backend, the cross-table checks, uniqueness checks and No_of_genome counts of the validator run as multithreaded SQL over the dataframes already loaded in memory by the validator,
+# and only the Monocle join and filter run as SQL over views of the tables directly on disk, using multiple threads and spilling to disk when they do not fit in memory.
+# The results are identical to the default 'pandas' backend.
+
+
+import os
+import threading
+import bin.table_io as table_io
+import bin.startup_profile as startup_profile
+
+
+pd = startup_profile.lazy_import('pandas')
+np = startup_profile.lazy_import('numpy')
+
+
+BACKENDS = ('pandas', 'duckdb')
+BACKEND = 'pandas'
+
+# DuckDB connections by (process ID, thread ID); a connection is not shared with forked worker processes or other threads
+CONNECTIONS = {}
+
+
+# Select the backend for all subsequent processing; raise ImportError if the backend is not available
+def set_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend: {backend}. Available backend(s): {", ".join(BACKENDS)}')
+
+    if backend == 'duckdb':
+        import duckdb
+
+    global BACKEND
+    BACKEND = backend
+
+
+# Check whether the DuckDB backend is selected
+def is_enabled():
+    return BACKEND == 'duckdb'
+
+
+# Get the DuckDB connection of the current process and thread, created on first use
+def get_connection():
+    key = (os.getpid(), threading.get_ident())
+    if key not in CONNECTIONS:
+        import duckdb
+        CONNECTIONS[key] = duckdb.connect()
+    return CONNECTIONS[key]
+
+
+# Run a SQL query with the dataframes registered as views by their names, return all rows as a list of tuples
+def query(sql, **dfs):
+    connection = get_connection()
+    for name, df in dfs.items():
+        connection.register(name, df)
+    try:
+        return connection.execute(sql).fetchall()
+    finally:
+        for name in dfs:
+            connection.unregister(name)
+
+
+# Get the values of a column that appear more than once, in the order of their first appearance (as unique() of a pandas Series)
+def get_duplicated_values(df, column_name):
+    return [value for (value,) in query(f'SELECT {quote(column_name)} FROM (SELECT {quote(column_name)}, row_number() OVER () AS row_id FROM df) GROUP BY 1 HAVING count(*) > 1 ORDER BY min(row_id)', df=df)]
+
+
+# Get the extra occurrences of values of a column, i.e. each value repeated once for each time it appears after its first appearance (as duplicated() of a pandas Series)
+def get_extra_occurrences(df, column_name):
+    return [value for (value, count) in query(f'SELECT {quote(column_name)}, count(*) FROM df GROUP BY 1 HAVING count(*) > 1', df=df) for _ in range(count - 1)]
+
+
+# Get the number of rows of each Public_name, with the _R* suffix of repeats removed if repeats are counted towards their originals
+def get_public_name_counts(df, remove_repeat_suffix):
+    public_name = "regexp_replace(Public_name, '_R[1-9]$', '')" if remove_repeat_suffix else 'Public_name'
+    return dict(query(f'SELECT {public_name}, count(*) FROM df GROUP BY 1', df=df))
+
+
+# Get the distinct Lane_id(s) which have different Public_name(s) in table2 and table3
+def get_lane_ids_with_different_public_names(df_table2, df_table3):
+    return [lane_id for (lane_id,) in query('SELECT DISTINCT Lane_id FROM table2 JOIN table3 USING (Lane_id) WHERE table2.Public_name != table3.Public_name', table2=df_table2, table3=df_table3)]
+
+
+# Get the sets of Lane_id(s) that are in table3 but not table2, QC passed in table2 but not in table3, and QC failed in table2 but in table3
+def get_qc_and_insilico_mismatches(df_table2, df_table3):
+    sqls = (
+        'SELECT Lane_id FROM table3 EXCEPT SELECT Lane_id FROM table2',
+        "SELECT Lane_id FROM table2 WHERE QC = 'PASS' EXCEPT SELECT Lane_id FROM table3",
+        "SELECT Lane_id FROM table2 WHERE QC = 'FAIL' INTERSECT SELECT Lane_id FROM table3"
+    )
+    return tuple({lane_id for (lane_id,) in query(sql, table2=df_table2, table3=df_table3)} for sql in sqls)
+
+
+# Get the dataframe of a GPS dataset for Monocle table by joining views of table1-4 on disk, keeping only QC passed and UNIQUE samples that exist in all 4 tables
+# The tables are read with all values as strings and Pandas default NA values as NULL, then the result is returned with NaN in place of NULL, identical to the Pandas merges
+def get_monocle_dataset(table1, table2, table3, table4, drop_columns):
+    headers = {table: table_io.read_header(table) for table in (table1, table2, table3, table4)}
+
+    # Column names in SQL are case-insensitive, so a table with column names only differing in case is not supported
+    for table, header in headers.items():
+        if len({column.lower() for column in header}) != len(header):
+            raise ValueError(f'{table} has column names only differing in case, which is not supported by the duckdb backend')
+
+    headers = {table: [column for column in header if column not in drop_columns[table]] for table, header in headers.items()}
+
+    # Pandas merges suffix overlapping columns, which is not expected in the tables; such tables are not supported
+    columns = headers[table1] + [column for column in headers[table3] if column != 'Public_name'] + [column for column in headers[table2] if column != 'Lane_id'] + [column for column in headers[table4] if column != 'Public_name']
+    if len(set(columns)) != len(columns):
+        raise ValueError(f'Tables of {os.path.dirname(table1)} have overlapping columns, which are not supported by the duckdb backend')
+
+    connection = get_connection()
+    for name, table in (('table1', table1), ('table2', table2), ('table3', table3), ('table4', table4)):
+        # Rows are numbered in table1 to keep its row order, as the Pandas merges do
+        row_id = ', row_number() OVER () AS row_id' if name == 'table1' else ''
+        connection.execute(f'CREATE OR REPLACE TEMP VIEW {name} AS SELECT *{row_id} FROM {get_scan_sql(table)}')
+    connection.execute("CREATE OR REPLACE TEMP VIEW qc AS SELECT * FROM table2 WHERE QC IN ('PASS', 'PASSPLUS')")
+    connection.execute("CREATE OR REPLACE TEMP VIEW analysis AS SELECT * FROM table3 WHERE Duplicate = 'UNIQUE'")
+
+    # Merges with validate='one_to_one' raise MergeError if a merge key is not unique; as in Pandas, NULL keys are equal to each other, so more than one NULL key is not unique
+    for view, key in (('table1', 'Public_name'), ('analysis', 'Public_name'), ('analysis', 'Lane_id'), ('qc', 'Lane_id'), ('table4', 'Public_name')):
+        if connection.execute(f'SELECT count(*) != count(DISTINCT {key}) + (count(*) > count({key}))::INTEGER FROM {view}').fetchone()[0]:
+            raise pd.errors.MergeError(f'Merge keys are not unique in {key} of {view} view of {os.path.dirname(table1)}; not a one-to-one merge')
+
+    select = ', '.join(
+        [f'table1.{quote(column)}' for column in headers[table1]]
+        + [f'analysis.{quote(column)}' for column in headers[table3] if column != 'Public_name']
+        + [f'qc.{quote(column)}' for column in headers[table2] if column != 'Lane_id']
+        + [f'table4.{quote(column)}' for column in headers[table4] if column != 'Public_name']
+    )
+    # Pandas merges match NaN keys to each other, so keys are compared with IS NOT DISTINCT FROM instead of =, which never matches NULL
+    df = connection.execute(f'''
+        SELECT {select}
+        FROM table1
+        JOIN analysis ON table1.Public_name IS NOT DISTINCT FROM analysis.Public_name
+        JOIN qc ON analysis.Lane_id IS NOT DISTINCT FROM qc.Lane_id
+        JOIN table4 ON table1.Public_name IS NOT DISTINCT FROM table4.Public_name
+        ORDER BY table1.row_id
+    ''').df()
+
+    # Columns of different tables only differing in case (e.g. COT and Cot) are renamed in the result, use the names of the tables instead
+    df.columns = columns
+    return df.where(df.notna(), np.nan)
+
+
+# Get the SQL to scan a table on disk, with all values as strings and Pandas default NA values as NULL
+def get_scan_sql(path):
+    from pandas._libs.parsers import STR_NA_VALUES
+    null_values = ', '.join(f"'{escape(value)}'" for value in sorted(STR_NA_VALUES))
+    return f"read_csv('{escape(path)}', header=true, delim=',', quote='\"', escape='\"', all_varchar=true, nullstr=[{null_values}])"
+
+
+# Quote an identifier for SQL
+def quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+# Escape a string literal for SQL
+def escape(value):
+    return value.replace("'", "''")
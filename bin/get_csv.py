@@ -1,34 +1,76 @@
 # This module contains functions for generating various .csv and .txt.
 
 
-import pandas as pd
 import csv
 import os
 import sys
 import re
+from concurrent.futures import ThreadPoolExecutor
 import bin.config as config
+import bin.table_io as table_io
+import bin.table_cache as table_cache
+import bin.key_index as key_index
+import bin.startup_profile as startup_profile
+import bin.run_manifest as run_manifest
+import bin.colorlog as colorlog
+import bin.duckdb_backend as duckdb_backend
+import bin.polars_engine as polars_engine
 
 
-# Generate table4 based on data from table1
-def get_table4(path, location):
-    table1, table3, table4 = (os.path.join(path, table) for table in ("table1.csv", "table3.csv", "table4.csv"))
+pd = startup_profile.lazy_import('pandas')
+pl = startup_profile.lazy_import('polars')
 
-    config.LOG.info(f'Generating {table4} now...')
 
-    # Read table1 and table3 for inferring data in table4
-    df_meta, df_analysis = read_tables(table1, table3)
+# Columns in the schema of table4
+TABLE4_COLUMNS = ['Public_name', 'Latitude', 'Longitude', 'Resolution', 'Vaccine_period', 'Introduction_year', 'PCV_type', 'Manifestation', 'Less_than_5_years_old', 'PCV7', 'PCV10_GSK', 'PCV10_Pneumosil', 'PCV13', 'PCV15', 'PCV20', 'PCV21', 'PCV24', 'IVT25', 'Published', 'Continent']
 
-    # Create a partial table4 dataframe based on a subset of table1
-    df_table4_meta = df_meta[['Public_name', 'Country', 'Region', 'City', 'Year', 'Age_years', 'Age_months', 'Age_days', 'Clinical_manifestation', 'Source']].copy()
+# Columns of table1 that do not exist in Monocle table, by dataset version
+MONOCLE_DROP_COLUMNS_TABLE1 = {
+    1: ['Sequence_Type', 'aroE', 'ddl', 'gdh', 'gki', 'recP', 'spi', 'xpt'],
+    2: ['Sequence_Type', 'aroE', 'ddl', 'gdh', 'gki', 'recP', 'spi', 'xpt', 'Accession_number']
+}
+
+# Whether coordinates of new locations are fetched via MapBox API, and whether any is fetched in the current table4 generation
+LOCATION = False
+UPDATED_COORDINATES = False
+
+
+# Generate table4 based on data from table1; optionally compress table4 with the compression (see table_io.COMPRESSIONS)
+def get_table4(path, location, compression=None):
+    table1, table3 = (table_io.find_table(path, table) for table in ("table1.csv", "table3.csv"))
+    table4 = table_io.get_output_path(os.path.join(path, "table4.csv"), compression)
+
+    config.LOG.info(f'Generating {table4} now...')
 
     global UPDATED_COORDINATES
     UPDATED_COORDINATES = False
     global LOCATION
     LOCATION = location
-    df_table4_meta = df_table4_meta.apply(get_coordinate, axis=1)
+
+    if polars_engine.is_enabled():
+        df_table4, input_rows = get_table4_polars(table1, table3)
+    else:
+        df_table4, input_rows = get_table4_pandas(*read_tables(table1, table3))
+
     if UPDATED_COORDINATES:
         config.LOG.warning(f'Please verify the new coordinate(s). If any is incorrect, modify the coordinate in {config.COORDINATES_FILE} and re-run this tool.')
 
+    # Export table4
+    if polars_engine.is_enabled():
+        polars_engine.write_csv(df_table4, table4)
+    else:
+        table_io.write_csv(df_table4, table4)
+    table_io.remove_other_paths(table4)
+    run_manifest.add_rows(input_rows=input_rows, output_rows=len(df_table4))
+    config.LOG.info(f'{table4} is generated.')
+
+
+# Generate table4 dataframe with Pandas from the dataframes of table1 and table3, return it with the number of rows of table1 and table3
+def get_table4_pandas(df_meta, df_analysis):
+    # Create a partial table4 dataframe based on a subset of table1
+    df_table4_meta = df_meta[['Public_name', 'Country', 'Region', 'City', 'Year', 'Age_years', 'Age_months', 'Age_days', 'Clinical_manifestation', 'Source']].copy()
+
+    df_table4_meta = df_table4_meta.apply(get_coordinate, axis=1)
     df_table4_meta = df_table4_meta.apply(get_resolution, axis=1)
     df_table4_meta = df_table4_meta.apply(get_pcv_info, axis=1)
     df_table4_meta = df_table4_meta.apply(get_less_than_5_years_old, axis=1)
@@ -47,89 +89,232 @@ def get_table4(path, location):
     # Merge the partial table4 dataframes
     df_table4 = df_table4_meta.merge(df_table4_analysis, on='Public_name', how='outer', validate='one_to_one')
     
-    # Get the published status based on the values in 'Public_name' and the 'data/published_public_names.txt' reference list; All repeats (_R* suffix) are marked as published if the reference list does not state a specific repeat
-    published_public_names_with_repeats = config.PUBLISHED_PUBLIC_NAMES.copy()
-    published_public_names_with_repeats.update(f"{public_name}_R{i}" for public_name in config.PUBLISHED_PUBLIC_NAMES if not re.search(r'_R[1-9]$', public_name) for i in range(1, 10))
+    # Get the published status based on the values in 'Public_name' and the 'data/published_public_names.txt' reference list
     df_table4['Published'] = 'N'
-    df_table4.loc[df_table4['Public_name'].isin(published_public_names_with_repeats), 'Published'] = 'Y'
+    df_table4.loc[df_table4['Public_name'].isin(get_published_public_names_with_repeats()), 'Published'] = 'Y'
     
     # Replace all NA values with '_'
     df_table4.fillna('_', inplace=True)
 
     # Drop all columns that are not in the schema of table4
-    output_cols = ['Public_name', 'Latitude', 'Longitude', 'Resolution', 'Vaccine_period', 'Introduction_year', 'PCV_type', 'Manifestation', 'Less_than_5_years_old', 'PCV7', 'PCV10_GSK', 'PCV10_Pneumosil', 'PCV13', 'PCV15', 'PCV20', 'PCV21', 'PCV24', 'IVT25', 'Published', 'Continent']
-    df_table4.drop(columns=[col for col in df_table4 if col not in output_cols], inplace=True)
-    df_table4 = df_table4.reindex(columns = output_cols)
-    
-    # Export table4
-    df_table4.to_csv(table4, index=False)
-    config.LOG.info(f'{table4} is generated.')
+    df_table4.drop(columns=[col for col in df_table4 if col not in TABLE4_COLUMNS], inplace=True)
+    df_table4 = df_table4.reindex(columns = TABLE4_COLUMNS)
+
+    return df_table4, len(df_meta) + len(df_analysis)
+
+
+# Generate table4 dataframe with Polars lazy frames, return it with the number of rows read from table1 and table3
+# The row functions of the Pandas engine are applied once per unique combination of their input values, and the results are joined back to the rows
+def get_table4_polars(table1, table3):
+    lf_meta = polars_engine.scan_csv(table1).select(['Public_name', 'Country', 'Region', 'City', 'Year', 'Age_years', 'Age_months', 'Age_days', 'Clinical_manifestation', 'Source'])
+    lf_analysis = polars_engine.scan_csv(table3).select(['Public_name', 'In_silico_serotype', 'Duplicate'])
+    input_rows = lf_meta.select(pl.len()).collect().item() + lf_analysis.select(pl.len()).collect().item()
+
+    # Create a partial table4 lazy frame based on a subset of table1
+    lf_table4_meta = lf_meta
+    for keys, func, columns in (
+        (('Country', 'Region', 'City'), get_coordinate, ('Latitude', 'Longitude')),
+        (('Country', 'Region', 'City'), get_resolution, ('Resolution',)),
+        (('Country', 'Region', 'Year'), get_pcv_info, ('Vaccine_period', 'Introduction_year', 'PCV_type')),
+        (('Age_years', 'Age_months', 'Age_days'), get_less_than_5_years_old, ('Less_than_5_years_old',)),
+        (('Clinical_manifestation', 'Source'), get_manifestation, ('Manifestation',)),
+        (('Country',), get_continent, ('Continent',))
+    ):
+        lf_table4_meta = polars_engine.join_lookup(lf_table4_meta, polars_engine.get_lookup(lf_meta, keys, func, columns), keys)
+
+    # Create a partial table4 lazy frame based on a subset of table3
+    lf_analysis = lf_analysis.filter(pl.col('Duplicate') == 'UNIQUE')
+    lf_table4_analysis = polars_engine.join_lookup(lf_analysis, polars_engine.get_lookup(lf_analysis, ('In_silico_serotype',), get_vaccines_covered, tuple(config.PCV_VALENCY)), ('In_silico_serotype',))
+
+    # Full join the partial table4 lazy frames, with rows in the order of Pandas outer merge: all rows of table1, then rows only in table3
+    polars_engine.check_one_to_one(lf_meta, lf_analysis, 'Public_name')
+    lf_table4 = (
+        lf_table4_meta.with_row_index('meta_row')
+        .join(lf_table4_analysis.with_row_index('analysis_row'), on='Public_name', how='full', coalesce=True, nulls_equal=True)
+        .sort(['meta_row', 'analysis_row'], nulls_last=True)
+    )
+
+    # Get the published status based on the values in 'Public_name' and the 'data/published_public_names.txt' reference list
+    published = pl.col('Public_name').is_in(list(get_published_public_names_with_repeats())).fill_null(False)
+    lf_table4 = lf_table4.with_columns(pl.when(published).then(pl.lit('Y')).otherwise(pl.lit('N')).alias('Published'))
+
+    # Keep only the columns in the schema of table4 and replace all NA values with '_'; columns without values (e.g. a vaccine not in the reference table) are left empty
+    schema = lf_table4.collect_schema()
+    df_table4 = lf_table4.select([pl.col(column).fill_null('_') if column in schema else pl.lit(None, dtype=pl.String).alias(column) for column in TABLE4_COLUMNS]).collect()
+
+    return df_table4, input_rows
+
+
+# Get Public_name(s) in the 'data/published_public_names.txt' reference list; All repeats (_R* suffix) are included if the reference list does not state a specific repeat
+def get_published_public_names_with_repeats():
+    published_public_names_with_repeats = config.PUBLISHED_PUBLIC_NAMES.copy()
+    published_public_names_with_repeats.update(f"{public_name}_R{i}" for public_name in config.PUBLISHED_PUBLIC_NAMES if not re.search(r'_R[1-9]$', public_name) for i in range(1, 10))
+    return published_public_names_with_repeats
 
 
 # Generate Monocle table based on GPS1 and GPS2, and Published Public Name list
-def get_monocle(gps1, gps2):
+# Optionally provide datasets, a dictionary of GPS data directory path: its dataframe generated by get_monocle_dataset, to reuse datasets that have not changed
+# Optionally compress Monocle table with the compression (see table_io.COMPRESSIONS)
+def get_monocle(gps_provided, datasets=None, compression=None):
     config.LOG.info(f'Generating Monocle table now...')
 
-    dfs = []
+    # Ensure the same Public_name is not used in more than one GPS dataset
+    # Public_name(s) are looked up in the key indexes of the data directories instead of the tables
+    check_public_name_collisions([(gps_path, key_index.load_key_index(gps_path)) for (_, gps_path) in gps_provided])
+
+    # Generate dataframes of the GPS datasets concurrently, reuse the dataframes kept in datasets (if provided) and keep the newly generated ones in it
+    # Threads are used as the dataframes are kept in the main process; reading, joining and filtering the tables mostly run in Arrow, DuckDB or Polars without holding the GIL
+    pending = [(version, gps_path) for (version, gps_path) in gps_provided if datasets is None or gps_path not in datasets]
+    with ThreadPoolExecutor(max_workers=max(1, min(len(pending), os.cpu_count()))) as executor:
+        futures = {gps_path: executor.submit(get_monocle_dataset, version, gps_path) for (version, gps_path) in pending}
+        generated = {gps_path: future.result() for gps_path, future in futures.items()}
+    if datasets is not None:
+        datasets.update(generated)
+
+    dfs = [generated[gps_path] if gps_path in generated else datasets[gps_path] for (_, gps_path) in gps_provided]
+
+    monocle_csv = table_io.get_output_path('table_monocle.csv', compression)
+
+    if polars_engine.is_enabled():
+        return export_monocle_polars(dfs, monocle_csv)
+
+    df = get_monocle_table(dfs)
+    run_manifest.add_rows(input_rows=len(df))
+
+    # Export Monocle Table
+    table_io.write_csv(df, monocle_csv)
+    table_io.remove_other_paths(monocle_csv)
+    run_manifest.add_rows(output_rows=len(df))
+    config.LOG.info(f'{monocle_csv} is generated.')
+
+    # Save Published Public Name list to file
+    published_public_name_list = "published_public_names.txt"
+    config.LOG.info(f'Generating {published_public_name_list} now...')
+    get_published_public_names(df).to_csv(published_public_name_list, index=False, header=False)
+    config.LOG.info(f'{published_public_name_list} is generated.')
+
+    return df
 
-    # Ensure the same Public_name is not used in both GPS1 and GPS2
-    set_gps1_meta_public_name = set(read_tables(os.path.join(gps1, "table1.csv"))[0]["Public_name"])
-    set_gps2_meta_public_name = set(read_tables(os.path.join(gps2, "table1.csv"))[0]["Public_name"])
-    if (reused_public_name := set_gps1_meta_public_name.intersection(set_gps2_meta_public_name)):
-        config.LOG.error(f'The following Public_name(s) are used in both GPS1 and GPS2: {", ".join(sorted(reused_public_name))}.')
+
+# Ensure the same Public_name is not used in more than one GPS dataset, given the key indexes of the datasets as a list of (label, key index)
+def check_public_name_collisions(key_indexes):
+    if (collisions := key_index.find_collisions(key_indexes, 'table1.csv', 'Public_name')):
+        for (label_a, label_b), reused_public_name in collisions.items():
+            config.LOG.error(f'The following Public_name(s) are used in both {label_a} and {label_b}: {colorlog.join_values(reused_public_name)}.')
         config.LOG.error(f'The process will now be halted. Please correct the above error and re-run the processor.')
         sys.exit(1)
 
-    # Generate dataframes for GPS1 and GPS2
-    for version, gps_path in ((1, gps1), (2, gps2)):
-        table1, table2, table3, table4 = (os.path.join(gps_path, table) for table in ("table1.csv", "table2.csv", "table3.csv", "table4.csv")) 
-        df_meta, df_qc, df_analysis, df_table4 = read_tables(table1, table2, table3, table4)
-
-        # Only preserve QC Passed and UNIQUE for Monocle table
-        df_qc.drop(df_qc[~df_qc['QC'].isin(['PASS', 'PASSPLUS'])].index, inplace=True)
-        df_analysis.drop(df_analysis[df_analysis['Duplicate'] != 'UNIQUE'].index, inplace=True)
-
-        # Drop columns that do not exist in Monocle table, and fix differences between GPS1 and GPS2
-        df_meta.drop(columns=['Sequence_Type', 'aroE', 'ddl', 'gdh', 'gki', 'recP', 'spi', 'xpt'], inplace=True)
-        df_qc.drop(columns=['Public_name', 'Supplier_name'], inplace=True)
-        df_analysis.drop(columns=['No_of_genome', 'Duplicate'], inplace=True)
-
-        if version == 2:
-            df_meta.drop(columns=['Accession_number'], inplace=True)
-        
-        # Merge all 4 tables and only retain samples exist in all 4
-        df = df_meta.merge(df_analysis, how='inner', on='Public_name', validate='one_to_one')
-        df = df.merge(df_qc, how='inner', on='Lane_id', validate='one_to_one')
-        df = df.merge(df_table4, how='inner', on='Public_name', validate='one_to_one')
-        
-        dfs.append(df)
-
-    # Concat GPS1 and GPS2 Dataframe
+
+# Generate Monocle table with Pandas by concatenating the dataframes of the GPS datasets
+def get_monocle_table(dfs):
+    # Concat Dataframes of the GPS datasets
     df = pd.concat(dfs, ignore_index=True)
 
     # Remove Age_months and Age_days information from CDC data
     remove_age_months_days_information(df, ["CDC"])
-    
-    # Export Monocle Table
-    monocle_csv = 'table_monocle.csv'
+
     df.replace('_', '', inplace=True)
-    df.to_csv(monocle_csv, index=False)
+    return df
+
+
+# Get the sorted Public_name(s) of the published samples in Monocle table
+def get_published_public_names(df):
+    return df.loc[df["Published"] == "Y", "Public_name"].sort_values()
+
+
+# Export Monocle table to monocle_csv and Published Public Name list from the dataframes of the GPS datasets with Polars, return the Monocle table as Pandas dataframe
+# Dataframes joined by the duckdb backend are Pandas dataframes, and are converted to Polars
+def export_monocle_polars(dfs, monocle_csv):
+    # Concat Dataframes of the GPS datasets
+    df = pl.concat([df if isinstance(df, pl.DataFrame) else pl.from_pandas(df) for df in dfs], how='diagonal')
+    run_manifest.add_rows(input_rows=len(df))
+
+    # Remove Age_months and Age_days information from CDC data
+    df = remove_age_months_days_information_polars(df, ["CDC"])
+
+    # Export Monocle Table
+    df = df.with_columns(pl.when(pl.col(pl.String) == '_').then(pl.lit('')).otherwise(pl.col(pl.String)).name.keep())
+    polars_engine.write_csv(df, monocle_csv)
+    table_io.remove_other_paths(monocle_csv)
+    run_manifest.add_rows(output_rows=len(df))
     config.LOG.info(f'{monocle_csv} is generated.')
 
     # Save Published Public Name list to file
     published_public_name_list = "published_public_names.txt"
     config.LOG.info(f'Generating {published_public_name_list} now...')
-    df.loc[df["Published"] == "Y", "Public_name"].sort_values().to_csv(published_public_name_list, index=False, header=False)
+    df.filter(pl.col('Published') == 'Y').select(pl.col('Public_name').sort(nulls_last=True)).write_csv(published_public_name_list, include_header=False)
     config.LOG.info(f'{published_public_name_list} is generated.')
 
+    return polars_engine.to_pandas(df)
+
+
+# Generate the dataframe of a GPS dataset for Monocle table, containing QC passed and UNIQUE samples that exist in all 4 tables
+def get_monocle_dataset(version, gps_path):
+    table1, table2, table3, table4 = (table_io.find_table(gps_path, table) for table in ("table1.csv", "table2.csv", "table3.csv", "table4.csv"))
+
+    drop_columns = dict(zip((table1, table2, table3, table4), get_monocle_drop_columns(version)))
+
+    # Join and filter the tables on disk with SQL if the duckdb backend is selected, or with Polars lazy frames if the polars engine is selected
+    if duckdb_backend.is_enabled():
+        return duckdb_backend.get_monocle_dataset(table1, table2, table3, table4, drop_columns)
+    if polars_engine.is_enabled():
+        return get_monocle_dataset_polars(table1, table2, table3, table4, drop_columns)
+
+    return get_monocle_dataset_pandas(*read_tables(table1, table2, table3, table4), drop_columns.values())
+
+
+# Get the columns of table1-4 that do not exist in Monocle table, including the differences between dataset versions
+def get_monocle_drop_columns(version):
+    return (MONOCLE_DROP_COLUMNS_TABLE1[version], ['Public_name', 'Supplier_name'], ['No_of_genome', 'Duplicate'], [])
+
+
+# Generate the dataframe of a GPS dataset for Monocle table with Pandas from the dataframes of table1-4, dropping the columns in drop_columns (one list per table)
+def get_monocle_dataset_pandas(df_meta, df_qc, df_analysis, df_table4, drop_columns):
+    drop_columns_meta, drop_columns_qc, drop_columns_analysis, _ = drop_columns
+
+    # Only preserve QC Passed and UNIQUE for Monocle table
+    df_qc.drop(df_qc[~df_qc['QC'].isin(['PASS', 'PASSPLUS'])].index, inplace=True)
+    df_analysis.drop(df_analysis[df_analysis['Duplicate'] != 'UNIQUE'].index, inplace=True)
+
+    # Drop columns that do not exist in Monocle table
+    df_meta.drop(columns=drop_columns_meta, inplace=True)
+    df_qc.drop(columns=drop_columns_qc, inplace=True)
+    df_analysis.drop(columns=drop_columns_analysis, inplace=True)
+
+    # Merge all 4 tables and only retain samples exist in all 4
+    df = df_meta.merge(df_analysis, how='inner', on='Public_name', validate='one_to_one')
+    df = df.merge(df_qc, how='inner', on='Lane_id', validate='one_to_one')
+    df = df.merge(df_table4, how='inner', on='Public_name', validate='one_to_one')
+
     return df
 
 
+# Generate the Polars dataframe of a GPS dataset for Monocle table with lazy frames, the filters are pushed down to the scans of the tables
+def get_monocle_dataset_polars(table1, table2, table3, table4, drop_columns):
+    tables = (table1, table2, table3, table4)
+    lf_meta, lf_qc, lf_analysis, lf_table4 = (polars_engine.scan_csv(table) for table in tables)
+
+    # Only preserve QC Passed and UNIQUE for Monocle table
+    lf_qc = lf_qc.filter(pl.col('QC').is_in(['PASS', 'PASSPLUS']))
+    lf_analysis = lf_analysis.filter(pl.col('Duplicate') == 'UNIQUE')
+
+    # Drop columns that do not exist in Monocle table
+    lf_meta, lf_qc, lf_analysis, lf_table4 = (lf.drop(drop_columns[table]) for lf, table in zip((lf_meta, lf_qc, lf_analysis, lf_table4), tables))
+
+    # Merge all 4 tables and only retain samples exist in all 4, in the order of table1 as Pandas inner merges do
+    lf = lf_meta
+    for lf_other, key in ((lf_analysis, 'Public_name'), (lf_qc, 'Lane_id'), (lf_table4, 'Public_name')):
+        polars_engine.check_one_to_one(lf, lf_other, key)
+        lf = lf.join(lf_other, on=key, how='inner', nulls_equal=True, maintain_order='left')
+
+    return lf.collect()
+
+
 # Read the tables into Pandas dataframes for processing
 def read_tables(*arg):
     dfs = []
     for table in arg:
-        dfs.append(pd.read_csv(table, dtype=str))
+        dfs.append(table_cache.read_csv(table, keep_default_na=True))
     return dfs
 
 
@@ -238,6 +423,18 @@ def get_less_than_5_years_old(row):
     return row
 
 
+# Get the Manifestation based on the values in 'Clinical_manifestation', 'Source' and the 'data/manifestations.csv' reference table.
+def get_manifestation(row):
+    row['Manifestation'] = config.MANIFESTATIONS.get((row['Clinical_manifestation'], row['Source']))
+    return row
+
+
+# Get the Continent based on the value in 'Country'.
+def get_continent(row):
+    row['Continent'] = config.COUNTRY_CONTINENT.get(row['Country'], "_").upper()
+    return row
+
+
 # Get whether the in silico serotype of the row is targeted by each vaccine.
 def get_vaccines_covered(row):
     # For 6E(6*), capture content in bracket; 
@@ -258,3 +455,15 @@ def remove_age_months_days_information(df, institutes_list):
     for institute in institutes_list:
         df.loc[(df["Submitting_institution"] == institute) & (df["Age_years"] == "_") & ((df["Age_months"].str.isnumeric()) | (df["Age_days"].str.isnumeric())), "Age_years"] = "0"
         df.loc[(df["Submitting_institution"] == institute) & ((df["Age_months"].str.isnumeric()) | (df["Age_days"].str.isnumeric())), ["Age_months", "Age_days"]] = ["_", "_"]
+
+
+# Polars version of 'remove_age_months_days_information', return the updated dataframe
+def remove_age_months_days_information_polars(df, institutes_list):
+    for institute in institutes_list:
+        has_months_or_days = (pl.col("Age_months").str.contains(r'^\p{N}+$') | pl.col("Age_days").str.contains(r'^\p{N}+$')).fill_null(False)
+        is_institute = (pl.col("Submitting_institution") == institute).fill_null(False)
+        df = df.with_columns(
+            pl.when(is_institute & (pl.col("Age_years") == "_").fill_null(False) & has_months_or_days).then(pl.lit("0")).otherwise(pl.col("Age_years")).alias("Age_years"),
+            *(pl.when(is_institute & has_months_or_days).then(pl.lit("_")).otherwise(pl.col(column)).alias(column) for column in ("Age_months", "Age_days"))
+        )
+    return df
@@ -0,0 +1,111 @@
+# This module contains 'get_cube' function and its supporting functions.
+# 'get_cube' function takes the generated Monocle Table as input and generate a sparse count cube of the public data for the GPS Database Overview
+# Any slice or rollup of the count cube can be answered by 'rollup_cube' with array reductions, without reprocessing the Monocle Table
+
+
+import bin.config as config
+import bin.get_json as get_json
+import bin.startup_profile as startup_profile
+import bin.run_manifest as run_manifest
+
+
+pd = startup_profile.lazy_import('pandas')
+np = startup_profile.lazy_import('numpy')
+
+
+# Dimensions of the count cube and their source columns in the prepared Monocle Table
+CUBE_DIMENSIONS = {
+    'country': 'Country',
+    'year': 'Year',
+    'vaccine_period': 'Vaccine_period',
+    'manifestation': 'Manifestation',
+    'age': 'Age_bin',
+    'serotype': 'In_silico_serotype',
+    'gpsc': 'GPSC',
+    'continent': 'Continent'
+}
+
+# Columns of the Monocle Table needed to prepare the dimensions of the count cube
+CUBE_SOURCE_COLUMNS = ['Country', 'Region', 'Year', 'Vaccine_period', 'Manifestation', 'Age_years', 'Age_months', 'Age_days', 'In_silico_serotype', 'GPSC', 'Continent']
+
+
+# Generate count cube based on Monocle Table
+def get_cube(df):
+    # Only account for public data and the columns needed; selecting them makes a copy, as the Monocle Table is still needed by other outputs
+    df = df.loc[df['Published'] == 'Y', CUBE_SOURCE_COLUMNS].replace("", np.nan)
+
+    data_cube = "data_cube.npz"
+
+    config.LOG.info(f'Generating {data_cube} now...')
+
+    # Workaround for non-country level entry that has separated PCV programmes
+    for region in {'HONG KONG'}:
+        df.loc[df['Region'] == region, 'Country'] = region
+
+    # Prepare columns for groupby functions in the same way as the Data JSON
+    df = df.assign(Vaccine_period=df['Vaccine_period'].str.split('-').str[0], Age_bin=get_age_bin(get_simplified_age(df)))
+
+    # Count all dimensions in one grouped pass; only non-empty cells are kept, with each dimension stored as integer codes pointing to its sorted labels
+    cells = df.groupby(list(CUBE_DIMENSIONS.values()), dropna=False).size()
+    run_manifest.add_rows(input_rows=len(df), output_rows=len(cells))
+    output = {
+        'dimensions': np.array(list(CUBE_DIMENSIONS)),
+        'counts': cells.to_numpy(dtype=np.int64)
+    }
+    for level, dimension in enumerate(CUBE_DIMENSIONS):
+        codes, labels = pd.factorize(cells.index.get_level_values(level).fillna('NaN').astype(str), sort=True)
+        output[f'{dimension}_codes'] = codes.astype(np.int32)
+        output[f'{dimension}_labels'] = np.asarray(labels, dtype=str)
+
+    # Save count cube to file
+    np.savez_compressed(data_cube, **output)
+
+    config.LOG.info(f'{data_cube} is generated.')
+
+
+# Get the simplified age of each row as get_json.simplify_age does, computed on the whole age columns at once: NaN if the age is unknown or non-standard, 0 if under 1 year old, otherwise the whole years
+def get_simplified_age(df):
+    age_years = df['Age_years']
+    non_standard = age_years.isin(list(config.NON_STANDARD_AGES))
+    unknown = age_years.isna() & df['Age_months'].isna() & df['Age_days'].isna()
+    years = pd.to_numeric(age_years.where(~non_standard), errors='coerce')
+
+    simplified_age = np.select([unknown | non_standard, age_years.isna() | (years < 1)], [np.nan, 0], default=np.floor(years))
+    return pd.Series(simplified_age, index=df.index)
+
+
+# Get age bin labels in the format of the Data JSON, or NaN if the age cannot be determined
+def get_age_bin(simplified_age):
+    age_bin = pd.cut(simplified_age, bins=pd.IntervalIndex.from_tuples(get_json.AGE_BINS, closed='both'))
+    return age_bin.cat.rename_categories(get_json.interval_to_string).astype(object).fillna('NaN')
+
+
+# Roll up the count cube to the selected dimensions; optionally slice by keyword arguments of dimension=label or dimension=[labels]
+# Return a Pandas series of counts indexed by the labels of the selected dimensions (non-empty cells only), or the total count if no dimension is selected
+def rollup_cube(data_cube, dimensions=(), **filters):
+    with np.load(data_cube) as cube:
+        counts = cube['counts']
+
+        if (unknown := (set(dimensions) | set(filters)) - set(cube['dimensions'])):
+            raise KeyError(f'Unknown dimension(s) in count cube: {", ".join(sorted(unknown))}')
+
+        mask = np.ones(len(counts), dtype=bool)
+        for dimension, values in filters.items():
+            selected_codes = np.flatnonzero(np.isin(cube[f'{dimension}_labels'], np.atleast_1d(values).astype(str)))
+            mask &= np.isin(cube[f'{dimension}_codes'], selected_codes)
+
+        if not dimensions:
+            return int(counts[mask].sum())
+
+        labels = [cube[f'{dimension}_labels'] for dimension in dimensions]
+        flat_codes = np.ravel_multi_index([cube[f'{dimension}_codes'][mask] for dimension in dimensions], [len(label) for label in labels])
+        cell_codes, inverse = np.unique(flat_codes, return_inverse=True)
+        cell_counts = np.bincount(inverse, weights=counts[mask], minlength=len(cell_codes)).astype(np.int64)
+
+        index = pd.MultiIndex.from_arrays(
+            [label[codes] for label, codes in zip(labels, np.unravel_index(cell_codes, [len(label) for label in labels]))],
+            names=list(dimensions)
+        )
+        if index.nlevels == 1:
+            index = index.get_level_values(0)
+        return pd.Series(cell_counts, index=index, name='count')
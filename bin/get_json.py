@@ -2,10 +2,18 @@
 # 'get_data' function takes the generated Monocle Table as input and generate Data JSON for the GPS Database Overview
 
 
-import pandas as pd
-import numpy as np
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 import bin.config as config
+import bin.startup_profile as startup_profile
+import bin.run_manifest as run_manifest
+import bin.polars_engine as polars_engine
+
+
+pd = startup_profile.lazy_import('pandas')
+np = startup_profile.lazy_import('numpy')
+pl = startup_profile.lazy_import('polars')
 
 
 # Age bins 
@@ -24,16 +32,27 @@ MANIFESTATION_DICT = {
 
 
 # Generate Data JSON based on Monocle Table
-def get_data(df):
+# Optionally also save it as a summary index file and one shard file per country for lazy loading
+def get_data(df, shard=False):
+    data_json = "data.json"
+
+    config.LOG.info(f'Generating {data_json} now...')
+
+    if polars_engine.is_enabled():
+        output, input_rows = get_data_polars(df)
+    else:
+        output, input_rows = get_data_pandas(df)
+
+    save_data(output, data_json, input_rows, shard)
+
+
+# Generate Data JSON with Pandas, return it with the number of rows it is generated from; the Monocle Table dataframe is modified in-place
+def get_data_pandas(df):
     # Only account for public data 
     df.drop(df[df['Published'] != 'Y'].index, inplace=True)
 
     df.replace("", np.nan, inplace=True)
 
-    data_json = "data.json"
-
-    config.LOG.info(f'Generating {data_json} now...')
-
     # Scaffold of the Data JSON
     output = {
         'summary': {
@@ -104,12 +123,146 @@ def get_data(df):
             # Generate manifestation sizes per year in country part of Data JSON
             output['country'][alpha2]['manifestation'][year] = get_manifestation(df_country_year)
 
-    # Save Data JSON to file
+    return output, len(df)
+
+
+# Generate Data JSON based on Monocle Table with Polars
+# The rows are filtered, prepared and counted per group with lazy frames, then the small aggregated counts are ordered and assembled as 'get_data_pandas' does
+def get_data_polars(df):
+    lf = pl.from_pandas(df).lazy()
+
+    # Only account for public data 
+    lf = lf.filter(pl.col('Published') == 'Y')
+
+    lf = lf.with_columns(pl.when(pl.col(pl.String) == '').then(None).otherwise(pl.col(pl.String)).name.keep())
+
+    # Scaffold of the Data JSON
+    output = {
+        'summary': {
+            'country': {},
+            'vaccine_period': {},
+            'manifestation': {},
+            'year_of_collection': {},
+            'age': {}
+        },
+        'country': {},
+    }
+
+    # Workaround for non-country level entry that has separated PCV programmes
+    for region in {'HONG KONG'}:
+        lf = lf.with_columns(pl.when(pl.col('Region') == region).then(pl.lit(region)).otherwise(pl.col('Country')).alias('Country'))
+
+    # Prepare columns for group_by functions; age group is determined once per unique combination of ages
+    lf = lf.with_columns(pl.col('Vaccine_period').str.split('-').list.first())
+    age_keys = ('Age_years', 'Age_months', 'Age_days')
+    lf = polars_engine.join_lookup(lf, polars_engine.get_lookup(lf, age_keys, get_age_group, ('Age_group',)), age_keys)
+    df = lf.select(['Country', 'Vaccine_period', 'Manifestation', 'Year', 'Age_group']).collect()
+
+    # Generate summary part of Data JSON
+    # Sort country, vaccine period, manifestation in descending order by values
+    # Sort year of collection, age in ascending order by index with NaN at the first position
+    output_summary_country = polars_engine.get_group_sizes(df, 'Country').sort_values(ascending=False).to_dict()
+    output['summary']['country'] = {get_summary_country_name(country): val for country, val in output_summary_country.items()}
+    output_summary_vaccine_period = polars_engine.get_group_sizes(df, 'Vaccine_period').sort_values(ascending=False).to_dict()
+    output['summary']['vaccine_period'] = {get_summary_vaccine_period_name(period): val for period, val in output_summary_vaccine_period.items()}
+    output_summary_manifestation = polars_engine.get_group_sizes(df, 'Manifestation').sort_values(ascending=False).to_dict()
+    output['summary']['manifestation'] = {MANIFESTATION_DICT.get(manifestation, manifestation): val for manifestation, val in output_summary_manifestation.items()}
+    output['summary']['year_of_collection'] = polars_engine.get_group_sizes(df, 'Year').sort_index(key=lambda x: x.astype('Int64'), na_position='first').to_dict()
+    output['summary']['age'] = get_age_group_size_from_counts(dict(df.group_by('Age_group').len().iter_rows()))
+
+    # Count rows per country, year, and age group or manifestation in one pass each
+    country_totals = dict(df.group_by('Country').len().iter_rows())
+    country_year_age_counts, country_year_manifestation_counts = {}, {}
+    for counts, column in ((country_year_age_counts, 'Age_group'), (country_year_manifestation_counts, 'Manifestation')):
+        for country, year, value, count in df.group_by(['Country', 'Year', column]).len().iter_rows():
+            counts.setdefault((country, year), {})[value] = count
+    country_years = {}
+    for country, year in country_year_age_counts:
+        country_years.setdefault(country, []).append(np.nan if year is None else year)
+
+    # Go through country by country to generate per-country part of Data JSON
+    countries = sorted(country for country in country_totals if country is not None)
+    for country in countries:
+        # Skip non-country entity (e.g. West Africa)
+        try:
+            alpha2 = config.COUNTRY_ALPHA2[country]
+        except KeyError:
+            continue
+
+        output['country'][alpha2] = {'total': country_totals[country], 'age': {}, 'manifestation': {}, 'vaccine_period': {}}
+
+        # Get all years within sample year range of that country
+        # years_min and years_max would be None if there is 0 non-NaN year
+        year_range, years_min, years_max = get_year_range(pd.Series(country_years[country], dtype=object))
+
+        # Get vaccine periods in country part of Data JSON if there is at least one non-NaN year
+        if not None in (years_min, years_max):
+            output['country'][alpha2]['vaccine_period'] = get_vaccine_periods(years_min, years_max, country)
+
+        # Go through year by year
+        for year in year_range:
+            # Get the key of the counts depending on year is NaN or numeric value
+            if pd.isna(year):
+                year_key = None
+                # Change to "NaN" string to allow hashing as dictionary key
+                year = 'NaN'
+            else:
+                year_key = year
+
+            # Get age group sizes per year in country part of Data JSON
+            output['country'][alpha2]['age'][year] = get_age_group_size_from_counts(country_year_age_counts.get((country, year_key), {}))
+
+            # Generate manifestation sizes per year in country part of Data JSON
+            output['country'][alpha2]['manifestation'][year] = {val: country_year_manifestation_counts.get((country, year_key), {}).get(key, 0) for key, val in MANIFESTATION_DICT.items()}
+
+    return output, len(df)
+
+
+# Save Data JSON to file, and optionally as shards
+def save_data(output, data_json, input_rows, shard):
     with open(data_json, 'w') as f:
         json.dump(output, f, indent=4)
+    run_manifest.add_rows(input_rows=input_rows, output_rows=len(output['country']))
     
     config.LOG.info(f'{data_json} is generated.')
 
+    if shard:
+        save_data_shards(output)
+
+
+# Save Data JSON as a summary index file and one shard file per country (named by ISO 3166-1 alpha-2 code), the files are written in parallel
+def save_data_shards(output):
+    data_shards = "data_shards"
+
+    config.LOG.info(f'Generating sharded Data JSON in {data_shards} now...')
+
+    os.makedirs(data_shards, exist_ok=True)
+
+    # Remove shards of countries no longer in the Data JSON
+    for file in os.listdir(data_shards):
+        if file.endswith('.json') and file != 'index.json' and file.removesuffix('.json') not in output['country']:
+            os.remove(os.path.join(data_shards, file))
+
+    # The index contains the summary part of Data JSON and the total and shard file name of each country
+    index = {
+        'summary': output['summary'],
+        'country': {alpha2: {'total': country_data['total'], 'file': f'{alpha2}.json'} for alpha2, country_data in output['country'].items()}
+    }
+
+    jobs = [(os.path.join(data_shards, 'index.json'), index)]
+    jobs.extend((os.path.join(data_shards, f'{alpha2}.json'), country_data) for alpha2, country_data in output['country'].items())
+    with ThreadPoolExecutor() as executor:
+        # Consume the results to raise any exception from the workers
+        list(executor.map(lambda job: save_json(*job), jobs))
+
+    config.LOG.info(f'Sharded Data JSON in {data_shards} is generated.')
+
+
+# Save a JSON-serialisable object to file
+def save_json(path, obj):
+    with open(path, 'w') as f:
+        json.dump(obj, f, indent=4)
+
 
 # Simplify age to a integer value based on year, or NaN if the precise age year cannot be determined
 def simplify_age(row):
@@ -182,6 +335,30 @@ def get_age_group_size(df):
     
     return age_group_size
 
+# Get the age group (as the string of its age bin) of the row, or None if the age cannot be simplified
+def get_age_group(row):
+    simplified_age = simplify_age(row)['Simplified_age']
+    row['Age_group'] = None
+    if not pd.isna(simplified_age):
+        for left, right in AGE_BINS:
+            if left <= simplified_age <= right:
+                row['Age_group'] = interval_to_string(pd.Interval(left, right, closed='both'))
+                break
+    return row
+
+
+# Get size of binned age group from the counts of age groups (None for unknown age), in the same order as get_age_group_size()
+def get_age_group_size_from_counts(age_group_counts):
+    age_group_size = {}
+    for left, right in AGE_BINS:
+        age_group = interval_to_string(pd.Interval(left, right, closed='both'))
+        age_group_size[age_group] = age_group_counts.get(age_group, 0)
+
+    # Add back count of unknown age
+    age_group_size["NaN"] = age_group_counts.get(None, 0)
+    return age_group_size
+
+
 # Convert interval index into string for get_age_group_size()
 def interval_to_string(interval):
     if interval.left == interval.right:
@@ -0,0 +1,164 @@
+# This module maintains the key index of a GPS data directory.
+# The key index file is saved next to table1, table2 and table3, and contains the sorted unique Lane_id and Public_name values of the tables,
+# so existence and collision checks of keys can run in O(log n) without parsing the tables.
+# Each entry is stamped with the mtime and size of its source table, and stale entries are rebuilt from the table on load; the key index file is written atomically, and rebuilt if it is unreadable.
+
+
+import itertools
+import json
+import os
+import zipfile
+from collections import defaultdict
+import bin.table_io as table_io
+import bin.startup_profile as startup_profile
+
+
+np = startup_profile.lazy_import('numpy')
+pd = startup_profile.lazy_import('pandas')
+
+
+KEY_INDEX_FILE = 'key_index.npz'
+KEY_INDEX_VERSION = 2
+
+# Key columns to be indexed in each table
+KEY_COLUMNS = {
+    'table1.csv': ['Public_name'],
+    'table2.csv': ['Lane_id', 'Public_name'],
+    'table3.csv': ['Lane_id', 'Public_name']
+}
+
+# Number of hash partitions of the keys in collision checks across data directories
+COLLISION_PARTITIONS = 16
+
+
+# Load the key index of a GPS data directory as a dictionary of (table, column): sorted unique keys
+# Entries of tables modified since they were indexed are rebuilt by reading their key columns only, and the key index file is updated
+def load_key_index(path):
+    metadata, key_index = read_key_index_file(path)
+
+    updated = False
+    for table, columns in KEY_COLUMNS.items():
+        table_path = table_io.find_table(path, table)
+        if not os.path.isfile(table_path):
+            continue
+
+        if is_fresh(metadata.get(table), table_path, key_index, table, columns):
+            continue
+
+        df = table_io.read_csv(table_path, columns=columns)
+        index_table(metadata, key_index, table, table_path, df)
+        updated = True
+
+    if updated:
+        write_key_index_file(path, metadata, key_index)
+
+    return key_index
+
+
+# Update the key index of a GPS data directory after tables are written, from the dataframes of the tables in memory (dictionary of table file name: dataframe)
+# If append is True, the dataframes only contain the rows appended to the tables, and their keys are merged into the existing entries;
+# the key index must have been loaded before the append to ensure the existing entries match the tables before the append
+def update_key_index(path, dfs, append=False):
+    metadata, key_index = read_key_index_file(path)
+
+    for table, df in dfs.items():
+        if table not in KEY_COLUMNS:
+            continue
+
+        columns = KEY_COLUMNS[table]
+        table_path = table_io.find_table(path, table)
+
+        if append:
+            if table in metadata and all((table, column) in key_index for column in columns):
+                df = {column: np.concatenate([key_index[(table, column)], np.asarray(df[column], dtype=str)]) for column in columns}
+            else:
+                # No existing entry to merge into, index the whole table instead
+                df = table_io.read_csv(table_path, columns=columns)
+
+        index_table(metadata, key_index, table, table_path, df)
+
+    write_key_index_file(path, metadata, key_index)
+
+
+# Get the values that already exist in the selected column of a table; each value is looked up by binary search
+def find_existing(key_index, table, column, values):
+    keys = key_index.get((table, column), np.array([], dtype=str))
+    values = np.asarray(list(values), dtype=str)
+    if len(keys) == 0 or len(values) == 0:
+        return set()
+
+    positions = np.searchsorted(keys, values)
+    found = keys[np.minimum(positions, len(keys) - 1)] == values
+    return set(values[found].tolist())
+
+
+# Get the values in the selected column of a table that exist in more than one of the key indexes (list of (label, key index))
+# Return a dictionary of (label, label): sorted shared values, for every pair of key indexes sharing values, in the order of the key indexes
+# Keys are hash-partitioned, and each partition is checked across all key indexes in one sorted pass, instead of intersecting each pair of key indexes
+def find_collisions(key_indexes, table, column, partitions=COLLISION_PARTITIONS):
+    labels = [label for label, _ in key_indexes]
+    all_keys = [key_index.get((table, column), np.array([], dtype=str)) for _, key_index in key_indexes]
+    all_partition_ids = [pd.util.hash_array(keys.astype(object)) % partitions for keys in all_keys]
+
+    collisions = defaultdict(list)
+    for partition in range(partitions):
+        partition_keys = [keys[partition_ids == partition] for keys, partition_ids in zip(all_keys, all_partition_ids)]
+        keys = np.concatenate(partition_keys)
+        owners = np.concatenate([np.full(len(keys_part), i) for i, keys_part in enumerate(partition_keys)])
+
+        # Keys are unique within each key index, so a key existing in multiple key indexes is a run of equal keys after a stable sort, with its owners in order
+        order = np.argsort(keys, kind='stable')
+        keys, owners = keys[order], owners[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        ends = np.r_[starts[1:], len(keys)]
+        for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            for a, b in itertools.combinations(owners[start:end].tolist(), 2):
+                collisions[(a, b)].append(str(keys[start]))
+
+    return {(labels[a], labels[b]): sorted(collisions[(a, b)]) for (a, b) in sorted(collisions)}
+
+
+# Index the key columns of a table, stamping the entry with the current mtime and size of the table
+def index_table(metadata, key_index, table, table_path, df):
+    stat = os.stat(table_path)
+    metadata[table] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+    for column in KEY_COLUMNS[table]:
+        key_index[(table, column)] = np.unique(np.asarray(df[column], dtype=str))
+
+
+# Check whether the entry of a table matches the table on disk by its stamp, and has all key columns; the keys are trusted without being re-hashed
+def is_fresh(table_metadata, table_path, key_index, table, columns):
+    if table_metadata is None:
+        return False
+
+    stat = os.stat(table_path)
+    if (table_metadata['mtime_ns'], table_metadata['size']) != (stat.st_mtime_ns, stat.st_size):
+        return False
+
+    return all((table, column) in key_index for column in columns)
+
+
+# Read the key index file, return empty metadata and key index if the file does not exist, is unreadable or of another version
+def read_key_index_file(path):
+    try:
+        with np.load(os.path.join(path, KEY_INDEX_FILE)) as f:
+            metadata = json.loads(str(f['metadata']))
+            if metadata.get('version') != KEY_INDEX_VERSION:
+                raise ValueError
+            key_index = {tuple(name.split(':', 1)): f[name] for name in f.files if name != 'metadata'}
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return {}, {}
+
+    return metadata['tables'], key_index
+
+
+# Write the key index file atomically, so an interrupted write does not leave a corrupted key index
+def write_key_index_file(path, metadata, key_index):
+    key_index_file = os.path.join(path, KEY_INDEX_FILE)
+    temp_file = f'{key_index_file}.tmp.npz'
+
+    arrays = {f'{table}:{column}': keys for (table, column), keys in key_index.items()}
+    arrays['metadata'] = np.array(json.dumps({'version': KEY_INDEX_VERSION, 'tables': metadata}))
+    np.savez(temp_file, **arrays)
+    os.replace(temp_file, key_index_file)
@@ -0,0 +1,111 @@
+# This module provides a content-addressed cache of the outputs generated by the processing stages.
+# Each stage is fingerprinted by the content hash of its input files, the reference files, the code of the processor and its arguments;
+# the fingerprint and the content hash of each output file are recorded after the stage is run,
+# so the stage can be skipped in later runs while its fingerprint is unchanged and its outputs are not modified.
+# Records are kept per stage and absolute paths of its outputs, so runs from different working directories do not replace each other's records.
+
+
+import glob
+import hashlib
+import json
+import os
+import bin.config as config
+
+
+CACHE_VERSION = 2
+
+# Types of stage arguments included in the fingerprint; other arguments (e.g. dataframes kept in memory for reuse) do not change the outputs
+FINGERPRINT_ARG_TYPES = (str, int, float, bool, type(None), tuple)
+
+# Content hash of the code of the processor, only calculated once per process
+CODE_HASH = None
+
+
+# Load the cache records of the stages, or an empty cache if the cache file is missing or unreadable
+def load(cache_file):
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+        if cache['version'] == CACHE_VERSION:
+            return cache['stages']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return {}
+
+
+# Save the cache records of the stages atomically; the cache is an optimisation only, so failure to save is ignored
+def save(cache_file, records):
+    temp_file = f'{cache_file}.tmp'
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(temp_file, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'stages': records}, f, indent=4)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass
+
+
+# Get the fingerprint of a stage from its inputs and the absolute paths of its outputs (which are relative to the working directory, so a run from another directory does not match);
+# the results of other stages in args should be replaced by the fingerprints of those stages
+def get_fingerprint(key, args, inputs, outputs):
+    fingerprint = {
+        'version': CACHE_VERSION,
+        'code': get_code_hash(),
+        'stage': key,
+        'args': [repr(arg) for arg in args if isinstance(arg, FINGERPRINT_ARG_TYPES)],
+        'inputs': {os.path.abspath(input_file): get_hash(input_file) for input_file in sorted(inputs)},
+        'outputs': sorted(os.path.abspath(output) for output in outputs),
+        'references': {os.path.abspath(reference_file): get_hash(reference_file) for reference_file in config.get_reference_files()}
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+# Get the key of the record of a stage: the stage key and the absolute paths of its outputs
+def get_record_key(key, outputs):
+    return json.dumps([key, sorted(os.path.abspath(output) for output in outputs)])
+
+
+# Get the record of a stage after it is run: its fingerprint and the content hash of each of its outputs
+def get_record(fingerprint, outputs):
+    return {'fingerprint': fingerprint, 'outputs': {os.path.abspath(output): get_hash(output) for output in sorted(outputs)}}
+
+
+# Check whether the record of a stage matches its fingerprint, and all its outputs still exist unmodified
+def is_fresh(record, fingerprint, outputs):
+    if record is None or record['fingerprint'] != fingerprint or set(record['outputs']) != {os.path.abspath(output) for output in outputs}:
+        return False
+    return all(output_hash is not None and get_hash(output) == output_hash for output, output_hash in record['outputs'].items())
+
+
+# Get the content hash of all Python source files of the processor
+def get_code_hash():
+    global CODE_HASH
+    if CODE_HASH is None:
+        base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code_hash = hashlib.sha256()
+        for source_file in [os.path.join(base_path, 'processor.py')] + sorted(glob.glob(os.path.join(base_path, 'bin', '*.py'))):
+            code_hash.update(os.path.basename(source_file).encode())
+            with open(source_file, 'rb') as f:
+                code_hash.update(f.read())
+        CODE_HASH = code_hash.hexdigest()
+    return CODE_HASH
+
+
+# Get the SHA-256 hash of a file, or of the relative paths and contents of all files in a directory; None if it does not exist
+def get_hash(path):
+    if os.path.isdir(path):
+        dir_hash = hashlib.sha256()
+        for file_path in sorted(glob.glob(os.path.join(path, '**', '*'), recursive=True)):
+            if os.path.isfile(file_path):
+                dir_hash.update(os.path.relpath(file_path, path).encode())
+                dir_hash.update(get_hash(file_path).encode())
+        return dir_hash.hexdigest()
+
+    try:
+        file_hash = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,97 @@
+# This module provides the optional Polars engine and its shared helpers.
+# With the 'polars' engine, table4, Monocle table and Data JSON are generated on Polars lazy frames,
+# so filters, projections and joins are optimised and run across all cores; the outputs are identical to the default 'pandas' engine.
+
+
+import bin.table_io as table_io
+import bin.startup_profile as startup_profile
+
+
+pd = startup_profile.lazy_import('pandas')
+np = startup_profile.lazy_import('numpy')
+pl = startup_profile.lazy_import('polars')
+
+
+ENGINES = ('pandas', 'polars')
+ENGINE = 'pandas'
+
+
+# Select the engine for generating table4, Monocle table and Data JSON; raise ImportError if the engine is not available
+def set_engine(engine):
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown frame engine: {engine}. Available engine(s): {", ".join(ENGINES)}')
+
+    if engine == 'polars':
+        import polars
+        # Polars DataFrames are converted to and from Pandas via Arrow
+        import pyarrow
+
+    global ENGINE
+    ENGINE = engine
+
+
+# Check whether the Polars engine is selected
+def is_enabled():
+    return ENGINE == 'polars'
+
+
+# Scan a table lazily with all values as strings and Pandas default NA values as null, as table_io.read_csv(path, keep_default_na=True) does
+def scan_csv(path):
+    from pandas._libs.parsers import STR_NA_VALUES
+    return pl.scan_csv(path, infer_schema=False, null_values=sorted(STR_NA_VALUES))
+
+
+# Get a lookup table of the columns computed by func for each unique combination of values in the key columns of lf, computed in the order of their first appearance
+# func takes and returns a row as a dictionary (with NaN in place of null), so the row functions applied to Pandas dataframes can be reused while being called only once per combination
+def get_lookup(lf, keys, func, columns):
+    df_keys = lf.select(list(keys)).unique(maintain_order=True).collect()
+
+    lookup = {column: [] for column in (*keys, *columns)}
+    for values in df_keys.iter_rows():
+        row = func({key: np.nan if value is None else value for key, value in zip(keys, values)})
+        for key, value in zip(keys, values):
+            lookup[key].append(value)
+        for column in columns:
+            lookup[column].append(to_string(row[column]))
+
+    return pl.DataFrame(lookup, schema={column: pl.String for column in lookup}).lazy()
+
+
+# Add the columns of a lookup table to the rows of lf with the same values in the key columns, keeping the order of the rows
+def join_lookup(lf, lf_lookup, keys):
+    return lf.join(lf_lookup, on=list(keys), how='left', nulls_equal=True, maintain_order='left')
+
+
+# Convert a value to string as it is written to CSV by Pandas, or None if it is NA
+def to_string(value):
+    return None if pd.isna(value) else str(value)
+
+
+# Check for a one-to-one join that the keys are unique on both sides, raise MergeError as Pandas merge with validate='one_to_one' does
+def check_one_to_one(lf_left, lf_right, key):
+    for side, lf in (('left', lf_left), ('right', lf_right)):
+        if lf.select(pl.col(key).is_duplicated().any()).collect().item():
+            raise pd.errors.MergeError(f'Merge keys are not unique in {side} dataset; not a one-to-one merge')
+
+
+# Write a table without index as Pandas does; Polars quotes empty strings to tell them apart from null, while Pandas writes both as empty fields
+# Compressed tables (e.g. table4.csv.gz) are written to a compressed stream
+def write_csv(df, path):
+    df = df.with_columns(pl.when(pl.col(pl.String) != '').then(pl.col(pl.String)).name.keep())
+    if table_io.get_compression(path) is None:
+        df.write_csv(path)
+    else:
+        with table_io.open_table(path, 'wb') as f:
+            df.write_csv(f)
+
+
+# Convert a Polars DataFrame to Pandas with NaN in place of null, as in dataframes read by table_io.read_csv(path, keep_default_na=True)
+def to_pandas(df):
+    df = df.to_pandas()
+    return df.where(df.notna(), np.nan)
+
+
+# Get the number of rows of each value (including null as NaN) in a column, in the order of Pandas groupby(column, dropna=False).size()
+def get_group_sizes(df, column):
+    sizes = {np.nan if value is None else value: size for value, size in df.group_by(column).len().iter_rows()}
+    return pd.Series(sizes, dtype='int64').sort_index(na_position='last')
@@ -0,0 +1,182 @@
+# This module provides the local HTTP query service over the Monocle table.
+# The Monocle table is loaded once and indexed in memory by its key columns, so filter, count and lookup queries are answered without re-reading the table;
+# the table is polled for changes, and a new index is built in the background and swapped in when the processor has generated a new Monocle table.
+# The Monocle table may be compressed (e.g. table_monocle.csv.gz), as generated by the processor with --compress.
+
+
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bin.config as config
+import bin.table_io as table_io
+import bin.watch as watch
+import bin.startup_profile as startup_profile
+
+
+np = startup_profile.lazy_import('numpy')
+
+
+MONOCLE_FILE = 'table_monocle.csv'
+
+# Columns indexed for filtering and lookup
+INDEX_COLUMNS = ('Public_name', 'Lane_id', 'Country', 'Year', 'In_silico_serotype', 'GPSC')
+
+# Maximum number of rows returned by a query, unless a lower limit is requested
+MAX_ROWS = 1000
+
+# Index of the current Monocle table; replaced as a whole on reload, so a query always uses one consistent index
+INDEX = None
+
+
+# Monocle table with the row positions of each value of the indexed columns
+class MonocleIndex:
+    def __init__(self, path):
+        self.path = path
+        self.signature = watch.get_signature(path)
+        self.df = table_io.read_csv(path)
+        self.loaded = time.strftime('%Y-%m-%dT%H:%M:%S')
+        # Row positions of each value are sorted, so filters on multiple columns are intersected as sorted arrays
+        self.positions = {column: self.df.groupby(column, sort=False).indices for column in INDEX_COLUMNS if column in self.df}
+
+
+# Start the query service on localhost:port in background threads, serving the Monocle table in the working directory and reloading it when it changes (polled every interval seconds)
+def start(port, interval):
+    global INDEX
+    if os.path.isfile(path := table_io.find_table('', MONOCLE_FILE)):
+        INDEX = MonocleIndex(path)
+        config.LOG.info(f'{path} is loaded into the query service with {len(INDEX.df)} row(s).')
+    else:
+        config.LOG.warning(f'{MONOCLE_FILE} is not found in the working directory, the query service will load it once it is generated.')
+
+    try:
+        server = ThreadingHTTPServer(('127.0.0.1', port), Query_Handler)
+    except OSError as e:
+        config.LOG.critical(f'The query service cannot be started on port {port}: {e}. The process will now be halted.')
+        sys.exit(1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=poll, args=(interval,), daemon=True).start()
+    config.LOG.info(f'The query service is running at http://127.0.0.1:{server.server_port}/.')
+
+    return server
+
+
+# Keep the main thread alive while the query service is running, until interrupted
+def wait():
+    config.LOG.info('Press Ctrl+C to stop the query service.')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        config.LOG.info('The query service is stopped.')
+
+
+# Poll the Monocle table every interval seconds, and reload it once it stops changing (so a table that is still being written is not loaded)
+def poll(interval):
+    global INDEX
+    while True:
+        time.sleep(interval)
+
+        path = table_io.find_table('', MONOCLE_FILE)
+        signature = watch.get_signature(path)
+        if signature is None or (INDEX is not None and path == INDEX.path and signature == INDEX.signature):
+            continue
+
+        while (settled_signature := watch.get_signature(path)) != signature:
+            signature = settled_signature
+            time.sleep(interval)
+
+        try:
+            index = MonocleIndex(path)
+        except Exception as e:
+            config.LOG.error(f'{path} cannot be reloaded into the query service: {e}')
+            continue
+
+        INDEX = index
+        config.LOG.info(f'{path} is reloaded into the query service with {len(INDEX.df)} row(s).')
+
+
+# Answer a query: the path selects the query type, the parameters are filters on indexed columns (repeat a parameter to match any of its values) and options
+# /rows: matching rows, limited to 'limit' rows; /count: number of matching rows, or per value of the 'by' column; /lookup: rows of the given Public_name or Lane_id
+# /published: whether each given Public_name is published, with the Public_name(s) not in the table listed separately as unknown; /status: the loaded Monocle table
+# Return (HTTP status, response object)
+def answer(index, path, params):
+    if path == '/status':
+        return 200, {'file': os.path.abspath(index.path), 'rows': len(index.df), 'loaded': index.loaded, 'indexed_columns': list(index.positions)}
+
+    options = {key: params.pop(key)[-1] for key in ('by', 'limit', 'columns') if key in params}
+    if (unknown := sorted(set(params) - set(index.positions))):
+        return 400, {'error': f'Unknown filter(s): {", ".join(unknown)}. Available filter(s): {", ".join(index.positions)}'}
+
+    if path == '/published':
+        if 'Public_name' not in params:
+            return 400, {'error': 'Public_name is required.'}
+        published = index.df['Published'].to_numpy()
+        public_name_positions = index.positions['Public_name']
+        return 200, {
+            'published': {public_name: bool((published[public_name_positions[public_name]] == 'Y').any()) for public_name in params['Public_name'] if public_name in public_name_positions},
+            'unknown': [public_name for public_name in params['Public_name'] if public_name not in public_name_positions]
+        }
+
+    if path == '/lookup' and not ({'Public_name', 'Lane_id'} & set(params)):
+        return 400, {'error': 'Public_name or Lane_id is required.'}
+
+    positions = get_positions(index, params)
+
+    if path == '/count':
+        if 'by' not in options:
+            return 200, {'count': len(positions)}
+        if options['by'] not in index.df:
+            return 400, {'error': f'Unknown column: {options["by"]}.'}
+        values, counts = np.unique(index.df[options['by']].to_numpy()[positions].astype(str), return_counts=True)
+        order = np.argsort(-counts, kind='stable')
+        return 200, {'count': len(positions), 'by': options['by'], 'counts': dict(zip(values[order].tolist(), counts[order].tolist()))}
+
+    if path in ('/rows', '/lookup'):
+        try:
+            limit = min(int(options.get('limit', MAX_ROWS)), MAX_ROWS)
+            if limit < 0:
+                raise ValueError
+        except ValueError:
+            return 400, {'error': f'Invalid limit: {options["limit"]}. It must be a non-negative integer.'}
+        columns = options['columns'].split(',') if 'columns' in options else list(index.df.columns)
+        if (unknown := [column for column in columns if column not in index.df]):
+            return 400, {'error': f'Unknown column(s): {", ".join(unknown)}.'}
+        return 200, {'count': len(positions), 'rows': index.df.iloc[positions[:limit]][columns].to_dict('records')}
+
+    return 404, {'error': f'Unknown query: {path}. Available queries: /rows, /count, /lookup, /published, /status'}
+
+
+# Get the sorted row positions matching all filters (dictionary of column: values); rows matching any of the values of a column match its filter
+def get_positions(index, filters):
+    positions = np.arange(len(index.df))
+    for column, values in filters.items():
+        column_positions = [index.positions[column][value] for value in values if value in index.positions[column]]
+        column_positions = np.unique(np.concatenate(column_positions)) if column_positions else np.array([], dtype=int)
+        positions = np.intersect1d(positions, column_positions, assume_unique=True)
+    return positions
+
+
+class Query_Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        # Take the current index once, so the query is answered from one table even if it is reloaded meanwhile
+        index = INDEX
+        if index is None:
+            status, response = 503, {'error': f'{MONOCLE_FILE} is not loaded yet.'}
+        else:
+            status, response = answer(index, url.path.rstrip('/') or '/status', urllib.parse.parse_qs(url.query, keep_blank_values=True))
+
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Requests are not logged, as the log is for the processing
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,49 @@
+# This module provides a binary cache of reference data structures compiled from source files.
+# The cache is keyed by the content hash of each source file, so it is loaded in one read when none of the source files has changed,
+# and recompiled from the source files otherwise.
+
+
+import hashlib
+import os
+import pickle
+
+
+CACHE_VERSION = 1
+
+
+# Load reference data compiled from the source files; if the cache is missing, unreadable or any source file has changed, compile it with compile_func and save it to the cache
+def load(cache_file, source_files, compile_func):
+    key = get_key(source_files)
+
+    try:
+        with open(cache_file, 'rb') as f:
+            cache = pickle.load(f)
+        if cache['version'] == CACHE_VERSION and cache['key'] == key:
+            return cache['data']
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, KeyError, TypeError):
+        pass
+
+    data = compile_func()
+    save(cache_file, key, data)
+    return data
+
+
+# Get the cache key, which is the path and content hash of each source file
+def get_key(source_files):
+    key = {}
+    for source_file in source_files:
+        with open(source_file, 'rb') as f:
+            key[os.path.abspath(source_file)] = hashlib.sha256(f.read()).hexdigest()
+    return key
+
+
+# Save the compiled reference data to the cache atomically; the cache is an optimisation only, so failure to save is ignored
+def save(cache_file, key, data):
+    temp_file = f'{cache_file}.tmp'
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(temp_file, 'wb') as f:
+            pickle.dump({'version': CACHE_VERSION, 'key': key, 'data': data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass
@@ -0,0 +1,149 @@
+# This module records the run manifest of each processing run, and saves it as run_manifest.json in the working directory.
+# The manifest contains the hashes of the input files, and the wall time, CPU time, input and output row counts and peak memory of each stage,
+# so performance can be compared across releases and regressions can be spotted in production runs.
+
+
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+import bin.config as config
+
+# resource is not available on Windows, peak RSS is not recorded there
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+MANIFEST_FILE = 'run_manifest.json'
+
+# Manifest of the current run, and the current stage of it; both are None outside of a run / stage
+MANIFEST = None
+CURRENT_STAGE = None
+
+
+# Record a run: hash the input files, then save the manifest with the status of the run when the with-block ends
+# If trace_memory is True, Python memory allocations are traced with tracemalloc to record the peak of each stage, which slows down the run
+@contextlib.contextmanager
+def run(input_files, trace_memory=False):
+    global MANIFEST
+    MANIFEST = {
+        'command': sys.argv,
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'status': 'running',
+        'inputs': {os.path.abspath(input_file): get_file_hash(input_file) for input_file in input_files},
+        'stages': []
+    }
+
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+        MANIFEST['status'] = 'completed'
+    except SystemExit:
+        MANIFEST['status'] = 'halted'
+        raise
+    except BaseException:
+        MANIFEST['status'] = 'failed'
+        raise
+    finally:
+        MANIFEST['wall_time'] = round(time.perf_counter() - start_wall, 3)
+        MANIFEST['cpu_time'] = round(time.process_time() - start_cpu, 3)
+        MANIFEST['peak_rss_mb'] = get_peak_rss_mb()
+
+        with open(MANIFEST_FILE, 'w') as f:
+            json.dump(MANIFEST, f, indent=4)
+        config.LOG.info(f'{MANIFEST_FILE} is saved.')
+
+        MANIFEST = None
+
+
+# Record a stage of the current run, cached=True if it is skipped as its outputs are up to date; does nothing outside of a run
+@contextlib.contextmanager
+def stage(name, target=None, cached=False):
+    if MANIFEST is None:
+        yield
+        return
+
+    global CURRENT_STAGE
+    CURRENT_STAGE = {'name': name, 'target': target, 'cached': cached, 'input_rows': None, 'output_rows': None}
+
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        CURRENT_STAGE['wall_time'] = round(time.perf_counter() - start_wall, 3)
+        CURRENT_STAGE['cpu_time'] = round(time.process_time() - start_cpu, 3)
+        # Peak RSS is the high-water mark of the whole process by the end of the stage, tracemalloc peak is of the stage only
+        CURRENT_STAGE['peak_rss_mb'] = get_peak_rss_mb()
+        CURRENT_STAGE['tracemalloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1) if tracemalloc.is_tracing() else None
+
+        MANIFEST['stages'].append(CURRENT_STAGE)
+        CURRENT_STAGE = None
+
+
+# Add the record of a stage run by a worker process to the current run
+def add_stage(record):
+    if MANIFEST is not None and record is not None:
+        MANIFEST['stages'].append(record)
+
+
+# In a worker process, record stages into a scratch manifest, so their records can be returned to the main process with 'pop_stage'
+def init_worker(trace_memory=False):
+    global MANIFEST
+    MANIFEST = {'stages': []}
+
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+# Remove and return the record of the last stage, or None if there is none
+def pop_stage():
+    if MANIFEST is None or not MANIFEST['stages']:
+        return None
+    return MANIFEST['stages'].pop()
+
+
+# Record the critical path of the current run
+def set_critical_path(critical_path):
+    if MANIFEST is not None:
+        MANIFEST['critical_path'] = critical_path
+
+
+# Add input and/or output row counts to the current stage; does nothing outside of a stage
+def add_rows(input_rows=None, output_rows=None):
+    if CURRENT_STAGE is None:
+        return
+
+    for key, rows in (('input_rows', input_rows), ('output_rows', output_rows)):
+        if rows is not None:
+            CURRENT_STAGE[key] = (CURRENT_STAGE[key] or 0) + rows
+
+
+# Get peak RSS of the process in MB, or None if it is not available
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+
+    # ru_maxrss is in bytes on macOS, and in kilobytes on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(max_rss / 1024 ** 2 if sys.platform == 'darwin' else max_rss / 1024, 1)
+
+
+# Get SHA-256 hash of a file
+def get_file_hash(path):
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
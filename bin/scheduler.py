@@ -0,0 +1,224 @@
+# This module contains 'run_stages' function and its supporting classes and functions.
+# A processing stage is declared with its input and output files, and the results of other stages it takes as arguments;
+# a stage depends on the stages producing any of its input files or results.
+# 'run_stages' runs the stages in dependency order; stages that do not depend on each other run concurrently in a pool of worker processes,
+# and the critical path (the chain of dependent stages that determines the total time) is reported.
+# Stages with cached=True are skipped if their outputs are up to date according to the output cache.
+
+
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import bin.config as config
+import bin.colorlog as colorlog
+import bin.table_io as table_io
+import bin.duckdb_backend as duckdb_backend
+import bin.polars_engine as polars_engine
+import bin.run_manifest as run_manifest
+import bin.output_cache as output_cache
+
+
+# A processing stage, calling func(*args); use Result(key) in args to take the result of another stage
+# Stages with local=True always run in the main process, e.g. when they prompt for input or keep data in memory of the main process
+# Stages with cached=True are skipped when the fingerprint of their inputs is unchanged and their outputs are not modified since they were last run
+class Stage:
+    def __init__(self, name, func, args=(), inputs=(), outputs=(), target=None, local=False, cached=False):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.inputs = set(inputs)
+        self.outputs = set(outputs)
+        self.target = target
+        self.local = local
+        self.cached = cached
+
+        # Unique key of the stage, e.g. "table4 gps-data"
+        self.key = f'{name} {target}' if target is not None else name
+
+
+# Placeholder of the result of the stage with the key, to be used in the args of another stage
+class Result:
+    def __init__(self, key):
+        self.key = key
+
+
+# Run the stages in dependency order; with jobs > 1, stages that are ready run concurrently in a pool of jobs worker processes
+# When there is no dependency between them, stages start in the order they are declared
+# With force=True, all stages are run regardless of the output cache
+def run_stages(stages, jobs=1, trace_memory=False, force=False):
+    dependencies = get_dependencies(stages)
+
+    records = output_cache.load(config.OUTPUT_CACHE_FILE)
+    fingerprints = {}
+
+    results = {}
+    durations = {}
+    pending = list(stages)
+    running = {}
+
+    executor = None
+    if jobs > 1 and any(not stage.local for stage in stages):
+        log_queue, log_listener = colorlog.get_worker_log_queue()
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(log_queue, colorlog.SHARED_SPILLED_VALUES, table_io.ENGINE, duckdb_backend.BACKEND, polars_engine.ENGINE, trace_memory))
+
+    try:
+        while pending or running:
+            ready = [stage for stage in pending if dependencies[stage.key] <= results.keys()]
+
+            # Fingerprint the cached stages once their inputs are ready, skip those with up-to-date outputs, then check for newly ready stages
+            skipped = False
+            for stage in ready:
+                if stage.cached and stage.key not in fingerprints:
+                    fingerprints[stage.key] = get_fingerprint(stage, fingerprints)
+                    if not force and can_skip(stage, stages, dependencies, records, fingerprints, results.keys()):
+                        pending.remove(stage)
+                        results[stage.key], durations[stage.key] = skip_stage(stage)
+                        skipped = True
+            if skipped:
+                continue
+
+            for stage in ready:
+                if executor is not None and not stage.local:
+                    pending.remove(stage)
+                    running[executor.submit(run_stage_in_worker, stage.name, stage.target, stage.func, get_args(stage, results))] = stage
+
+            # Run a local stage in the main process while the submitted stages run in the worker processes, then check for newly ready stages
+            if local_ready := [stage for stage in ready if executor is None or stage.local]:
+                stage = local_ready[0]
+                pending.remove(stage)
+                results[stage.key], durations[stage.key] = run_stage(stage.name, stage.target, stage.func, get_args(stage, results))
+                record_outputs(stage, records, fingerprints)
+                continue
+
+            if not running:
+                raise ValueError(f'The following stage(s) have circular dependencies: {", ".join(stage.key for stage in pending)}')
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                results[stage.key], durations[stage.key], record = future.result()
+                run_manifest.add_stage(record)
+                record_outputs(stage, records, fingerprints)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+            log_listener.stop()
+
+    report_critical_path(dependencies, durations)
+
+    return results
+
+
+# Get the keys of the stages each stage depends on: the stages producing its input files, and the stages whose results are in its args
+def get_dependencies(stages):
+    stage_keys = {stage.key for stage in stages}
+
+    dependencies = {}
+    for stage in stages:
+        dependencies[stage.key] = {other.key for other in stages if other is not stage and stage.inputs & other.outputs}
+        for arg in stage.args:
+            if isinstance(arg, Result):
+                if arg.key not in stage_keys:
+                    raise ValueError(f'{stage.key} takes the result of {arg.key}, which is not a declared stage')
+                dependencies[stage.key].add(arg.key)
+
+    return dependencies
+
+
+# Get the args of a stage, with results of other stages in place of their placeholders
+def get_args(stage, results):
+    return tuple(results[arg.key] if isinstance(arg, Result) else arg for arg in stage.args)
+
+
+# Get the fingerprint of a stage, or None if it takes the result of a stage without fingerprint
+def get_fingerprint(stage, fingerprints):
+    args = []
+    for arg in stage.args:
+        if isinstance(arg, Result):
+            if fingerprints.get(arg.key) is None:
+                return None
+            arg = fingerprints[arg.key]
+        args.append(arg)
+    return output_cache.get_fingerprint(stage.key, args, stage.inputs, stage.outputs)
+
+
+# Check whether a stage can be skipped: its outputs are up to date, and so are the outputs of all stages taking its result, as its result is not available when it is skipped
+def can_skip(stage, stages, dependencies, records, fingerprints, done):
+    if fingerprints[stage.key] is None or not output_cache.is_fresh(records.get(output_cache.get_record_key(stage.key, stage.outputs)), fingerprints[stage.key], stage.outputs):
+        return False
+
+    done = done | {stage.key}
+    for dependent in stages:
+        if not any(isinstance(arg, Result) and arg.key == stage.key for arg in dependent.args):
+            continue
+        if not dependent.cached or not dependencies[dependent.key] <= done:
+            return False
+        if not can_skip(dependent, stages, dependencies, records, {**fingerprints, dependent.key: get_fingerprint(dependent, fingerprints)}, done):
+            return False
+
+    return True
+
+
+# Skip a stage with up-to-date outputs, return its result (None) and duration
+def skip_stage(stage):
+    config.LOG.info(f'{stage.key} is skipped, as its output(s) are up to date: {", ".join(sorted(stage.outputs))}. Use --force to regenerate.')
+    with run_manifest.stage(stage.name, stage.target, cached=True):
+        pass
+    return None, 0
+
+
+# Record the fingerprint and outputs of a cached stage after it is run, and save the output cache
+def record_outputs(stage, records, fingerprints):
+    if not stage.cached or fingerprints.get(stage.key) is None:
+        return
+
+    records[output_cache.get_record_key(stage.key, stage.outputs)] = output_cache.get_record(fingerprints[stage.key], stage.outputs)
+    output_cache.save(config.OUTPUT_CACHE_FILE, records)
+
+
+# Run a stage in the current process, return its result and duration
+def run_stage(name, target, func, args):
+    start = time.perf_counter()
+    with run_manifest.stage(name, target):
+        result = func(*args)
+    return result, time.perf_counter() - start
+
+
+# Run a stage in a worker process, return its result, duration and run manifest record for the main process
+def run_stage_in_worker(name, target, func, args):
+    result, duration = run_stage(name, target, func, args)
+    return result, duration, run_manifest.pop_stage()
+
+
+# Initialise a worker process: log to the main process, and use the table I/O engine, backend, frame engine and memory tracing of the main process
+def init_worker(log_queue, shared_spilled_values, io_engine, backend, frame_engine, trace_memory):
+    # Worker processes started by spawn (instead of fork) do not inherit the initialised config
+    if not hasattr(config, 'LOG'):
+        config.init()
+
+    colorlog.log_to_queue(log_queue, shared_spilled_values)
+    table_io.set_engine(io_engine)
+    duckdb_backend.set_backend(backend)
+    polars_engine.set_engine(frame_engine)
+    run_manifest.init_worker(trace_memory)
+
+
+# Report the critical path, the chain of dependent stages with the longest total duration
+def report_critical_path(dependencies, durations):
+    if not durations:
+        return
+
+    # Stages are in durations in the order they finished, which is always after their dependencies, so the finish time of each stage on its longest chain can be calculated in one pass
+    finish_times = {}
+    predecessors = {}
+    for key, duration in durations.items():
+        predecessor = max(dependencies[key], key=finish_times.get, default=None)
+        predecessors[key] = predecessor
+        finish_times[key] = duration + (finish_times[predecessor] if predecessor is not None else 0)
+
+    critical_path = [max(finish_times, key=finish_times.get)]
+    while (predecessor := predecessors[critical_path[-1]]) is not None:
+        critical_path.append(predecessor)
+    critical_path.reverse()
+
+    config.LOG.info(f'Critical path ({finish_times[critical_path[-1]]:.2f} second(s) in total): {" -> ".join(f"{key} ({durations[key]:.2f} s)" for key in critical_path)}')
+    run_manifest.set_critical_path([{'stage': key, 'wall_time': round(durations[key], 3)} for key in critical_path])
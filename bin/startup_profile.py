@@ -0,0 +1,51 @@
+# This module provides lazy import of heavy dependencies, and records the time spent on importing modules and initialising reference data during startup.
+# The recorded timings are reported in --startup-profile mode.
+
+
+import contextlib
+import importlib
+import sys
+import time
+import types
+
+
+# Recorded timings as a list of (category, name, start time, seconds)
+TIMINGS = []
+
+# Time when this module is first imported, i.e. when the processor starts loading its modules
+START = time.perf_counter()
+
+
+# Record the time spent in the with-block under the category and name
+@contextlib.contextmanager
+def timed(category, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        TIMINGS.append((category, name, start, time.perf_counter() - start))
+
+
+# Import a module lazily: return the module if it is already imported, otherwise a placeholder that imports the module on first attribute access and records the import time
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+# Placeholder of a lazily imported module, attribute access is delegated to the actual module after it is imported
+class LazyModule(types.ModuleType):
+    def __getattr__(self, attr):
+        if (module := sys.modules.get(self.__name__)) is None:
+            with timed('import', self.__name__):
+                module = importlib.import_module(self.__name__)
+        return getattr(module, attr)
+
+
+# Report the recorded timings in the order they started; time of an import includes the imports of its own dependencies that are not yet imported
+def report(log):
+    log.info('Startup profile:')
+    for category, name, _, seconds in sorted(TIMINGS, key=lambda timing: timing[2]):
+        log.info(f'{category:<9} {name}: {seconds * 1000:.1f} ms')
+    log.info(f'Total time since start: {time.perf_counter() - START:.3f} s')
+
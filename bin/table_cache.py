@@ -0,0 +1,145 @@
+# This module provides a cache of parsed tables as Arrow IPC files.
+# A table is parsed from CSV on its first read and saved to the cache; later reads memory-map the cached file instead of parsing the CSV again.
+# Each cached table is stamped with the path, size, mtime and content hash of its CSV, so it is invalidated automatically when the CSV changes;
+# cached tables of CSVs that have changed or no longer exist are removed once per process, on the first read through the cache.
+# The cache is an optimisation only: it is skipped if pyarrow is not installed, and any failure to read or save it falls back to parsing the CSV.
+
+
+import hashlib
+import glob
+import os
+import bin.table_io as table_io
+
+
+CACHE_VERSION = 3
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'tables')
+
+# Whether the cached tables have been pruned in this process, only done on the first read (see 'prune')
+PRUNED = False
+
+
+# Read a table with all values as strings, from the cache if it is up to date; optionally only read the selected columns
+# keep_default_na=False keeps all values as-is (including empty string); keep_default_na=True converts Pandas default NA values to NaN
+def read_csv(path, keep_default_na=False, columns=None):
+    try:
+        import pyarrow
+    except ImportError:
+        return table_io.read_csv(path, keep_default_na, columns)
+
+    global PRUNED
+    if not PRUNED:
+        prune()
+        PRUNED = True
+
+    cache_file = get_cache_file(path)
+    stamp = get_stamp(path)
+
+    table = load(cache_file, path, stamp)
+    if table is None:
+        # All values are cached as-is, so the cached table serves reads with and without NA conversion
+        df = table_io.read_csv(path)
+        save(cache_file, df, stamp)
+    else:
+        df = table.to_pandas()
+
+    if columns is not None:
+        if (missing := set(columns) - set(df.columns)):
+            raise ValueError(f'Usecols do not match columns, columns expected but not found: {sorted(missing)}')
+        # Keep the column order of the file as Pandas does
+        df = df[[column for column in df.columns if column in columns]]
+
+    if keep_default_na:
+        df = table_io.convert_default_na(df)
+
+    return df
+
+
+# Get the path of the cached file of a table, named by the hash of the absolute path of the table
+def get_cache_file(path):
+    return os.path.join(CACHE_DIR, f'{hashlib.sha256(os.path.abspath(path).encode()).hexdigest()}.arrow')
+
+
+# Get the stamp of a table: its absolute path, size and mtime; its content hash is only calculated when needed (see 'load' and 'save')
+def get_stamp(path):
+    stat = os.stat(path)
+    return {'version': str(CACHE_VERSION), 'path': os.path.abspath(path), 'size': str(stat.st_size), 'mtime_ns': str(stat.st_mtime_ns)}
+
+
+# Load the cached table as an Arrow table memory-mapped from the cached file, or None if it is missing, unreadable or out of date
+# If only the mtime of the CSV has changed (e.g. it is rewritten with the same content), the cached table is still used if the content hash matches, and is re-stamped
+def load(cache_file, path, stamp):
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    try:
+        with pa.memory_map(cache_file) as source:
+            table = pa.ipc.open_file(source).read_all()
+    except (OSError, pa.ArrowException):
+        return None
+
+    cached_stamp = get_cached_stamp(table.schema)
+    if any(cached_stamp.get(key) != stamp[key] for key in ('version', 'path', 'size')):
+        return None
+
+    if cached_stamp.get('mtime_ns') != stamp['mtime_ns']:
+        if cached_stamp.get('sha256') != get_file_hash(path):
+            return None
+        save(cache_file, table, stamp, file_hash=cached_stamp['sha256'])
+
+    return table
+
+
+# Save a table (Pandas dataframe or Arrow table) to the cache atomically, stamped with the stamp and content hash of its CSV
+def save(cache_file, table, stamp, file_hash=None):
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    temp_file = f'{cache_file}.{os.getpid()}.tmp'
+    try:
+        if not isinstance(table, pa.Table):
+            table = pa.Table.from_pandas(table, preserve_index=False)
+        table = table.replace_schema_metadata({**stamp, 'sha256': file_hash or get_file_hash(stamp['path'])})
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with pa.OSFile(temp_file, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temp_file, cache_file)
+    except (OSError, pa.ArrowException):
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+# Remove the cached tables that are unreadable, of another cache version, or whose CSV has changed size or no longer exists; only their schemas are read
+# A cached table whose CSV only has a different mtime is kept, as it is re-stamped on its next read if the content hash still matches
+def prune():
+    import pyarrow as pa
+    import pyarrow.ipc
+
+    for cache_file in glob.glob(os.path.join(CACHE_DIR, '*.arrow')):
+        try:
+            with pa.memory_map(cache_file) as source:
+                cached_stamp = get_cached_stamp(pa.ipc.open_file(source).schema)
+            is_stale = not os.path.isfile(cached_stamp.get('path', '')) or any(cached_stamp.get(key) != value for key, value in get_stamp(cached_stamp['path']).items() if key != 'mtime_ns')
+        except (OSError, pa.ArrowException):
+            is_stale = True
+
+        if is_stale:
+            try:
+                os.remove(cache_file)
+            except OSError:
+                pass
+
+
+# Get the stamp of a cached table from the metadata of its schema
+def get_cached_stamp(schema):
+    return {key.decode(): value.decode() for key, value in (schema.metadata or {}).items()}
+
+
+# Get SHA-256 hash of a file
+def get_file_hash(path):
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
@@ -0,0 +1,203 @@
+# This module contains 'read_csv' and 'write_csv' functions shared by all modules and scripts for table reading and writing.
+# The default 'pandas' engine uses the single-threaded Pandas C parser and writer;
+# the 'arrow' engine uses the multithreaded Arrow CSV reader and writer, while keeping the same values and output formatting.
+# Tables compressed with gzip (.csv.gz) or zstd (.csv.zst) are read and written as streams, so they are never decompressed to disk.
+
+
+import csv
+import gzip
+import io
+import os
+import bin.startup_profile as startup_profile
+
+
+pd = startup_profile.lazy_import('pandas')
+np = startup_profile.lazy_import('numpy')
+
+
+ENGINES = ('pandas', 'arrow')
+ENGINE = 'pandas'
+
+# Supported compressions of tables and their file extensions; zstd streams are handled by pyarrow
+COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+# Compression level of gzip streams; lower than the default of the gzip module (9), which is several times slower for a slightly smaller file
+GZIP_LEVEL = 6
+
+
+# Select the engine for all subsequent table reading and writing; raise ImportError if the engine is not available
+def set_engine(engine):
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown table I/O engine: {engine}. Available engine(s): {", ".join(ENGINES)}')
+
+    if engine == 'arrow':
+        import pyarrow
+        import pyarrow.csv
+
+    global ENGINE
+    ENGINE = engine
+
+
+# Read a table with all values as strings; optionally only read the selected columns
+# keep_default_na=False keeps all values as-is (including empty string); keep_default_na=True converts Pandas default NA values to NaN
+def read_csv(path, keep_default_na=False, columns=None):
+    if ENGINE == 'arrow':
+        return read_csv_arrow(path, keep_default_na, columns)
+    return read_csv_pandas(path, keep_default_na, columns)
+
+
+# Read a table with the Pandas C parser, decompressing the stream of a compressed table
+def read_csv_pandas(path, keep_default_na, columns=None):
+    if get_compression(path) is None:
+        return pd.read_csv(path, dtype=str, keep_default_na=keep_default_na, usecols=columns)
+    with open_table(path) as f:
+        return pd.read_csv(f, dtype=str, keep_default_na=keep_default_na, usecols=columns)
+
+
+# Convert Pandas default NA values in a dataframe read with keep_default_na=False to NaN, as if it is read with keep_default_na=True
+def convert_default_na(df):
+    from pandas._libs.parsers import STR_NA_VALUES
+    return df.mask(df.isin(STR_NA_VALUES), np.nan)
+
+
+# Read the column names in the header of a table
+def read_header(path):
+    with open_table(path) as f:
+        return next(csv.reader(io.TextIOWrapper(f, encoding='utf-8-sig', newline='')), [])
+
+
+# Write a table without index, compressed by the extension of the path (e.g. table4.csv.gz)
+def write_csv(df, path):
+    if ENGINE == 'arrow' and (table := get_arrow_writable_table(df)) is not None:
+        with open_table(path, 'wb') as f:
+            write_csv_arrow(table, f)
+    elif get_compression(path) is None:
+        df.to_csv(path, index=False)
+    else:
+        with open_table(path, 'wb') as f, io.TextIOWrapper(f, encoding='utf-8', newline='') as text:
+            df.to_csv(text, index=False)
+
+
+# Get the compression of a table by the extension of its path, or None if it is not compressed
+def get_compression(path):
+    for compression, extension in COMPRESSIONS.items():
+        if path.endswith(extension):
+            return compression
+    return None
+
+
+# Open a table as a binary file object for reading ('rb') or writing ('wb'); compressed tables are decompressed or compressed as a stream
+def open_table(path, mode='rb'):
+    match get_compression(path):
+        case 'gzip':
+            return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+        case 'zstd':
+            import pyarrow as pa
+            return pa.input_stream(path, compression='zstd') if mode == 'rb' else pa.output_stream(path, compression='zstd')
+        case _:
+            return open(path, mode)
+
+
+# Get the paths a table (e.g. table1.csv) may be saved as: uncompressed, then with the extension of each compression
+def get_table_paths(path):
+    return [path] + [path + extension for extension in COMPRESSIONS.values()]
+
+
+# Get the path of a table in a directory by its file name (e.g. table1.csv), which is either uncompressed or compressed (e.g. table1.csv.gz)
+# The first existing path of 'get_table_paths' is returned; if none exists, the uncompressed path is returned
+def find_table(directory, name):
+    paths = get_table_paths(os.path.join(directory, name))
+    return next((path for path in paths if os.path.isfile(path)), paths[0])
+
+
+# Get the path of a generated table (e.g. table4.csv) with the extension of the compression (None for uncompressed)
+def get_output_path(path, compression=None):
+    return path + COMPRESSIONS[compression] if compression is not None else path
+
+
+# Remove the other saved versions of a generated table (e.g. table4.csv after table4.csv.gz is generated), so they are not read in place of the newly generated table
+def remove_other_paths(path):
+    for other_path in get_table_paths(path.removesuffix(COMPRESSIONS.get(get_compression(path), ''))):
+        if other_path != path and os.path.isfile(other_path):
+            os.remove(other_path)
+
+
+# Format the rows of a table without index and header as bytes, for appending to the end of an existing table
+def format_csv_rows(df, lineterminator='\n'):
+    if ENGINE == 'arrow' and lineterminator == '\n' and (table := get_arrow_writable_table(df)) is not None:
+        buffer = io.BytesIO()
+        write_csv_arrow(table, buffer, header=False)
+        return buffer.getvalue()
+    return df.to_csv(index=False, header=False, lineterminator=lineterminator).encode('utf-8')
+
+
+# Read a table with the multithreaded Arrow CSV reader, fallback to Pandas if the header contains duplicated column names (which Pandas would rename)
+# or if the table cannot be parsed by Arrow (e.g. rows with fewer fields than the header, which Pandas fills with NaN)
+def read_csv_arrow(path, keep_default_na, columns=None):
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    from pandas._libs.parsers import STR_NA_VALUES
+
+    header = read_header(path)
+
+    if len(set(header)) != len(header):
+        return read_csv_pandas(path, keep_default_na, columns)
+
+    if columns is not None and (missing := set(columns) - set(header)):
+        raise ValueError(f'Usecols do not match columns, columns expected but not found: {sorted(missing)}')
+
+    convert_options = pa_csv.ConvertOptions(
+        column_types={column: pa.string() for column in header},
+        null_values=list(STR_NA_VALUES) if keep_default_na else [],
+        strings_can_be_null=keep_default_na,
+        quoted_strings_can_be_null=keep_default_na,
+        # Keep the column order of the file as Pandas does
+        include_columns=[column for column in header if column in columns] if columns is not None else None
+    )
+    # Compressed tables are decompressed by the Arrow CSV reader by their extension
+    try:
+        df = pa_csv.read_csv(path, read_options=pa_csv.ReadOptions(use_threads=True), convert_options=convert_options).to_pandas()
+    except pa.ArrowInvalid:
+        return read_csv_pandas(path, keep_default_na, columns)
+
+    # Arrow nulls are converted to None, use NaN as Pandas does
+    if keep_default_na:
+        df = df.where(df.notna(), np.nan)
+
+    return df
+
+
+# Get a table as an Arrow table to be written by the Arrow CSV writer, or None if the writer cannot reproduce the output of Pandas:
+# values must not require quoting, as the Arrow CSV writer either quotes all strings or none of them; they are checked with a vectorised Arrow compute kernel
+# Single-column tables and non-integer numeric columns are excluded, as Pandas quotes empty values in the former and formats floats differently
+def get_arrow_writable_table(df):
+    import pyarrow as pa
+    import pyarrow.compute as pa_compute
+
+    if len(df.columns) < 2:
+        return None
+
+    if not all(column.dtype == object or pd.api.types.is_integer_dtype(column.dtype) for _, column in df.items()):
+        return None
+
+    # Mixed-type columns (e.g. integer placeholders added to string columns) are written as their string representation, as Pandas does
+    df = df.apply(lambda column: column.where(column.isna(), column.astype(str)) if column.dtype == object else column)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    for column in table.columns:
+        if pa.types.is_string(column.type) and pa_compute.any(pa_compute.match_substring_regex(column, r'[,"\r\n]')).as_py():
+            return None
+
+    return table
+
+
+# Write an Arrow table to a binary file object with the multithreaded Arrow CSV writer; the header is written by the csv module to match the minimal quoting of Pandas
+def write_csv_arrow(table, f, header=True):
+    import pyarrow.csv as pa_csv
+
+    if header:
+        header_line = io.StringIO()
+        csv.writer(header_line, lineterminator='\n').writerow(table.column_names)
+        f.write(header_line.getvalue().encode('utf-8'))
+
+    pa_csv.write_csv(table, f, write_options=pa_csv.WriteOptions(include_header=False, quoting_style='none'))
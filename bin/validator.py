@@ -3,19 +3,87 @@
 # and all fields contain only the expected values or values in the expected formats for their respective columns. 
 
 
-import pandas as pd
 import sys
 import os
 import re
 from datetime import date
 import bin.config as config
+import bin.table_io as table_io
+import bin.table_cache as table_cache
+import bin.key_index as key_index
+import bin.startup_profile as startup_profile
+import bin.run_manifest as run_manifest
+import bin.colorlog as colorlog
+import bin.duckdb_backend as duckdb_backend
 
 
-# The main function to perform validation on the provided GPS1 database tables.
+pd = startup_profile.lazy_import('pandas')
+np = startup_profile.lazy_import('numpy')
+
+
+# Report of the rows failing validation rules, saved to the data directory when the validation completes with error(s)
+ERRORS_FILE = 'validation_errors.csv'
+
+# Columns of the report of the rows failing validation rules; Row is the row number in the table, with the header being row 1
+ERRORS_COLUMNS = ['Table', 'Row', 'Column', 'Value', 'Lane_id', 'Public_name', 'Error']
+
+
+# The main function to perform validation on the provided GPS database tables.
 def validate(path, version, check=False):
+    config.LOG.info(f'Loading the tables at {path} now...')
+
+    # Tables may be compressed (e.g. table1.csv.gz), and fixes are saved in the same compression
+    table1, table2, table3 = (table_io.find_table(path, table) for table in ("table1.csv", "table2.csv", "table3.csv"))
+
+    df_index = read_tables(table1, table2, table3)
+    run_manifest.add_rows(input_rows=sum(len(df) for df in df_index.values()))
+
+    validate_tables(df_index, table1, table2, table3, version)
+
+    # If not in check mode, and there is a case conversion, whitespace stripping, repeat addition, updated No of genome, or updated Duplicate save the result
+    if not check:
+        for table in sorted(UPDATED_CASE | STRIPPED_WHITESPACE | INSERTED_METADATA | UPDATED_NO_OF_GENOME | UPDATED_DUPLICATE):
+            table_io.write_csv(df_index[table], table)
+            if table in UPDATED_CASE:
+                config.LOG.info(f'The unexpected lowercase value(s) in {table} have been fixed in-place.')
+            if table in STRIPPED_WHITESPACE:
+                config.LOG.info(f'The leading/trailing whitespace(s) in value(s) in {table} have been fixed in-place.')
+            if table in INSERTED_METADATA:
+                config.LOG.info(f'The missing repeat(s) which marked as UNIQUE and have their original(s) available have been inserted into {table} based on their original(s).')
+            if table in UPDATED_NO_OF_GENOME:
+                config.LOG.info(f'The incorrect values in No_of_genome in {table} have been fixed in-place.')
+            if table in UPDATED_DUPLICATE:
+                config.LOG.info(f'UNIQUE has been auto-assign to Duplicate in {table} for Public_name(s) with no UNIQUE assignment.')
+
+        # Keep the key index of the data directory in sync with the tables, which are named by their file name without the compression extension (e.g. table1.csv.gz is table1.csv)
+        key_index.update_key_index(path, {os.path.basename(table).removesuffix(table_io.COMPRESSIONS.get(table_io.get_compression(table), '')): df for table, df in df_index.items()})
+
+    run_manifest.add_rows(output_rows=sum(len(df) for df in df_index.values()))
+
+    # Save the rows failing validation rules for curators, or remove the report of a previous run if there is no error
+    errors_file = os.path.join(path, ERRORS_FILE)
+    if FOUND_ERRORS:
+        table_io.write_csv(get_error_rows(), errors_file)
+        config.LOG.info(f'The rows failing validation rule(s) are saved to {errors_file}.')
+    elif os.path.isfile(errors_file):
+        os.remove(errors_file)
+
+    if FOUND_ERRORS:
+        config.LOG.error(f'The validation of the tables at {path} completed with error(s). The process will now be halted. Please correct the error(s) and re-run the processor')
+        sys.exit(1)
+    else:
+        config.LOG.info(f'The validation of the tables at {path} completed without error.')
+
+
+# Validate the dataframes of table1, table2 and table3 (dictionary of table name: dataframe) in-place, return whether error is found
+# The tables fixed in-place are recorded in UPDATED_CASE, STRIPPED_WHITESPACE, INSERTED_METADATA, UPDATED_NO_OF_GENOME and UPDATED_DUPLICATE; the rows failing validation rules in ERROR_ROWS
+def validate_tables(df_index, table1, table2, table3, version):
     global FOUND_ERRORS
     FOUND_ERRORS = False
 
+    global ERROR_ROWS
+    ERROR_ROWS = []
+
     global UPDATED_CASE 
     UPDATED_CASE = set()
 
@@ -31,12 +99,6 @@ def validate(path, version, check=False):
     global UPDATED_DUPLICATE
     UPDATED_DUPLICATE = set()
 
-    config.LOG.info(f'Loading the tables at {path} now...')
-
-    table1, table2, table3 = (os.path.join(path, table) for table in ("table1.csv", "table2.csv", "table3.csv"))
-
-    df_index = read_tables(table1, table2, table3)
-
     config.LOG.info(f'Validating {table1} now...')
     check_meta_table(df_index[table1], table1, version)
 
@@ -56,33 +118,14 @@ def validate(path, version, check=False):
         add_unique_repeat_to_metadata(df_index, table1, table3)
         check_missing_metadata(df_index, table1, table3)
 
-    # If not in check mode, and there is a case conversion, whitespace stripping, repeat addition, updated No of genome, or updated Duplicate save the result
-    if not check:
-        for table in sorted(UPDATED_CASE | STRIPPED_WHITESPACE | INSERTED_METADATA | UPDATED_NO_OF_GENOME | UPDATED_DUPLICATE):
-            df_index[table].to_csv(table, index=False)
-            if table in UPDATED_CASE:
-                config.LOG.info(f'The unexpected lowercase value(s) in {table} have been fixed in-place.')
-            if table in STRIPPED_WHITESPACE:
-                config.LOG.info(f'The leading/trailing whitespace(s) in value(s) in {table} have been fixed in-place.')
-            if table in INSERTED_METADATA:
-                config.LOG.info(f'The missing repeat(s) which marked as UNIQUE and have their original(s) available have been inserted into {table} based on their original(s).')
-            if table in UPDATED_NO_OF_GENOME:
-                config.LOG.info(f'The incorrect values in No_of_genome in {table} have been fixed in-place.')
-            if table in UPDATED_DUPLICATE:
-                config.LOG.info(f'UNIQUE has been auto-assign to Duplicate in {table} for Public_name(s) with no UNIQUE assignment.')
-
-    if FOUND_ERRORS:
-        config.LOG.error(f'The validation of the tables at {path} completed with error(s). The process will now be halted. Please correct the error(s) and re-run the processor')
-        sys.exit(1)
-    else:
-        config.LOG.info(f'The validation of the tables at {path} completed without error.')
+    return FOUND_ERRORS
 
 
 # Read the tables into Pandas dataframes for processing
 def read_tables(table1, table2, table3):
     df_index = dict()
     for table in table1, table2, table3:
-        df_index[table] = pd.read_csv(table, dtype=str, keep_default_na=False)
+        df_index[table] = table_cache.read_csv(table)
     return df_index
 
 
@@ -159,7 +202,7 @@ def check_analysis_table(df_analysis, table, version, df_qc):
 
     check_sanger_sample_id(df_analysis, 'Sanger_sample_id', table, version)
     check_lane_id(df_analysis, 'Lane_id', table, version)
-    check_public_name(df_qc, 'Public_name', table, unique=False)
+    check_public_name(df_analysis, 'Public_name', table, unique=False)
     check_lane_id_is_unqiue(df_analysis, 'Lane_id', table)
     check_err(df_analysis, 'ERR', table, version)
     check_ers(df_analysis, 'ERS', table, version)
@@ -214,10 +257,10 @@ def check_analysis_table(df_analysis, table, version, df_qc):
 # Check whether tables contain only the expected columns
 def check_columns(df, columns, table):
     if (diff := set(list(df)) - set(columns)):
-        config.LOG.critical(f'{table} has the following unexpected column(s): {", ".join(diff)}. Incorrect or incompatible table is used and cannot be validated. The process will now be halted.')
+        config.LOG.critical(f'{table} has the following unexpected column(s): {colorlog.join_values(diff)}. Incorrect or incompatible table is used and cannot be validated. The process will now be halted.')
         sys.exit(1)
     if (diff := set(list(columns)) - set(df)):
-        config.LOG.critical(f'{table} is missing the following column(s): {", ".join(diff)}. Incorrect or incompatible table is used and cannot be validated. The process will now be halted.')
+        config.LOG.critical(f'{table} is missing the following column(s): {colorlog.join_values(diff)}. Incorrect or incompatible table is used and cannot be validated. The process will now be halted.')
         sys.exit(1)
 
 
@@ -244,7 +287,8 @@ def check_space(df, column_name, table):
     if len(unexpected) == 0:
         return
     
-    config.LOG.error(f'{column_name} in {table} has the following value(s) with space(s): {", ".join(unexpected)}.')
+    config.LOG.error(f'{column_name} in {table} has the following value(s) with space(s): {colorlog.join_values(unexpected)}.')
+    locate_error(df, column_name, table, unexpected, 'value with space(s)')
     found_error()
 
 # Check column values are in uppercase letters and have no space
@@ -260,12 +304,16 @@ def check_public_name(df, column_name, table, unique=False):
     if not unique:
         return
     
-    duplicated_names = df[df.duplicated(subset=[column_name], keep=False)][column_name].unique()
+    if duckdb_backend.is_enabled():
+        duplicated_names = duckdb_backend.get_duplicated_values(df, column_name)
+    else:
+        duplicated_names = df[df.duplicated(subset=[column_name], keep=False)][column_name].unique()
     
     if len(duplicated_names) == 0:
         return
     
-    config.LOG.error(f'{column_name} in {table} contains duplicate entries of the following Public_name(s): {", ".join(duplicated_names)}.')
+    config.LOG.error(f'{column_name} in {table} contains duplicate entries of the following Public_name(s): {colorlog.join_values(duplicated_names)}.')
+    locate_error(df, column_name, table, duplicated_names, 'duplicate Public_name')
     found_error()
 
 # Check column values contain Y, N, _ only
@@ -284,12 +332,13 @@ def check_country(df, column_name, table):
     # Check vaccine info
     no_vaccine_info = set(countries) - set(config.PCV_INTRO_YEARS.keys())
     if no_vaccine_info:
-        config.LOG.warning(f'{column_name} in {table} has the following country(s) without vaccine information: {", ".join(sorted(no_vaccine_info))}. If their National Immunisation/Vaccination Programme includes PCV, please add their information to {config.PCV_INTRO_YEARS_FILE}.') 
+        config.LOG.warning(f'{column_name} in {table} has the following country(s) without vaccine information: {colorlog.join_values(sorted(no_vaccine_info))}. If their National Immunisation/Vaccination Programme includes PCV, please add their information to {config.PCV_INTRO_YEARS_FILE}.') 
 
     # Check alpha2 info; database contains 'WEST AFRICA' which is not a country, therefore hard-coded for its removal
     no_alpha2 = set(countries) - set(config.COUNTRY_ALPHA2) - {'WEST AFRICA'}
     if no_alpha2:
-        config.LOG.error(f'{column_name} in {table} has the following country(s) without ISO 3166-1 alpha-2 code: {", ".join(no_alpha2)}. Please check spelling or add their alpha-2 code information to {config.ALPHA2_COUNTY_FILE}.')
+        config.LOG.error(f'{column_name} in {table} has the following country(s) without ISO 3166-1 alpha-2 code: {colorlog.join_values(no_alpha2)}. Please check spelling or add their alpha-2 code information to {config.ALPHA2_COUNTY_FILE}.')
+        locate_error(df, column_name, table, no_alpha2, 'country without ISO 3166-1 alpha-2 code')
         found_error()
 
 
@@ -322,7 +371,8 @@ def check_age_years(df, column_name, table):
     if len(unexpected) == 0:
         return
 
-    config.LOG.error(f'{column_name} in {table} has the following unexpected value(s): {", ".join(unexpected)}. If valid, please add to {config.NON_STANDARD_AGES_FILE} and state whether it is less than 5 years old or not.')
+    config.LOG.error(f'{column_name} in {table} has the following unexpected value(s): {colorlog.join_values(unexpected)}. If valid, please add to {config.NON_STANDARD_AGES_FILE} and state whether it is less than 5 years old or not.')
+    locate_error(df, column_name, table, unexpected, 'unexpected value')
     found_error()
 
 
@@ -353,8 +403,10 @@ def check_clinical_manifestation_and_source(df, clinical_manifestation, source,
     if len(unexpected) == 0:
         return
 
+    mask = df.set_index([clinical_manifestation, source]).index.isin(list(unexpected))
     unexpected = [f'{n}' for n in unexpected]
-    config.LOG.error(f'{table} has the following unexpected Clinical_manifestation and Source combination(s): {", ".join(unexpected)}. Please add the combination(s) to {config.MANIFESTATIONS_FILE} and state the resulting Manifestation.')
+    config.LOG.error(f'{table} has the following unexpected Clinical_manifestation and Source combination(s): {colorlog.join_values(unexpected)}. Please add the combination(s) to {config.MANIFESTATIONS_FILE} and state the resulting Manifestation.')
+    locate_error(df, [clinical_manifestation, source], table, unexpected, 'unexpected Clinical_manifestation and Source combination', mask=mask)
     found_error()
 
 
@@ -485,15 +537,17 @@ def check_ers(df, column_name, table, version):
 def check_no_of_genome(df, column_name, table, version):
     df_copy = df.copy()
 
+    df_copy['Public_name_no_suffix'] = get_public_name_no_suffix(df_copy['Public_name'], version)
     match version:
         case 1:
-            df_copy['Public_name_no_suffix'] = df_copy['Public_name']
             public_name_string = "Public_name(s)"
         case 2:
-            df_copy['Public_name_no_suffix'] = df_copy['Public_name'].str.replace(r'_R[1-9]$', '', regex=True)
             public_name_string = "Public_name(s) (_R* suffix repeats considered)"
 
-    dict_calculated_no_of_genome = df_copy.groupby("Public_name_no_suffix", dropna=False).size().to_dict()
+    if duckdb_backend.is_enabled():
+        dict_calculated_no_of_genome = duckdb_backend.get_public_name_counts(df, remove_repeat_suffix=version == 2)
+    else:
+        dict_calculated_no_of_genome = df_copy.groupby("Public_name_no_suffix", dropna=False).size().to_dict()
     df_copy["calculated_no_of_genome"] = df_copy["Public_name_no_suffix"].map(dict_calculated_no_of_genome).astype(str)
 
     mask_updated_no_of_genome = df_copy["calculated_no_of_genome"] != df_copy["No_of_genome"]
@@ -503,7 +557,7 @@ def check_no_of_genome(df, column_name, table, version):
         global UPDATED_NO_OF_GENOME
         UPDATED_NO_OF_GENOME.add(table)
 
-        config.LOG.info(f'{table} has the following {public_name_string} with incorrect value(s) in {column_name} that do not match the actual statistic: {", ".join(df.loc[mask_updated_no_of_genome, "Public_name"])}.')
+        config.LOG.info(f'{table} has the following {public_name_string} with incorrect value(s) in {column_name} that do not match the actual statistic: {colorlog.join_values(df.loc[mask_updated_no_of_genome, "Public_name"])}.')
 
 
 # Check column values contain DUPLICATE, UNIQUE only
@@ -516,13 +570,12 @@ def check_duplicate(df, column_name, table, version, df_qc):
 
     df_copy = df.copy()
 
+    df_copy['Public_name_no_suffix'] = get_public_name_no_suffix(df_copy['Public_name'], version)
     match version:
         case 1:
-            df_copy['Public_name_no_suffix'] = df_copy['Public_name']
             unique_public_name_string = "unique Public_name(s)"
             duplicate_string = "duplicates"
         case 2:
-            df_copy['Public_name_no_suffix'] = df_copy['Public_name'].str.replace(r'_R[1-9]$', '', regex=True)
             unique_public_name_string = "unique Public_name(s) (_R* suffix repeats considered)"
             duplicate_string = "duplicates (including _R* suffix repeats)"
 
@@ -534,34 +587,18 @@ def check_duplicate(df, column_name, table, version, df_qc):
     # Check and assign UNIQUE to unique public name marked as DUPLICATE
     df_uniques_as_duplicate = df_uniques[df_uniques[column_name]=='DUPLICATE']
     if len(df_uniques_as_duplicate) > 0:
-        config.LOG.info(f'{table} has the following {unique_public_name_string} marked as DUPLICATE in {column_name}: {", ".join(df_uniques_as_duplicate["Public_name"].tolist())}.')
+        config.LOG.info(f'{table} has the following {unique_public_name_string} marked as DUPLICATE in {column_name}: {colorlog.join_values(df_uniques_as_duplicate["Public_name"].tolist())}.')
         
         df.loc[df_uniques_as_duplicate.index, column_name] = "UNIQUE"
         UPDATED_DUPLICATE.add(table)
 
     # Check, select and assign UNIQUE to duplicated public name with none marked as UNIQUE
-    # Duplicate with ERR information takes priority
     duplicates_no_unique = set(df_duplicates['Public_name_no_suffix']) - set(df_duplicates[df_duplicates['Duplicate']=='UNIQUE']['Public_name_no_suffix'])
     if duplicates_no_unique:
-        config.LOG.info(f'{table} has the following duplicated Public_name(s) with none of their {duplicate_string} marked as UNIQUE in {column_name}: {", ".join(duplicates_no_unique)}.')
+        config.LOG.info(f'{table} has the following duplicated Public_name(s) with none of their {duplicate_string} marked as UNIQUE in {column_name}: {colorlog.join_values(duplicates_no_unique)}.')
 
         for duplicate in duplicates_no_unique:
-            candidate_lane_ids = df_duplicates[df_duplicates["Public_name_no_suffix"] == duplicate]["Lane_id"].tolist()
-            
-            candidate_qc_scores = {
-                    lane_id: 10 if df_duplicates[df_duplicates["Lane_id"] == lane_id]["ERR"].str.fullmatch(r'^[ESD]RR[0-9]{6,8}$').iloc[0] else 0
-                    for lane_id in candidate_lane_ids
-                }
-
-            df_qc_candidate = df_qc[df_qc["Lane_id"].isin(candidate_lane_ids)].copy().reset_index(drop=True)
-            for high_metric in ("Streptococcus_pneumoniae", "Genome_covered", "Depth_of_coverage"):
-                winner_lane_id = df_qc_candidate.iloc[df_qc_candidate[high_metric].astype(float).idxmax()]["Lane_id"]
-                candidate_qc_scores[winner_lane_id] += 1
-            for low_metric in ("No_of_contigs", "Hetsites_50bp"):
-                winner_lane_id = df_qc_candidate.iloc[df_qc_candidate[low_metric].astype(int).idxmin()]["Lane_id"]
-                candidate_qc_scores[winner_lane_id] += 1
-            
-            selected_lane_id = max(candidate_qc_scores, key=candidate_qc_scores.get)
+            selected_lane_id = select_unique_lane_id(df_duplicates[df_duplicates["Public_name_no_suffix"] == duplicate], df_qc)
             df.loc[df["Lane_id"] == selected_lane_id, column_name] = "UNIQUE"
         
         UPDATED_DUPLICATE.add(table)
@@ -570,10 +607,41 @@ def check_duplicate(df, column_name, table, version, df_qc):
     df_duplicates_unique_count = df_duplicates[df_duplicates['Duplicate']=='UNIQUE'].groupby(['Public_name_no_suffix']).size()
     duplicates_more_than_one_unique = df_duplicates_unique_count.index[df_duplicates_unique_count > 1].tolist()
     if duplicates_more_than_one_unique:
-        config.LOG.error(f'{table} has the following duplicated Public_name(s) with more than one of their {duplicate_string} marked as UNIQUE in {column_name}: {", ".join(duplicates_more_than_one_unique)}. Fix them manually or change all to DUPLICATE for auto-assignment.')
+        config.LOG.error(f'{table} has the following duplicated Public_name(s) with more than one of their {duplicate_string} marked as UNIQUE in {column_name}: {colorlog.join_values(duplicates_more_than_one_unique)}. Fix them manually or change all to DUPLICATE for auto-assignment.')
+        mask = df_copy['Public_name_no_suffix'].isin(duplicates_more_than_one_unique) & (df_copy[column_name] == 'UNIQUE')
+        locate_error(df, column_name, table, duplicates_more_than_one_unique, f'more than one of the {duplicate_string} marked as UNIQUE', mask=mask)
         found_error()
 
 
+# Get Public_name without the _R* suffix of repeats in version 2, as repeats are counted towards the No_of_genome and Duplicate of their originals
+def get_public_name_no_suffix(public_names, version):
+    match version:
+        case 1:
+            return public_names
+        case 2:
+            return public_names.str.replace(r'_R[1-9]$', '', regex=True)
+
+
+# Select the Lane_id to be marked as UNIQUE among the duplicates of a Public_name, based on their ERR and QC metrics in table2
+# Duplicate with ERR information takes priority, then the duplicate winning the most QC metrics; ties go to the first candidate
+def select_unique_lane_id(df_candidates, df_qc):
+    df_candidates = df_candidates.drop_duplicates("Lane_id")
+    candidate_qc_scores = {
+            lane_id: 10 if isinstance(err, str) and re.fullmatch(r'[ESD]RR[0-9]{6,8}', err) else 0
+            for lane_id, err in zip(df_candidates["Lane_id"], df_candidates["ERR"])
+        }
+
+    df_qc_candidate = df_qc[df_qc["Lane_id"].isin(candidate_qc_scores)].copy().reset_index(drop=True)
+    for high_metric in ("Streptococcus_pneumoniae", "Genome_covered", "Depth_of_coverage"):
+        winner_lane_id = df_qc_candidate.iloc[df_qc_candidate[high_metric].astype(float).idxmax()]["Lane_id"]
+        candidate_qc_scores[winner_lane_id] += 1
+    for low_metric in ("No_of_contigs", "Hetsites_50bp"):
+        winner_lane_id = df_qc_candidate.iloc[df_qc_candidate[low_metric].astype(int).idxmin()]["Lane_id"]
+        candidate_qc_scores[winner_lane_id] += 1
+
+    return max(candidate_qc_scores, key=candidate_qc_scores.get)
+
+
 # Check column values contain 1 - 20000 integers or NEW, -, _ only
 def check_in_silico_st(df, column_name, table):
     check_case(df, column_name, table)
@@ -659,10 +727,11 @@ def check_expected(df, column_name, table, expected, absolute=True):
         return
     
     if absolute:
-        config.LOG.error(f'{column_name} in {table} has the following unexpected value(s): {", ".join(extras)}.')
+        config.LOG.error(f'{column_name} in {table} has the following unexpected value(s): {colorlog.join_values(extras)}.')
+        locate_error(df, column_name, table, extras, 'unexpected value')
         found_error()
     else:
-        config.LOG.warning(f'{column_name} in {table} has the following previously unknown value(s): {", ".join(extras)}. Please check if they are correct.')
+        config.LOG.warning(f'{column_name} in {table} has the following previously unknown value(s): {colorlog.join_values(extras)}. Please check if they are correct.')
 
 
 # Check whether all strings are uppercase in the selected column, ignore values without alphabets; convert all strings to upper if any lowercase found
@@ -700,10 +769,11 @@ def check_int_range(df, column_name, table, lo, hi=float('inf'), others=None, al
         return
     
     if absolute:
-        config.LOG.error(f'{column_name} in {table} has the following unexpected value(s): {", ".join(unexpected)}.')
+        config.LOG.error(f'{column_name} in {table} has the following unexpected value(s): {colorlog.join_values(unexpected)}.')
+        locate_error(df, column_name, table, unexpected, 'unexpected value')
         found_error()
     else:
-        config.LOG.warning(f'{column_name} in {table} has the following non-standard value(s): {", ".join(unexpected)}. Please check if they are correct.')
+        config.LOG.warning(f'{column_name} in {table} has the following non-standard value(s): {colorlog.join_values(unexpected)}. Please check if they are correct.')
 
 
 # Check column values is between specific year and now or _
@@ -727,10 +797,11 @@ def check_regex(df, column_name, table, pattern=None, allow_empty=False, float_r
         return
 
     if absolute:
-        config.LOG.error(f'{column_name} in {table} has the following unexpected value(s): {", ".join(unexpected)}.')
+        config.LOG.error(f'{column_name} in {table} has the following unexpected value(s): {colorlog.join_values(unexpected)}.')
+        locate_error(df, column_name, table, unexpected, 'unexpected value')
         found_error()
     else:
-        config.LOG.warning(f'{column_name} in {table} has the following non-standard value(s): {", ".join(unexpected)}. Please check if they are correct.')
+        config.LOG.warning(f'{column_name} in {table} has the following non-standard value(s): {colorlog.join_values(unexpected)}. Please check if they are correct.')
 
 
 # If there is a repeat (Public_name with _R* suffix) marked as UNIQUE in Duplicate but does not exist in table1, attempt to create an entry in table1 based on its original metadata
@@ -760,9 +831,9 @@ def add_unique_repeat_to_metadata(df_index, table1, table3):
             repeats_without_original.append(repeat)
 
     if repeats_inserted:
-        config.LOG.info(f'The following repeats which marked as UNIQUE in {table3} are not in {table1}, but their original(s) are: {", ".join(sorted(repeats_inserted))}')
+        config.LOG.info(f'The following repeats which marked as UNIQUE in {table3} are not in {table1}, but their original(s) are: {colorlog.join_values(sorted(repeats_inserted))}')
     if repeats_without_original:
-        config.LOG.warning(f'The following repeats which marked as UNIQUE in {table3} are not in {table1}, nor their original(s): {", ".join(sorted(repeats_without_original))}')
+        config.LOG.warning(f'The following repeats which marked as UNIQUE in {table3} are not in {table1}, nor their original(s): {colorlog.join_values(sorted(repeats_without_original))}')
 
 
 # Check if there is an original Public_name (Public_name without _R* suffix) marked as UNIQUE in Duplicate but does not exist in table1
@@ -771,48 +842,99 @@ def check_missing_metadata(df_index, table1, table3):
     df_analysis = df_index[table3]
     missing_metadata = set(df_analysis[(df_analysis['Duplicate'] == 'UNIQUE') & ~(df_analysis['Public_name'].str.contains(r'_R[1-9]$'))]['Public_name']) - set(df_meta['Public_name'])
     if missing_metadata:
-        config.LOG.warning(f'The following original Public_name(s) which marked as UNIQUE in {table3} are not in {table1}: {", ".join(sorted(missing_metadata))}')
+        config.LOG.warning(f'The following original Public_name(s) which marked as UNIQUE in {table3} are not in {table1}: {colorlog.join_values(sorted(missing_metadata))}')
 
 
 # Check if Public_names in table2 and table3 are the same for the same Lane_id
 def crosscheck_public_name(df_table2, table2, df_table3, table3):
-    df_merged = df_table2[['Lane_id', 'Public_name']].merge(df_table3[['Lane_id', 'Public_name']], on='Lane_id', suffixes=('_table2', '_table3'))
-    laneids_different_public_name = df_merged[df_merged['Public_name_table2'] != df_merged['Public_name_table3']]['Lane_id'].unique().tolist()
+    if duckdb_backend.is_enabled():
+        laneids_different_public_name = duckdb_backend.get_lane_ids_with_different_public_names(df_table2, df_table3)
+    else:
+        df_merged = df_table2[['Lane_id', 'Public_name']].merge(df_table3[['Lane_id', 'Public_name']], on='Lane_id', suffixes=('_table2', '_table3'))
+        laneids_different_public_name = df_merged[df_merged['Public_name_table2'] != df_merged['Public_name_table3']]['Lane_id'].unique().tolist()
 
     if laneids_different_public_name:
-        config.LOG.error(f'The following Lane_id(s) have different Public_name(s) in {table2} and {table3}: {", ".join(sorted(laneids_different_public_name))}.')
+        config.LOG.error(f'The following Lane_id(s) have different Public_name(s) in {table2} and {table3}: {colorlog.join_values(sorted(laneids_different_public_name))}.')
+        for (df, table) in (df_table2, table2), (df_table3, table3):
+            locate_error(df, 'Lane_id', table, laneids_different_public_name, 'Lane_id with different Public_name(s) in table2 and table3')
         found_error()
 
 
 # Check that table3 is a subset of table2, and all and only genomes passed QC in table2 should be in table3
 def crosscheck_qc_and_insilico(df_table2, table2, df_table3, table3):
-    set_table2_laneid = set(df_table2["Lane_id"])
-    set_table2_laneid_passed = set(df_table2[df_table2["QC"] == "PASS"]["Lane_id"])
-    set_table2_laneid_failed  = set(df_table2[df_table2["QC"] == "FAIL"]["Lane_id"])
-    set_table3_laneid = set(df_table3["Lane_id"])
-
-    if (set_laneid_table3_only := set_table3_laneid - set_table2_laneid):
-        config.LOG.error(f'The following Lane_id(s) are found in {table3} but not {table2}: {", ".join(sorted(set_laneid_table3_only))}.')
+    if duckdb_backend.is_enabled():
+        set_laneid_table3_only, set_table3_missing_passed_laneid, set_table3_failed_laneid = duckdb_backend.get_qc_and_insilico_mismatches(df_table2, df_table3)
+    else:
+        set_table2_laneid = set(df_table2["Lane_id"])
+        set_table2_laneid_passed = set(df_table2[df_table2["QC"] == "PASS"]["Lane_id"])
+        set_table2_laneid_failed  = set(df_table2[df_table2["QC"] == "FAIL"]["Lane_id"])
+        set_table3_laneid = set(df_table3["Lane_id"])
+
+        set_laneid_table3_only = set_table3_laneid - set_table2_laneid
+        set_table3_missing_passed_laneid = set_table2_laneid_passed - set_table3_laneid
+        set_table3_failed_laneid = set_table2_laneid_failed.intersection(set_table3_laneid)
+
+    if set_laneid_table3_only:
+        config.LOG.error(f'The following Lane_id(s) are found in {table3} but not {table2}: {colorlog.join_values(sorted(set_laneid_table3_only))}.')
+        locate_error(df_table3, 'Lane_id', table3, set_laneid_table3_only, 'Lane_id not found in table2')
         found_error()
 
-    if (set_table3_missing_passed_laneid := set_table2_laneid_passed - set_table3_laneid):
-        config.LOG.error(f'The following QC passed Lane_id(s) are missing in {table3}: {", ".join(sorted(set_table3_missing_passed_laneid))}.')
+    if set_table3_missing_passed_laneid:
+        config.LOG.error(f'The following QC passed Lane_id(s) are missing in {table3}: {colorlog.join_values(sorted(set_table3_missing_passed_laneid))}.')
+        locate_error(df_table2, 'Lane_id', table2, set_table3_missing_passed_laneid, 'QC passed Lane_id missing in table3')
         found_error()
 
-    if (set_table3_failed_laneid := set_table2_laneid_failed.intersection(set_table3_laneid)):
-        config.LOG.error(f'The following QC failed Lane_id(s) are found in {table3}: {", ".join(sorted(set_table3_failed_laneid))}.')
+    if set_table3_failed_laneid:
+        config.LOG.error(f'The following QC failed Lane_id(s) are found in {table3}: {colorlog.join_values(sorted(set_table3_failed_laneid))}.')
+        locate_error(df_table3, 'Lane_id', table3, set_table3_failed_laneid, 'QC failed Lane_id found in table3')
         found_error()
 
 
 # Check if Lane_ids are unique
 def check_lane_id_is_unqiue(df, column_name, table):
-    duplicated_lane_ids = df[df[column_name].duplicated()][column_name].tolist()
+    if duckdb_backend.is_enabled():
+        duplicated_lane_ids = duckdb_backend.get_extra_occurrences(df, column_name)
+    else:
+        duplicated_lane_ids = df[df[column_name].duplicated()][column_name].tolist()
 
     if duplicated_lane_ids:
-        config.LOG.error(f'The following Lane_id(s) are duplicated in {table}: {", ".join(sorted(duplicated_lane_ids))}.')
+        config.LOG.error(f'The following Lane_id(s) are duplicated in {table}: {colorlog.join_values(sorted(duplicated_lane_ids))}.')
+        locate_error(df, column_name, table, duplicated_lane_ids, 'duplicated Lane_id')
         found_error()
 
 
 def found_error():
     global FOUND_ERRORS
-    FOUND_ERRORS = True
\ No newline at end of file
+    FOUND_ERRORS = True
+
+
+# Record the rows of the table with the values failing a validation rule in the column, i.e. their row numbers and key columns (Lane_id and Public_name, if available)
+# Rows are located in one vectorised lookup of all failing values; for rules on a combination of columns, column_name is a list and mask selects the rows instead
+def locate_error(df, column_name, table, values, rule, mask=None):
+    if mask is None:
+        mask = df[column_name].isin(list(values))
+    rows = np.flatnonzero(np.asarray(mask))
+
+    if isinstance(column_name, list):
+        row_values = df[column_name].iloc[rows].agg(', '.join, axis=1).to_numpy()
+        column_name = ', '.join(column_name)
+    else:
+        row_values = df[column_name].to_numpy()[rows]
+
+    df_rows = pd.DataFrame({
+        'Table': os.path.basename(table),
+        'Row': rows + 2,
+        'Column': column_name,
+        'Value': row_values,
+        'Lane_id': df['Lane_id'].to_numpy()[rows] if 'Lane_id' in df else '',
+        'Public_name': df['Public_name'].to_numpy()[rows] if 'Public_name' in df else '',
+        'Error': rule
+    }, columns=ERRORS_COLUMNS)
+    ERROR_ROWS.append(df_rows)
+
+
+# Get the recorded rows failing validation rules as a dataframe, ordered by table and row
+def get_error_rows():
+    if not ERROR_ROWS:
+        return pd.DataFrame(columns=ERRORS_COLUMNS)
+    return pd.concat(ERROR_ROWS, ignore_index=True).sort_values(['Table', 'Row'], kind='stable', ignore_index=True)
@@ -0,0 +1,82 @@
+# This module contains 'watch' function and its supporting functions.
+# 'watch' function keeps the processor running with its modules and reference data loaded, polls the tables of the GPS data directories and the reference files for changes,
+# and re-runs the processing for the changed data directories only (or all of them if any reference file has changed), reporting the latency of each cycle.
+
+
+import os
+import time
+import bin.config as config
+import bin.table_io as table_io
+
+
+# Tables of a GPS data directory that trigger a new processing cycle when changed; generated tables (e.g. table4) are excluded
+WATCHED_TABLES = ('table1.csv', 'table2.csv', 'table3.csv')
+
+
+# Run process_func for all data directories, then keep polling every interval seconds and run process_func for changed data directories until interrupted
+# process_func takes a set of changed data directory paths, or None if all data directories should be processed
+def watch(process_func, paths, interval):
+    config.LOG.info(f'Watching {", ".join(paths)} and the reference files for changes every {interval} second(s). Press Ctrl+C to stop.')
+
+    try:
+        # Data directories of a halted cycle (None for all) are processed again in the next cycle, as their outputs are not up to date
+        pending = set() if run_cycle(process_func, None) else None
+        signatures = get_signatures(paths)
+
+        while True:
+            time.sleep(interval)
+
+            if (latest_signatures := get_signatures(paths)) == signatures:
+                continue
+
+            # Wait until the files stop changing, so a table that is still being written is not processed
+            while (settled_signatures := get_signatures(paths)) != latest_signatures:
+                latest_signatures = settled_signatures
+                time.sleep(interval)
+
+            if latest_signatures[None] != signatures[None]:
+                config.LOG.info('Change in the reference files is detected, reloading reference data now...')
+                config.load_reference_data()
+                changed = None
+            else:
+                changed = {path for path in paths if latest_signatures[path] != signatures[path]}
+                config.LOG.info(f'Change in {", ".join(sorted(changed))} is detected.')
+                changed = None if pending is None else changed | pending
+
+            pending = set() if run_cycle(process_func, changed) else changed
+
+            # Take the signatures after the cycle, as the cycle itself might update the tables (e.g. case conversion) or the reference files (e.g. new coordinates)
+            signatures = get_signatures(paths)
+    except KeyboardInterrupt:
+        config.LOG.info('Watch mode is stopped.')
+
+
+# Run a processing cycle and report its latency, return whether the cycle is completed; a halted cycle does not stop the watch mode, the next change triggers another cycle
+def run_cycle(process_func, changed):
+    start = time.perf_counter()
+
+    try:
+        process_func(changed)
+    except SystemExit:
+        config.LOG.error(f'The processing cycle is halted after {time.perf_counter() - start:.2f} second(s). Waiting for the next change...')
+        return False
+
+    config.LOG.info(f'The processing cycle is completed in {time.perf_counter() - start:.2f} second(s). Waiting for the next change...')
+    return True
+
+
+# Get the (mtime, size) signatures of the watched tables of each data directory and of the reference files; missing files have None as signature
+def get_signatures(paths):
+    signatures = {path: tuple(get_signature(table_io.find_table(path, table)) for table in WATCHED_TABLES) for path in paths}
+    # Reference files are keyed by None, which cannot clash with a data directory path
+    signatures[None] = tuple(get_signature(reference_file) for reference_file in config.get_reference_files())
+    return signatures
+
+
+# Get the (mtime, size) signature of a file, or None if it does not exist
+def get_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
@@ -3,47 +3,131 @@
 import argparse
 import sys
 import os
+import bin.startup_profile as startup_profile
 import bin.config as config
-import bin.validator as validator
-import bin.get_csv as get_csv
-import bin.get_json as get_json
+import bin.table_io as table_io
+import bin.duckdb_backend as duckdb_backend
+import bin.polars_engine as polars_engine
+import bin.colorlog as colorlog
+import bin.run_manifest as run_manifest
+import bin.scheduler as scheduler
+
+
+# Modules of the processing stages are imported on first use, so stages that are not run (e.g. all but validation in --check mode) do not add to the startup time
+validator = startup_profile.lazy_import('bin.validator')
+get_csv = startup_profile.lazy_import('bin.get_csv')
+get_json = startup_profile.lazy_import('bin.get_json')
+get_cube = startup_profile.lazy_import('bin.get_cube')
+watch = startup_profile.lazy_import('bin.watch')
+query_service = startup_profile.lazy_import('bin.query_service')
 
 
 def main():
-    config.init()
+    with startup_profile.timed('init', 'config'):
+        config.init()
 
     args = parse_arguments()
 
-    gps_provided = [(version + 1, path) for version, path in enumerate((args.gps1, args.gps2)) if bool(path)]
+    if args.log_json:
+        colorlog.add_json_sink(args.log_json)
+
+    try:
+        run(args)
+    finally:
+        if args.startup_profile:
+            startup_profile.report(config.LOG)
+
+
+# Run the processing once, or keep running in watch mode
+def run(args):
+    gps_provided = get_gps_provided(args)
 
     check_arguments(args, gps_provided)
 
+    # The query service runs in background threads, serving the Monocle table generated by the processing (if any) in the working directory
+    if args.serve:
+        query_service.start(args.port, args.interval)
+        if not gps_provided:
+            query_service.wait()
+            return
+
+    # In watch mode, keep processing the changed data directories; Monocle dataframes of unchanged data directories are kept in memory between cycles
+    if args.watch:
+        monocle_datasets = {}
+        watch.watch(lambda changed: process(args, gps_provided, changed, monocle_datasets), [path for (_, path) in gps_provided], args.interval)
+        return
+
+    process(args, gps_provided)
+
+    if args.serve:
+        query_service.wait()
+
+
+# Process the data directories in changed (all data directories if None)
+# Optionally provide monocle_datasets to reuse the Monocle dataframes of unchanged data directories
+# Each processing is recorded in run_manifest.json, with the hashes of all tables and reference files as inputs
+def process(args, gps_provided, changed=None, monocle_datasets=None):
+    gps_changed = [(version, path) for (version, path) in gps_provided if changed is None or path in changed]
+
+    if monocle_datasets is not None:
+        for (_, path) in gps_changed:
+            monocle_datasets.pop(path, None)
+
+    input_files = [table_io.find_table(path, table) for (_, path) in gps_provided for table in ("table1.csv", "table2.csv", "table3.csv")] + list(config.get_reference_files())
+    with run_manifest.run(input_files, args.trace_memory):
+        # The stages are run in dependency order; with --jobs, independent stages (e.g. those of GPS1 and GPS2) run concurrently
+        scheduler.run_stages(get_stages(args, gps_provided, gps_changed, monocle_datasets), args.jobs, args.trace_memory, args.force)
+
+        if args.check:
+            return
+
+        config.LOG.info('The processing is completed. Data is validated and all files are generated.')
+
+
+# Get the processing stages of the data directories in gps_changed, each with the files it reads and writes; Monocle data is generated from all data directories in gps_provided
+# The generated outputs are cached, i.e. their stages are skipped if their inputs have not changed since they were last generated
+# Tables may be compressed (e.g. table1.csv.gz); generated tables are compressed with --compress
+def get_stages(args, gps_provided, gps_changed, monocle_datasets):
+    stages = []
+
     # Validate all tables
     # Perform in-place letter case fix if not in validation only mode
-    for (version, path) in gps_provided:
-        validator.validate(path, version, args.check)
+    for (version, path) in gps_changed:
+        tables = [table_io.find_table(path, table) for table in ("table1.csv", "table2.csv", "table3.csv")]
+        stages.append(scheduler.Stage('validation', validator.validate, (path, version, args.check), inputs=tables, outputs=tables, target=path))
 
-    # Early exit if in validation only mode
+    # Only validate in validation only mode
     if args.check:
-        return
+        return stages
 
     # Generate table 4
-    for (_, path) in gps_provided:
-        get_csv.get_table4(path, args.location)
+    # Fetching coordinates via MapBox API prompts for input, so it is done in the main process
+    table4_outputs = {path: table_io.get_output_path(os.path.join(path, "table4.csv"), args.compress) for (_, path) in gps_changed}
+    for (_, path) in gps_changed:
+        stages.append(scheduler.Stage('table4', get_csv.get_table4, (path, args.location, args.compress),
+                                      inputs=[table_io.find_table(path, table) for table in ("table1.csv", "table3.csv")], outputs=[table4_outputs[path]],
+                                      target=path, local=args.location, cached=True))
 
-    # Generate Monocle data and GPS Database Overview data payload
+    # Generate Monocle data, GPS Database Overview count cube and data payload
+    # Monocle table is generated in the main process, as the dataframes of the data directories are kept in its memory in watch mode
+    # Count cube is declared before data payload, as generating data payload modifies the Monocle dataframe when they run one after another
     if args.monocle:
-        monocle_table = get_csv.get_monocle(args.gps1, args.gps2)
-        get_json.get_data(monocle_table)
+        # table4 of the data directories not processed in this cycle (in watch mode) is read as it is saved
+        tables = [table_io.find_table(path, table) for (_, path) in gps_provided for table in ("table1.csv", "table2.csv", "table3.csv")]
+        tables += [table4_outputs.get(path) or table_io.find_table(path, "table4.csv") for (_, path) in gps_provided]
+        outputs = [table_io.get_output_path('table_monocle.csv', args.compress), 'published_public_names.txt']
+        stages.append(scheduler.Stage('monocle', get_csv.get_monocle, (tuple(gps_provided), monocle_datasets, args.compress), inputs=tables, outputs=outputs, local=True, cached=True))
+        stages.append(scheduler.Stage('data_cube', get_cube.get_cube, (scheduler.Result('monocle'),), outputs=['data_cube.npz'], cached=True))
+        stages.append(scheduler.Stage('data_json', get_json.get_data, (scheduler.Result('monocle'), args.shard), outputs=['data.json', 'data_shards'] if args.shard else ['data.json'], cached=True))
 
-    config.LOG.info('The processing is completed. Data is validated and all files are generated.')
+    return stages
 
 
 # Parse arguments
 def parse_arguments():
     parser = argparse.ArgumentParser(
         allow_abbrev=False,
-        description='Process GPS (Global Pneumococcal Sequencing Project) database updates. This tool validates data from GPS1 and/or GPS2; generates table4; generate Monocle Table and data payload of the GPS Database Overview.',
+        description='Process GPS (Global Pneumococcal Sequencing Project) database updates. This tool validates data from GPS1, GPS2 and/or additional GPS datasets; generates table4; generate Monocle Table and data payload of the GPS Database Overview.',
         epilog='If you have updated any files in the "data" directory, please submit a PR to https://github.com/sanger-bentley-group/gps-database-processor',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
@@ -60,6 +144,14 @@ def parse_arguments():
         help='path to directory of GPS2 data'
     )
 
+    parser.add_argument(
+        '-d', '--dataset',
+        action='append',
+        default=[],
+        metavar='VERSION:PATH',
+        help=f'version and path to directory of an additional GPS dataset (e.g. 2:gps3-data), validated and processed with the table schemas of its version ({", ".join(map(str, config.DATASET_VERSIONS))}); can be repeated'
+    )
+
     parser.add_argument(
         '-c', '--check',
         action="store_true",
@@ -69,7 +161,13 @@ def parse_arguments():
     parser.add_argument(
         '-m', '--monocle',
         action="store_true",
-        help='generate Monocle table and GPS Database Overview data payload from both GPS1 and GPS2'
+        help='generate Monocle table, GPS Database Overview count cube and data payload from all GPS datasets'
+    )
+
+    parser.add_argument(
+        '-s', '--shard',
+        action="store_true",
+        help='in addition to data.json, save GPS Database Overview data payload as a summary index and per-country shards in data_shards directory for lazy loading'
     )
 
     parser.add_argument(
@@ -78,23 +176,162 @@ def parse_arguments():
         help='get coordinates for locations not yet exist in data/coordinates.csv via MapBox API'
     )
 
+    parser.add_argument(
+        '--io-engine',
+        choices=table_io.ENGINES,
+        default='pandas',
+        help='engine for reading and writing tables; arrow uses the multithreaded Arrow CSV reader and writer (requires pyarrow)'
+    )
+
+    parser.add_argument(
+        '--compress',
+        choices=table_io.COMPRESSIONS,
+        default=None,
+        help='compress the generated table4 and Monocle table (e.g. table4.csv.gz); tables compressed with gzip (.csv.gz) or zstd (.csv.zst) are always read directly, and validation fixes are saved in the compression of their tables (zstd requires pyarrow)'
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='number of worker processes to run independent stages (e.g. validation and table4 of GPS1 and GPS2) concurrently'
+    )
+
+    parser.add_argument(
+        '--frame-engine',
+        choices=polars_engine.ENGINES,
+        default='pandas',
+        help='engine for generating table4, Monocle table and data payload; polars runs them on multithreaded Polars lazy frames (requires polars and pyarrow)'
+    )
+
+    parser.add_argument(
+        '-f', '--force',
+        action="store_true",
+        help='regenerate all outputs, even if their inputs have not changed since they were last generated'
+    )
+
+    parser.add_argument(
+        '--backend',
+        choices=duckdb_backend.BACKENDS,
+        default='pandas',
+        help='backend for cross-table checks, uniqueness checks, No_of_genome counts and Monocle table joins; duckdb runs them as multithreaded SQL, the validation checks over the loaded tables and the Monocle table joins over the tables on disk, spilling to disk when they do not fit in memory (requires duckdb)'
+    )
+
+    parser.add_argument(
+        '-w', '--watch',
+        action="store_true",
+        help='keep running and re-process the data directories whenever their tables or the reference files change, until stopped by Ctrl+C'
+    )
+
+    parser.add_argument(
+        '--interval',
+        type=float,
+        default=2,
+        help='interval in seconds between checks for changes (only used in --watch and --serve mode)'
+    )
+
+    parser.add_argument(
+        '--serve',
+        action="store_true",
+        help='serve filter, count and lookup queries over table_monocle.csv in the working directory via a local HTTP service, reloading it whenever it is regenerated; without data directories, only serve the existing table'
+    )
+
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=8000,
+        help='port of the local HTTP query service (only used in --serve mode)'
+    )
+
+    parser.add_argument(
+        '--trace-memory',
+        action="store_true",
+        help='trace Python memory allocations to record the peak memory of each stage in run_manifest.json (slows down the processing)'
+    )
+
+    parser.add_argument(
+        '--log-json',
+        default=None,
+        help='path to also save the log as a JSON Lines file, one JSON object (time, level, message) per log record'
+    )
+
+    parser.add_argument(
+        '--startup-profile',
+        action="store_true",
+        help='report the time spent on importing each module and loading each reference file when the processor exits'
+    )
+
     return parser.parse_args()
 
+
+# Get (version, path) of the provided GPS datasets: GPS1, GPS2, then the additional datasets in the order they are provided
+def get_gps_provided(args):
+    gps_provided = [(version + 1, path) for version, path in enumerate((args.gps1, args.gps2)) if bool(path)]
+
+    for dataset in args.dataset:
+        version, _, path = dataset.partition(':')
+        if not version.isdigit() or int(version) not in config.DATASET_VERSIONS or not path:
+            config.LOG.critical(f'{dataset} is not a valid dataset. A dataset should be provided as VERSION:PATH, where VERSION is one of {", ".join(map(str, config.DATASET_VERSIONS))}. The process will now be halted.')
+            sys.exit(1)
+        gps_provided.append((int(version), path))
+
+    return gps_provided
+
 # Check input arguments are logical, and all tables exist in the path(s)
 def check_arguments(args, gps_provided):
     if args.monocle:
-        if len(gps_provided) != 2:
-            config.LOG.critical(f'To generate Monocle-related data, paths to both GPS1 data and GPS2 data are required. The process will now be halted.')
+        if {version for (version, _) in gps_provided} != set(config.DATASET_VERSIONS):
+            config.LOG.critical(f'To generate Monocle-related data, paths to both GPS1 data and GPS2 data (or other datasets of both versions) are required. The process will now be halted.')
             sys.exit(1)
     else:
-        if len(gps_provided) == 0:
-            config.LOG.critical(f'At least one path to either GPS1 data and GPS2 data is required. The process will now be halted.')
+        if len(gps_provided) == 0 and not args.serve:
+            config.LOG.critical(f'At least one path to either GPS1 data, GPS2 data or an additional dataset is required. The process will now be halted.')
             sys.exit(1)
+
+    if len({os.path.abspath(path) for (_, path) in gps_provided}) != len(gps_provided):
+        config.LOG.critical(f'The same data directory is provided more than once. The process will now be halted.')
+        sys.exit(1)
+
+    if args.jobs < 1:
+        config.LOG.critical(f'The number of jobs must be at least 1. The process will now be halted.')
+        sys.exit(1)
+
+    try:
+        table_io.set_engine(args.io_engine)
+    except ImportError:
+        config.LOG.critical(f'The {args.io_engine} engine requires pyarrow, which is not installed. The process will now be halted.')
+        sys.exit(1)
+
+    try:
+        duckdb_backend.set_backend(args.backend)
+    except ImportError:
+        config.LOG.critical(f'The {args.backend} backend requires duckdb, which is not installed. The process will now be halted.')
+        sys.exit(1)
+
+    try:
+        polars_engine.set_engine(args.frame_engine)
+    except ImportError:
+        config.LOG.critical(f'The {args.frame_engine} frame engine requires polars and pyarrow, which are not installed. The process will now be halted.')
+        sys.exit(1)
     
     for (ver, gps) in gps_provided:
-        table1_path, table2_path, table3_path = (os.path.join(gps, table) for table in ("table1.csv", "table2.csv", "table3.csv"))
+        table1_path, table2_path, table3_path = (table_io.find_table(gps, table) for table in ("table1.csv", "table2.csv", "table3.csv"))
         if not all((os.path.isfile(table1_path), os.path.isfile(table2_path), os.path.isfile(table3_path))):
-            config.LOG.critical(f'{gps} does not contain all required files (table1.csv, table2.csv, table3.csv). The process will now be halted.')
+            config.LOG.critical(f'{gps} does not contain all required files (table1.csv, table2.csv, table3.csv, or their compressed versions). The process will now be halted.')
+            sys.exit(1)
+
+        # A table saved both uncompressed and compressed (e.g. table1.csv and table1.csv.gz) is ambiguous
+        for table in ("table1.csv", "table2.csv", "table3.csv"):
+            if len(paths := [path for path in table_io.get_table_paths(os.path.join(gps, table)) if os.path.isfile(path)]) > 1:
+                config.LOG.critical(f'{gps} contains more than one version of {table}: {", ".join(paths)}. Please keep only one of them. The process will now be halted.')
+                sys.exit(1)
+
+    # zstd streams are handled by pyarrow
+    if args.compress == 'zstd' or any(table_io.get_compression(table_io.find_table(gps, table)) == 'zstd' for (_, gps) in gps_provided for table in ("table1.csv", "table2.csv", "table3.csv")):
+        try:
+            import pyarrow
+        except ImportError:
+            config.LOG.critical(f'Reading or writing zstd compressed tables requires pyarrow, which is not installed. The process will now be halted.')
             sys.exit(1)
 
 
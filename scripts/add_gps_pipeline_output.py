@@ -6,38 +6,133 @@ import argparse
 import sys
 import os
 import re
+import functools
+import glob
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from collections import defaultdict
 
+# Allow shared modules of the GPS Database Processor to be imported
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bin.table_io as table_io
+import bin.table_cache as table_cache
+import bin.key_index as key_index
+import bin.reference_cache as reference_cache
+import bin.validator as validator
+
 
 def main():
     args = parse_arguments()
     
-    df_results, df_info, table2_path, table3_path, df_table2, df_table3, df_gpsc_colour, df_serotype_colour = args_check(args)
+    runs, table2_path, table3_path, df_table2, df_table3, dict_gpsc_colour, dict_serotype_colour = args_check(args)
     
-    df_table2_new_data = generate_table2_data(df_results, df_info, args.version, args.assembler)
-    df_table3_new_data = generate_table3_data(df_results, df_info, df_gpsc_colour, df_serotype_colour)
+    df_table2_new_data, df_table3_new_data = generate_new_data(runs, args.version, args.assembler, dict_gpsc_colour, dict_serotype_colour)
+
+    # Existing Lane_id(s) are looked up in the key index of the data directory instead of the tables
+    data_key_index = key_index.load_key_index(args.data)
+
+    # Existing samples sharing Public_name with the new samples have their No_of_genome updated, so their rows have to be rewritten instead of appended
+    if args.append and has_existing_public_name(df_table3_new_data, data_key_index):
+        print(f"Warning: Append mode is turned off, as some new samples share Public_name with existing samples, whose No_of_genome have to be updated; {table2_path} and {table3_path} are rewritten in full.")
+        args.append = False
+        df_table2 = table_cache.read_csv(table2_path)
+        df_table3 = table_cache.read_csv(table3_path)
 
-    df_table2_updated = integrate_table2(df_table2_new_data, df_table2, table2_path)
-    df_table3_updated = integrate_table3(df_table3_new_data, df_table3, table3_path)
+    df_table3_new_data = assign_no_of_genome_and_duplicate(df_table3_new_data, df_table3, df_table2_new_data, df_table2)
 
-    save_tables(df_table2_updated, table2_path, df_table3_updated, table3_path)
+    if args.append:
+        append_tables(df_table2_new_data, table2_path, df_table3_new_data, table3_path, data_key_index)
+    else:
+        df_table2_updated = integrate_table2(df_table2_new_data, df_table2, table2_path, data_key_index)
+        df_table3_updated = integrate_table3(df_table3_new_data, df_table3, table3_path, data_key_index)
+
+        save_tables(df_table2_updated, table2_path, df_table3_updated, table3_path)
 
 
 # Check files/paths actually exist, and load them into dataframes and save paths
 def args_check(args):
     try:
-        df_results = pd.read_csv(args.results, dtype=str, keep_default_na=False)
+        table_io.set_engine(args.io_engine)
+    except ImportError:
+        sys.exit(f"Error: The {args.io_engine} engine requires pyarrow, which is not installed!")
+
+    runs = [read_run(results, info) for results, info in get_run_paths(args)]
+
+    if not os.path.isdir(args.data):
+        sys.exit(f"Error: {args.data} is not a valid directory path!")
+    try:
+        # Tables may be compressed (e.g. table2.csv.gz), and are saved in the same compression
+        table2_path = table_io.find_table(args.data, "table2.csv")
+        table3_path = table_io.find_table(args.data, "table3.csv")
+
+        # Rows cannot be appended to compressed tables in place, so they are rewritten instead
+        if args.append and (compressed_tables := [table_path for table_path in (table2_path, table3_path) if table_io.get_compression(table_path)]):
+            print(f"Warning: Append mode is turned off, as rows cannot be appended to compressed table(s) in place: {', '.join(compressed_tables)}; {table2_path} and {table3_path} are rewritten in full.")
+            args.append = False
+
+        # Existing tables are not loaded in append mode, as existing samples are checked with the key index
+        if args.append:
+            if not all((os.path.isfile(table2_path), os.path.isfile(table3_path))):
+                raise FileNotFoundError
+            df_table2 = df_table3 = None
+        else:
+            df_table2 = table_cache.read_csv(table2_path)
+            df_table3 = table_cache.read_csv(table3_path)
     except FileNotFoundError:
-        sys.exit(f"Error: {args.results} is not found!")
+        sys.exit(f"Error: table2.csv and/or table3.csv (or their compressed versions) are not found in {args.data}!")
+
+    for colour_file in (args.gpsccolour, args.serotypecolour):
+        if not os.path.isfile(colour_file):
+            sys.exit(f"Error: {colour_file} is not found!")
+
+    # Load colour assignments from the compiled cache, which is only rebuilt when either colour assignment file has changed
+    dict_gpsc_colour, dict_serotype_colour = reference_cache.load(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "colours.pickle"),
+        (args.gpsccolour, args.serotypecolour),
+        lambda: read_colours(args.gpsccolour, args.serotypecolour)
+    )
+
+    return runs, table2_path, table3_path, df_table2, df_table3, dict_gpsc_colour, dict_serotype_colour
+
+
+# Read GPSC and serotype colour assignment files into dictionaries of GPSC: colour and serotype: colour
+def read_colours(gpsc_colour_file, serotype_colour_file):
+    df_gpsc_colour = table_io.read_csv(gpsc_colour_file)
+    df_serotype_colour = table_io.read_csv(serotype_colour_file)
+
+    dict_gpsc_colour = df_gpsc_colour.set_index("GPSC")["GPSC__colour"].to_dict()
+    dict_serotype_colour = df_serotype_colour.set_index("In_silico_serotype")["In_silico_serotype__colour"].to_dict()
+
+    return dict_gpsc_colour, dict_serotype_colour
+
+
+# Get paths of results.csv and info.csv of all runs, either from run directories matching --runs, or by pairing --results and --info by position
+def get_run_paths(args):
+    if args.runs:
+        run_dirs = sorted(run_dir for run_dir in glob.glob(args.runs) if os.path.isdir(run_dir))
+        if not run_dirs:
+            sys.exit(f"Error: No directory matches {args.runs}!")
+        return [(os.path.join(run_dir, "results.csv"), os.path.join(run_dir, "info.csv")) for run_dir in run_dirs]
+
+    if len(args.results) != len(args.info):
+        sys.exit(f"Error: {len(args.results)} results.csv and {len(args.info)} info.csv are provided, each results.csv must be paired with an info.csv!")
+    return list(zip(args.results, args.info))
+
+
+# Check results.csv and info.csv of a run exist, and load them into dataframes
+def read_run(results, info):
+    try:
+        df_results = table_io.read_csv(results)
+    except FileNotFoundError:
+        sys.exit(f"Error: {results} is not found!")
     
     try:
-        df_info = pd.read_csv(args.info, dtype=str, keep_default_na=False)
+        df_info = table_io.read_csv(info)
 
         if any((df_info["Lane_id"] == "") | (df_info["Public_name"] == "")):
-            sys.exit(f"Error: One or more rows in {args.info} are missing Lane_id and/or Public_name!")
+            sys.exit(f"Error: One or more rows in {info} are missing Lane_id and/or Public_name!")
 
         if missing_laneids := (set(df_results["Sample_ID"]) - set(df_info["Lane_id"])):
-            sys.exit(f"Error: Information of the following Lane ID(s) are not provided: {', '.join(sorted(missing_laneids))}")
+            sys.exit(f"Error: Information of the following Lane ID(s) are not provided in {info}: {', '.join(sorted(missing_laneids))}")
 
         optional_columns = ["Supplier_name", "Sanger_sample_id", "ERR", "ERS"]
         for col in optional_columns:
@@ -46,31 +141,38 @@ def args_check(args):
             else:
                 df_info[col] = df_info[col].replace("", "_")
     except FileNotFoundError:
-        sys.exit(f"Error: {args.info} is not found!")
+        sys.exit(f"Error: {info} is not found!")
 
+    return df_results, df_info
 
-    if not os.path.isdir(args.data):
-        sys.exit(f"Error: {args.data} is not a valid directory path!")
-    try:
-        table2_path = os.path.join(args.data, "table2.csv")
-        table3_path = os.path.join(args.data, "table3.csv")
 
-        df_table2 = pd.read_csv(table2_path, dtype=str, keep_default_na=False)
-        df_table3 = pd.read_csv(table3_path, dtype=str, keep_default_na=False)
-    except FileNotFoundError:
-        sys.exit(f"Error: table2.csv and/or table3.csv are not found in {args.data}!")
+# Generate table2 and table3 data of all runs, multiple runs are processed in parallel by a process pool
+# Workers are initialised with the table I/O engine of the main process, as they do not inherit it when started by spawn (e.g. on macOS and Windows)
+# Return the combined table2 and table3 data (table3 data is None if all samples failed QC)
+def generate_new_data(runs, pipeline_version, assembler, dict_gpsc_colour, dict_serotype_colour):
+    if len(runs) == 1:
+        results = [generate_run_data(*runs[0], pipeline_version, assembler, dict_gpsc_colour, dict_serotype_colour)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(len(runs), os.cpu_count()), initializer=table_io.set_engine, initargs=(table_io.ENGINE,)) as executor:
+            futures = [executor.submit(generate_run_data, df_results, df_info, pipeline_version, assembler, dict_gpsc_colour, dict_serotype_colour) for df_results, df_info in runs]
+            results = [future.result() for future in futures]
 
-    try:
-        df_gpsc_colour = pd.read_csv(args.gpsccolour, dtype=str, keep_default_na=False)
-    except FileNotFoundError:
-        sys.exit(f"Error: {args.gpsccolour} is not found!")
-    
-    try:
-        df_serotype_colour = pd.read_csv(args.serotypecolour, dtype=str, keep_default_na=False)
-    except FileNotFoundError:
-        sys.exit(f"Error: {args.serotypecolour} is not found!")
+    df_table2_new_data = pd.concat([df_table2_run_data for df_table2_run_data, _ in results], ignore_index=True)
+    dfs_table3_run_data = [df_table3_run_data for _, df_table3_run_data in results if df_table3_run_data is not None]
+    df_table3_new_data = pd.concat(dfs_table3_run_data, ignore_index=True) if dfs_table3_run_data else None
+
+    # Ensure each Lane_id only appears once across all runs
+    if duplicated_lane_id := set(df_table2_new_data.loc[df_table2_new_data["Lane_id"].duplicated(), "Lane_id"]):
+        sys.exit(f"Error: The following Lane_ID(s) are found more than once in the provided results: {', '.join(sorted(duplicated_lane_id))}.")
 
-    return df_results, df_info, table2_path, table3_path, df_table2, df_table3, df_gpsc_colour, df_serotype_colour
+    return df_table2_new_data, df_table3_new_data
+
+
+# Generate table2 and table3 data of a run
+def generate_run_data(df_results, df_info, pipeline_version, assembler, dict_gpsc_colour, dict_serotype_colour):
+    df_table2_run_data = generate_table2_data(df_results, df_info, pipeline_version, assembler)
+    df_table3_run_data = generate_table3_data(df_results, df_info, dict_gpsc_colour, dict_serotype_colour)
+    return df_table2_run_data, df_table3_run_data
 
 
 # Generate table2 data for integration
@@ -80,8 +182,7 @@ def generate_table2_data(df_results, df_info, pipeline_version, assembler):
     df_table2_new_data = df_table2_new_data.merge(df_info, left_on="Sample_ID", right_on="Lane_id", how="left")
 
     # Convert all content to UPPER case
-    for col in df_table2_new_data.columns:
-        df_table2_new_data[col] = df_table2_new_data[col].str.upper()
+    df_table2_new_data = pd.concat(run_kernels([(col, df_table2_new_data[col], UPPER_KERNELS) for col in df_table2_new_data.columns]), axis=1)
 
     # Add used pipeline version based on user input
     df_table2_new_data["Pipeline_version"] = pipeline_version
@@ -108,7 +209,7 @@ def generate_table2_data(df_results, df_info, pipeline_version, assembler):
     return df_table2_new_data
 
 
-def generate_table3_data(df_results, df_info, df_gpsc_colour, df_serotype_colour):
+def generate_table3_data(df_results, df_info, dict_gpsc_colour, dict_serotype_colour):
     df_table3_new_data = df_results[df_results["Overall_QC"] == "PASS"].copy()
 
     # Return None if all samples failed QC
@@ -118,11 +219,10 @@ def generate_table3_data(df_results, df_info, df_gpsc_colour, df_serotype_colour
     df_table3_new_data = df_table3_new_data.merge(df_info, left_on="Sample_ID", right_on="Lane_id", how="left")
 
     # Convert all content to UPPER case
-    for col in df_table3_new_data.columns:
-        df_table3_new_data[col] = df_table3_new_data[col].str.upper()
+    df_table3_new_data = pd.concat(run_kernels([(col, df_table3_new_data[col], UPPER_KERNELS) for col in df_table3_new_data.columns]), axis=1)
 
     # Add No_of_genome and Duplicate columns with placeholders values
-    # Values will be updated by the GPS Database Processor
+    # Values will be assigned by assign_no_of_genome_and_duplicate function after all new data is generated
     df_table3_new_data["No_of_genome"] = 1
     df_table3_new_data["Duplicate"] = "DUPLICATE"
 
@@ -174,9 +274,8 @@ def generate_table3_data(df_results, df_info, df_gpsc_colour, df_serotype_colour
 
     # Check all GPSCs have colours assigned, then assign those colours
     # No GPSC assignment as TRANSPARENT, also change no assignment value from NA to _
-    dict_gpsc_colour = df_gpsc_colour.set_index("GPSC")["GPSC__colour"].to_dict()
     df_table3_new_data["GPSC"] = df_table3_new_data["GPSC"].replace("NA", "_")
-    dict_gpsc_colour["_"] = "TRANSPARENT"
+    dict_gpsc_colour = {**dict_gpsc_colour, "_": "TRANSPARENT"}
     if gpsc_no_colour := (set(df_table3_new_data["GPSC"]) - set(dict_gpsc_colour)):
         sys.exit(f"Error: The following GPSC(s) are not found in the selected GPSC colour assignment file: {', '.join(sorted(gpsc_no_colour))}")
     columns_to_add.append(df_table3_new_data["GPSC"].map(dict_gpsc_colour).rename("GPSC__colour"))
@@ -184,148 +283,59 @@ def generate_table3_data(df_results, df_info, df_gpsc_colour, df_serotype_colour
     # Strip leading 0 anywhere in serotype, and "but..." warning
     # Check all serotypes have colours assigned, then assign those colours 
     df_table3_new_data["In_silico_serotype"] = df_table3_new_data["In_silico_serotype"].str.replace(r"0([1-9])", r"\1", regex=True).str.replace(r"\s+but\s.+$", "", regex=True, case=False)
-    if serotype_no_colour := (set(df_table3_new_data["In_silico_serotype"]) - set(df_serotype_colour["In_silico_serotype"])):
+    if serotype_no_colour := (set(df_table3_new_data["In_silico_serotype"]) - set(dict_serotype_colour)):
         sys.exit(f"Error: The following serotype(s) are not found in the selected serotype colour assignment file: {', '.join(sorted(serotype_no_colour))}")
-    columns_to_add.append(df_table3_new_data["In_silico_serotype"].map(df_serotype_colour.set_index("In_silico_serotype")["In_silico_serotype__colour"]).rename("In_silico_serotype__colour"))
+    columns_to_add.append(df_table3_new_data["In_silico_serotype"].map(dict_serotype_colour).rename("In_silico_serotype__colour"))
 
     # Remove spaces, leading = and duplicated NF (happen in PBP AMR), and fill empty as _ in WGS columns
-    for col in df_table3_new_data.columns:
-        if col.startswith("WGS_") and "_SIR" not in col:
-            df_table3_new_data[col] = df_table3_new_data[col].str.replace(" ", "").str.replace("^=", "", regex=True).str.replace(r"^(NF){2,}$", "NF", regex=True).str.replace(r"^$", "_", regex=True)
+    for s_mic in run_kernels([(col, df_table3_new_data[col], MIC_KERNELS) for col in df_table3_new_data.columns if col.startswith("WGS_") and "_SIR" not in col]):
+        df_table3_new_data[s_mic.name] = s_mic
     
     # Generate EC based on ERY_Determinant with table3 
-    def ec_format_convert(determinants):
-        if determinants == "_":
-            return "NEG"
-        ret = set(determinant.split("_")[0] for determinant in determinants.split("; "))
-        return ":".join(sorted(ret))
-
-    columns_to_add.append(df_table3_new_data["ERY_Determinant"].apply(ec_format_convert).rename("EC"))
+    columns_to_add.append(map_distinct(df_table3_new_data["ERY_Determinant"], ec_format_convert).rename("EC"))
 
     # Generate Cot based on COT_Determinant with table3 format and LOW COVERAGE warnings removed
-    def cot_format_convert(determinants):
-        fola_determinants = set()
-        folp_determinants = set()
-
-        for determinant in determinants.split("; "):
-            matches = re.match(r"^(FOL[AP])_.+ (?>(.+) AT ([0-9-]+))?(?>VARIANT (.+))?$", determinant)
-            if not matches:
-                continue
-            gene, disruption, location, variant =  matches.groups()
-            if gene == "FOLA":
-                fola_determinants.add(variant)
-            elif gene == "FOLP":
-                folp_determinants.add(f"{location}_{disruption}")
-        
-        ret_list = []
-
-        if fola_determinants:
-            ret_list.append(f"FOLA_{'_'.join(sorted(fola_determinants))}")
-        if folp_determinants:
-            ret_list.append(':'.join(f"FOLP_{determinant}" for determinant in sorted(folp_determinants)))
-
-        return ":".join(ret_list) if ret_list else "NEG"
-    
-    columns_to_add.append(s_cot := df_table3_new_data["COT_Determinant"].apply(cot_format_convert).rename("Cot"))
+    columns_to_add.append(s_cot := map_distinct(df_table3_new_data["COT_Determinant"], cot_format_convert).rename("Cot"))
 
     # Generate Tet__autocolour based on TET_Determinant with table3 format
-    def tet_format_convert(determinants):
-        if determinants == "_":
-            return "NEG"
-        ret = set(determinant.split("_")[0] for determinant in determinants.split("; "))
-        return ":".join(sorted(ret))
-    
-    columns_to_add.append(df_table3_new_data["TET_Determinant"].apply(tet_format_convert).rename("Tet__autocolour"))
+    columns_to_add.append(map_distinct(df_table3_new_data["TET_Determinant"], tet_format_convert).rename("Tet__autocolour"))
 
     # Generate FQ__autocolour based on FQ_Determinant with table3 format
-    def fq_format_convert(determinants):
-        dict_determinants = defaultdict(set)
-
-        for determinant in determinants.split("; "):
-            matches = re.match(r"^(.+)_.+ VARIANT (.+)$", determinant)
-            if not matches:
-                continue
-            gene, variant =  matches.groups()
-            dict_determinants[gene].add(variant)
-        
-        ret_list = [f"{gene}_{';'.join(sorted(determinants))}" for gene, determinants in dict_determinants.items()]
-
-        return ":".join(sorted(ret_list)) if ret_list else "NEG"
-    
-    columns_to_add.append(df_table3_new_data["FQ_Determinant"].apply(fq_format_convert).rename("FQ__autocolour"))
-
-    # Lookup table for S/I/R colours
-    sir_colour = {
-        "S": "#0069EC",
-        "I": "#F797B1",
-        "R": "#FF2722"
-    }
+    columns_to_add.append(map_distinct(df_table3_new_data["FQ_Determinant"], fq_format_convert).rename("FQ__autocolour"))
 
     # Generate all SIR colours based on their respective SIR columns, assign TRANSPARENT to non-SIR values
-    for col in df_table3_new_data.columns:
-        if "SIR" not in col:
-            continue
-        columns_to_add.append(df_table3_new_data[col].map(sir_colour).fillna("TRANSPARENT").rename(f"{col}__colour"))
+    columns_to_add.extend(run_kernels([(f"{col}__colour", df_table3_new_data[col], SIR_COLOUR_KERNELS) for col in df_table3_new_data.columns if "SIR" in col]))
 
     # Generate Other based on KAN_Determinant, RIF_Determinant, VAN_Determinant with table3 format
-    def other_format_convert(row):
-        determinants_set = set()
-
-        for determinants in (row["KAN_Determinant"], row["VAN_Determinant"]):
-            if determinants == '_':
-                continue
-            determinants_set.update(set(determinant.split("_")[0] for determinant in determinants.split("; ")))
-
-        dict_rif_determinants = defaultdict(set)
-        for determinant in row["RIF_Determinant"].split("; "):
-            matches = re.match(r"^(.+)_.+ VARIANT (.+)$", determinant)
-            if not matches:
-                continue
-            gene, variant =  matches.groups()
-            dict_rif_determinants[gene].add(variant)
-        determinants_set.update(set(f"{gene}_{';'.join(sorted(determinants))}" for gene, determinants in dict_rif_determinants.items()))
-
-        return ":".join(sorted(determinants_set)) if determinants_set else "NEG"
-    
-    columns_to_add.append(df_table3_new_data[["KAN_Determinant", "RIF_Determinant", "VAN_Determinant"]].apply(other_format_convert, axis=1).rename("Other"))
+    columns_to_add.append(map_distinct_rows(df_table3_new_data[["KAN_Determinant", "RIF_Determinant", "VAN_Determinant"]], other_format_convert).rename("Other"))
 
     # Generate PBP1A_2B_2X__autocolour based on pbp1a, pbp2b and pbp2x with table3 format
     df_table3_new_data["PBP1A_2B_2X__autocolour"] = df_table3_new_data["pbp1a"] + "__" + df_table3_new_data["pbp2b"] + "__" + df_table3_new_data["pbp2x"]
 
-    # Lookup table for POS and NEG colours
-    pos_neg_colour = {
-        "POS": "#FF2722",
-        "NEG": "#0069EC"
-    }
-
-    # Generate ermB and ermB__colour based on ERY_CLI_Determinant with table3 format
-    columns_to_add.append(s_ermb := (pd.Series(np.where(df_table3_new_data["ERY_CLI_Determinant"].str.contains("ERMB"), "POS", "NEG"), name="ermB")))
-    columns_to_add.append(s_ermb.map(pos_neg_colour).rename("ermB__colour"))
-
-    # Generate mefA and mefA__colour based on ERY_Determinant with table3 format
-    columns_to_add.append(s_mefa := (pd.Series(np.where(df_table3_new_data["ERY_Determinant"].str.contains("MEFA"), "POS", "NEG"), name="mefA")))
-    columns_to_add.append(s_mefa.map(pos_neg_colour).rename("mefA__colour"))
-
-    # Generate folA_I100L and folA_I100L__colour based on Series s_cot with table3 format
-    columns_to_add.append(s_mefa := (pd.Series(np.where(s_cot.str.contains("FOLA_I100L"), "POS", "NEG"), name="folA_I100L")))
-    columns_to_add.append(s_mefa.map(pos_neg_colour).rename("folA_I100L__colour"))
+    # Generate ermB and ermB__colour based on ERY_CLI_Determinant, mefA and mefA__colour based on ERY_Determinant,
+    # folA_I100L and folA_I100L__colour based on Series s_cot, and cat and cat__colour based on CHL_Determinant with table3 format
+    s_ermb, s_ermb_colour, s_mefa, s_mefa_colour, s_fola, s_fola_colour, s_cat, s_cat_colour = run_kernels([
+        ("ermB", df_table3_new_data["ERY_CLI_Determinant"], pos_neg_kernels("ERMB")),
+        ("ermB__colour", df_table3_new_data["ERY_CLI_Determinant"], pos_neg_colour_kernels("ERMB")),
+        ("mefA", df_table3_new_data["ERY_Determinant"], pos_neg_kernels("MEFA")),
+        ("mefA__colour", df_table3_new_data["ERY_Determinant"], pos_neg_colour_kernels("MEFA")),
+        ("folA_I100L", s_cot, pos_neg_kernels("FOLA_I100L")),
+        ("folA_I100L__colour", s_cot, pos_neg_colour_kernels("FOLA_I100L")),
+        ("cat", df_table3_new_data["CHL_Determinant"], pos_neg_kernels("CAT")),
+        ("cat__colour", df_table3_new_data["CHL_Determinant"], pos_neg_colour_kernels("CAT"))
+    ])
+    columns_to_add.extend([s_ermb, s_ermb_colour, s_mefa, s_mefa_colour, s_fola, s_fola_colour])
 
     # Generate folP__autocolour based on Series s_cot with table3 format
-    def folp_autocolour_format_convert(determinants):
-        ret = set(determinant for determinant in determinants.split(":") if "FOLP" in determinant)
-        return ":".join(sorted(ret)) if ret else "NEG"
-    
-    columns_to_add.append(s_cot.apply(folp_autocolour_format_convert).rename("folP__autocolour"))
+    columns_to_add.append(map_distinct(s_cot, folp_autocolour_format_convert).rename("folP__autocolour"))
 
-    # Generate cat and cat__colour based on CHL_Determinant with table3 format
-    columns_to_add.append(s_cat := (pd.Series(np.where(df_table3_new_data["CHL_Determinant"].str.contains("CAT"), "POS", "NEG"), name="cat")))
-    columns_to_add.append(s_cat.map(pos_neg_colour).rename("cat__colour"))
+    columns_to_add.extend([s_cat, s_cat_colour])
 
     # Add all new columns
     df_table3_new_data = pd.concat([df_table3_new_data, *columns_to_add], axis=1)
 
     # Extract and reorder relevant columns
-    # No_of_genome and Duplicate columns will be inserted in integrate_table3 function
+    # No_of_genome and Duplicate columns will be assigned in assign_no_of_genome_and_duplicate function
     df_table3_new_data = df_table3_new_data[[
         "Lane_id", "Public_name", "Sanger_sample_id", "ERR", "ERS", 
         "No_of_genome", "Duplicate",
@@ -366,29 +376,348 @@ def generate_table3_data(df_results, df_info, df_gpsc_colour, df_serotype_colour
     return df_table3_new_data
 
 
-def integrate_table2(df_table2_new_data, df_table2, table2_path):
+# Apply a function to each distinct value of a Series only, and map the results back to all rows
+# Determinant strings repeat heavily across samples, so this avoids re-parsing the same string for each row
+def map_distinct(series, func):
+    return series.map({value: func(value) for value in series.unique()})
+
+
+# Apply a function to each distinct combination of values across the columns of a DataFrame only, and map the results back to all rows
+def map_distinct_rows(df, func):
+    keys = list(df.itertuples(index=False, name=None))
+    results = {key: func(*key) for key in set(keys)}
+    return pd.Series([results[key] for key in keys], index=df.index)
+
+
+# Lookup table for S/I/R colours
+SIR_COLOUR = {
+    "S": "#0069EC",
+    "I": "#F797B1",
+    "R": "#FF2722"
+}
+
+# Lookup table for POS and NEG colours
+POS_NEG_COLOUR = {
+    "POS": "#FF2722",
+    "NEG": "#0069EC"
+}
+
+
+# Run a batch of normalisation kernels, each job is a tuple of (output column name, input Series, (Pandas kernel, Arrow kernel)); return the output Series in the order of the jobs
+# The Arrow compute kernels run column-parallel in a thread pool, as they release the GIL, regardless of the table I/O engine; the Pandas kernels only run column by column if pyarrow is not installed
+def run_kernels(jobs):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return [pandas_kernel(series).rename(name) for name, series, (pandas_kernel, _) in jobs]
+
+    def run_arrow_kernel(job):
+        name, series, (_, arrow_kernel) = job
+        result = arrow_kernel(pa.array(series, type=pa.string(), from_pandas=True))
+        # Arrow nulls are converted to None, use NaN as Pandas does
+        s_result = pd.Series(result.to_numpy(zero_copy_only=False), index=series.index, name=name)
+        return s_result.where(s_result.notna(), np.nan)
+
+    with ThreadPoolExecutor() as executor:
+        return list(executor.map(run_arrow_kernel, jobs))
+
+
+# Convert content to UPPER case
+def upper_pandas(series):
+    return series.str.upper()
+
+
+# Arrow kernel of upper_pandas; Arrow only applies simple case mappings, so columns with non-ASCII content fall back to Python to keep full case mappings (e.g. "ß" becomes "SS")
+def upper_arrow(array):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if pc.all(pc.string_is_ascii(array)).as_py() is False:
+        return pa.array([None if value is None else value.upper() for value in array.to_pylist()], type=pa.string())
+    return pc.utf8_upper(array)
+
+
+# Remove spaces, leading = and duplicated NF (happen in PBP AMR), and fill empty as _
+def clean_mic_pandas(series):
+    return series.str.replace(" ", "").str.replace("^=", "", regex=True).str.replace(r"^(NF){2,}$", "NF", regex=True).str.replace(r"^$", "_", regex=True)
+
+
+# Arrow kernel of clean_mic_pandas
+def clean_mic_arrow(array):
+    import pyarrow.compute as pc
+
+    array = pc.replace_substring(array, " ", "")
+    array = pc.replace_substring_regex(array, "^=", "")
+    array = pc.replace_substring_regex(array, r"^(NF){2,}$", "NF")
+    return pc.if_else(pc.equal(array, ""), "_", array)
+
+
+# Convert S/I/R to colours, assign TRANSPARENT to non-SIR values
+def sir_colour_pandas(series):
+    return series.map(SIR_COLOUR).fillna("TRANSPARENT")
+
+
+# Arrow kernel of sir_colour_pandas
+def sir_colour_arrow(array):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    positions = pc.index_in(array, value_set=pa.array(list(SIR_COLOUR)))
+    return pc.fill_null(pc.take(pa.array(list(SIR_COLOUR.values())), positions), "TRANSPARENT")
+
+
+# Get POS/NEG kernels of a gene, content containing the gene is POS, otherwise NEG
+def pos_neg_kernels(gene):
+    return (
+        lambda series: pd.Series(np.where(series.str.contains(gene), "POS", "NEG"), index=series.index),
+        lambda array: pos_neg_arrow(array, gene, "POS", "NEG")
+    )
+
+
+# Get POS/NEG colour kernels of a gene
+def pos_neg_colour_kernels(gene):
+    return (
+        lambda series: pd.Series(np.where(series.str.contains(gene), "POS", "NEG"), index=series.index).map(POS_NEG_COLOUR),
+        lambda array: pos_neg_arrow(array, gene, POS_NEG_COLOUR["POS"], POS_NEG_COLOUR["NEG"])
+    )
+
+
+# Arrow kernel of POS/NEG and their colours; missing content is POS as np.where treats NaN as True
+def pos_neg_arrow(array, gene, pos, neg):
+    import pyarrow.compute as pc
+
+    return pc.if_else(pc.fill_null(pc.match_substring(array, gene), True), pos, neg)
+
+
+# Normalisation kernels as (Pandas kernel, Arrow kernel)
+UPPER_KERNELS = (upper_pandas, upper_arrow)
+MIC_KERNELS = (clean_mic_pandas, clean_mic_arrow)
+SIR_COLOUR_KERNELS = (sir_colour_pandas, sir_colour_arrow)
+
+
+# Compiled patterns of the determinant formats
+COT_DETERMINANT_PATTERN = re.compile(r"^(FOL[AP])_.+ (?>(.+) AT ([0-9-]+))?(?>VARIANT (.+))?$")
+VARIANT_DETERMINANT_PATTERN = re.compile(r"^(.+)_.+ VARIANT (.+)$")
+
+
+# Get genes of acquired determinants, e.g. "ERMB_1; MEFA_10" becomes {"ERMB", "MEFA"}
+def get_acquired_genes(determinants):
+    return set(determinant.split("_")[0] for determinant in determinants.split("; "))
+
+
+# Get variants grouped by gene in "GENE_VARIANT;VARIANT" format, e.g. "PARC_1 VARIANT D83N; PARC_2 VARIANT S79F" becomes {"PARC_D83N;S79F"}
+def get_gene_variants(determinants):
+    dict_determinants = defaultdict(set)
+
+    for determinant in determinants.split("; "):
+        matches = VARIANT_DETERMINANT_PATTERN.match(determinant)
+        if not matches:
+            continue
+        gene, variant = matches.groups()
+        dict_determinants[gene].add(variant)
+
+    return set(f"{gene}_{';'.join(sorted(variants))}" for gene, variants in dict_determinants.items())
+
+
+# Convert ERY_Determinant to EC with table3 format
+@functools.cache
+def ec_format_convert(determinants):
+    if determinants == "_":
+        return "NEG"
+    return ":".join(sorted(get_acquired_genes(determinants)))
+
+
+# Convert COT_Determinant to Cot with table3 format and LOW COVERAGE warnings removed
+@functools.cache
+def cot_format_convert(determinants):
+    fola_determinants = set()
+    folp_determinants = set()
+
+    for determinant in determinants.split("; "):
+        matches = COT_DETERMINANT_PATTERN.match(determinant)
+        if not matches:
+            continue
+        gene, disruption, location, variant =  matches.groups()
+        if gene == "FOLA":
+            fola_determinants.add(variant)
+        elif gene == "FOLP":
+            folp_determinants.add(f"{location}_{disruption}")
+    
+    ret_list = []
+
+    if fola_determinants:
+        ret_list.append(f"FOLA_{'_'.join(sorted(fola_determinants))}")
+    if folp_determinants:
+        ret_list.append(':'.join(f"FOLP_{determinant}" for determinant in sorted(folp_determinants)))
+
+    return ":".join(ret_list) if ret_list else "NEG"
+
+
+# Convert TET_Determinant to Tet__autocolour with table3 format
+@functools.cache
+def tet_format_convert(determinants):
+    if determinants == "_":
+        return "NEG"
+    return ":".join(sorted(get_acquired_genes(determinants)))
+
+
+# Convert FQ_Determinant to FQ__autocolour with table3 format
+@functools.cache
+def fq_format_convert(determinants):
+    ret = get_gene_variants(determinants)
+    return ":".join(sorted(ret)) if ret else "NEG"
+
+
+# Convert KAN_Determinant, RIF_Determinant, VAN_Determinant to Other with table3 format
+@functools.cache
+def other_format_convert(kan_determinants, rif_determinants, van_determinants):
+    determinants_set = set()
+
+    for determinants in (kan_determinants, van_determinants):
+        if determinants == '_':
+            continue
+        determinants_set.update(get_acquired_genes(determinants))
+
+    determinants_set.update(get_gene_variants(rif_determinants))
+
+    return ":".join(sorted(determinants_set)) if determinants_set else "NEG"
+
+
+# Convert Cot to folP__autocolour with table3 format
+@functools.cache
+def folp_autocolour_format_convert(determinants):
+    ret = set(determinant for determinant in determinants.split(":") if "FOLP" in determinant)
+    return ":".join(sorted(ret)) if ret else "NEG"
+
+
+# Check whether any existing sample in table3 shares Public_name with the new samples (_R* suffix repeats considered) in the key index
+def has_existing_public_name(df_table3_new_data, data_key_index):
+    if df_table3_new_data is None:
+        return False
+
+    public_names_no_suffix = set(validator.get_public_name_no_suffix(df_table3_new_data["Public_name"], 2))
+    public_names = public_names_no_suffix | {f"{public_name}_R{repeat}" for public_name in public_names_no_suffix for repeat in range(1, 10)}
+    return bool(key_index.find_existing(data_key_index, "table3.csv", "Public_name", public_names))
+
+
+# Assign the final No_of_genome and Duplicate to the new samples with the rules of the validator, so the integrated table3 is valid without a fix-up run of the GPS Database Processor
+# Only the Public_name groups (_R* suffix repeats considered) of the new samples are evaluated; existing samples in these groups are updated in-place in df_table3
+# In append mode, df_table2 and df_table3 are None as no existing sample shares Public_name with the new samples
+def assign_no_of_genome_and_duplicate(df_table3_new_data, df_table3, df_table2_new_data, df_table2):
+    if df_table3_new_data is None:
+        return None
+
+    public_names_no_suffix = validator.get_public_name_no_suffix(df_table3_new_data["Public_name"], 2)
+
+    # Existing samples come first to match the row order of the integrated tables, which decides ties in UNIQUE selection
+    if df_table3 is not None:
+        mask_affected = validator.get_public_name_no_suffix(df_table3["Public_name"], 2).isin(set(public_names_no_suffix))
+        df_affected = pd.concat([df_table3[mask_affected], df_table3_new_data], keys=["existing", "new"])
+        df_qc = pd.concat([df_table2[df_table2["Lane_id"].isin(set(df_affected["Lane_id"]))], df_table2_new_data])
+    else:
+        df_affected = pd.concat([df_table3_new_data], keys=["new"])
+        df_qc = df_table2_new_data
+
+    df_affected["Public_name_no_suffix"] = validator.get_public_name_no_suffix(df_affected["Public_name"], 2)
+    group_sizes = df_affected["Public_name_no_suffix"].map(df_affected["Public_name_no_suffix"].value_counts())
+    df_affected["No_of_genome"] = group_sizes.astype(str)
+
+    # New samples are DUPLICATE unless they are the only sample of their Public_name, or selected as UNIQUE for a duplicated Public_name without UNIQUE
+    df_affected.loc["new", "Duplicate"] = np.where(group_sizes.loc["new"] == 1, "UNIQUE", "DUPLICATE")
+    df_duplicates = df_affected[group_sizes > 1]
+    duplicates_no_unique = set(df_duplicates["Public_name_no_suffix"]) - set(df_duplicates.loc[df_duplicates["Duplicate"] == "UNIQUE", "Public_name_no_suffix"])
+    for duplicate in duplicates_no_unique:
+        selected_lane_id = validator.select_unique_lane_id(df_duplicates[df_duplicates["Public_name_no_suffix"] == duplicate], df_qc)
+        df_affected.loc[df_affected["Lane_id"] == selected_lane_id, "Duplicate"] = "UNIQUE"
+
+    if df_table3 is not None and mask_affected.any():
+        df_table3.loc[mask_affected, ["No_of_genome", "Duplicate"]] = df_affected.loc["existing", ["No_of_genome", "Duplicate"]].to_numpy()
+
+    return df_affected.loc["new", df_table3_new_data.columns]
+
+
+def integrate_table2(df_table2_new_data, df_table2, table2_path, data_key_index):
     # Ensure new Lane_id(s) do not exist in the existing table2
-    if already_exist_lane_id := set(df_table2["Lane_id"]).intersection(df_table2_new_data["Lane_id"]):
-        sys.exit(f"Error: The following Lane_ID(s) already exist in {table2_path}: {', '.join(sorted(already_exist_lane_id))}.")
+    check_lane_id_not_exist(df_table2_new_data, table2_path, data_key_index)
 
     return pd.concat([df_table2, df_table2_new_data], axis=0)
 
 
-def integrate_table3(df_table3_new_data, df_table3, table3_path):
+def integrate_table3(df_table3_new_data, df_table3, table3_path, data_key_index):
     # Return original table if there is no QC passed samples
     if df_table3_new_data is None:
         return df_table3
 
     # Ensure new Lane_id(s) do not exist in the existing table3
-    if already_exist_lane_id := set(df_table3["Lane_id"]).intersection(df_table3_new_data["Lane_id"]):
-        sys.exit(f"Error: The following Lane_ID(s) already exist in {table3_path}: {', '.join(sorted(already_exist_lane_id))}.")
+    check_lane_id_not_exist(df_table3_new_data, table3_path, data_key_index)
 
     return pd.concat([df_table3, df_table3_new_data], axis=0)
 
 
+def check_lane_id_not_exist(df_new_data, table_path, data_key_index):
+    # The key index is keyed by table name without the compression extension (e.g. table3.csv.gz is table3.csv)
+    table = os.path.basename(table_path).removesuffix(table_io.COMPRESSIONS.get(table_io.get_compression(table_path), ""))
+    if already_exist_lane_id := key_index.find_existing(data_key_index, table, "Lane_id", df_new_data["Lane_id"]):
+        sys.exit(f"Error: The following Lane_ID(s) already exist in {table_path}: {', '.join(sorted(already_exist_lane_id))}.")
+
+
 def save_tables(df_table2_updated, table2_path, df_table3_updated, table3_path):
-    df_table2_updated.to_csv(table2_path, index=False)
-    df_table3_updated.to_csv(table3_path, index=False)
+    table_io.write_csv(df_table2_updated, table2_path)
+    table_io.write_csv(df_table3_updated, table3_path)
+
+    key_index.update_key_index(os.path.dirname(table2_path), {"table2.csv": df_table2_updated, "table3.csv": df_table3_updated})
+
+
+# Append new data to the end of table2 and table3 without rewriting the existing rows
+# The tables are appended transactionally: if appending to either table fails, both are truncated back to their original sizes
+def append_tables(df_table2_new_data, table2_path, df_table3_new_data, table3_path, data_key_index):
+    check_lane_id_not_exist(df_table2_new_data, table2_path, data_key_index)
+    appends = [(table2_path, df_table2_new_data)]
+
+    # Skip table3 if there is no QC passed samples
+    if df_table3_new_data is not None:
+        check_lane_id_not_exist(df_table3_new_data, table3_path, data_key_index)
+        appends.append((table3_path, df_table3_new_data))
+
+    # Format new rows in the column order and line terminator of the existing tables before modifying any file
+    new_data = {os.path.basename(table_path): df_new_data for table_path, df_new_data in appends}
+    appends = [(table_path, format_rows_to_append(df_new_data, table_path)) for table_path, df_new_data in appends]
+
+    original_sizes = {table_path: os.path.getsize(table_path) for table_path, _ in appends}
+    try:
+        for table_path, rows in appends:
+            with open(table_path, "r+b") as f:
+                f.seek(0, os.SEEK_END)
+
+                # Ensure the new rows start on a new line
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        rows = b"\n" + rows
+
+                f.write(rows)
+                f.flush()
+                os.fsync(f.fileno())
+    except BaseException:
+        for table_path, size in original_sizes.items():
+            with open(table_path, "r+b") as f:
+                f.truncate(size)
+                f.flush()
+                os.fsync(f.fileno())
+        raise
+
+    key_index.update_key_index(os.path.dirname(table2_path), new_data, append=True)
+
+
+def format_rows_to_append(df_new_data, table_path):
+    columns = table_io.read_header(table_path)
+    if set(columns) != set(df_new_data.columns):
+        sys.exit(f"Error: The columns of {table_path} do not match the columns of the new data, the new data cannot be appended!")
+
+    with open(table_path, "rb") as f:
+        lineterminator = "\r\n" if f.readline().endswith(b"\r\n") else "\n"
+
+    return table_io.format_csv_rows(df_new_data[columns], lineterminator)
 
 
 def parse_arguments():
@@ -402,14 +731,22 @@ def parse_arguments():
 
     parser.add_argument(
         '-r', '--results',
-        default='results.csv',
-        help='path to results.csv generated by the GPS Pipeline'
+        nargs='+',
+        default=['results.csv'],
+        help='path(s) to results.csv generated by the GPS Pipeline; multiple paths are paired with the paths of --info by position'
     )
 
     parser.add_argument(
         '-i', '--info',
-        default='info.csv',
-        help='path to info.csv which contain at least 2 comma-separated columns (first two are required, others are optional): Lane_id, Public_name, Supplier_name, Sanger_sample_id, ERR, ERS'
+        nargs='+',
+        default=['info.csv'],
+        help='path(s) to info.csv which contain at least 2 comma-separated columns (first two are required, others are optional): Lane_id, Public_name, Supplier_name, Sanger_sample_id, ERR, ERS'
+    )
+
+    parser.add_argument(
+        '--runs',
+        default=None,
+        help='glob pattern of run directories (e.g. "runs/*"), each containing results.csv and info.csv; overrides --results and --info'
     )
 
     parser.add_argument(
@@ -442,6 +779,19 @@ def parse_arguments():
         help='path to serotype colour assignment file'
     )
 
+    parser.add_argument(
+        '--append',
+        action='store_true',
+        help='append new data to the end of table2.csv and table3.csv instead of rewriting them; existing tables are not loaded, unless existing samples share Public_name with the new samples and their No_of_genome has to be updated, or the tables are compressed'
+    )
+
+    parser.add_argument(
+        '--io-engine',
+        choices=table_io.ENGINES,
+        default='pandas',
+        help='engine for reading and writing tables; arrow uses the multithreaded Arrow CSV reader and writer (requires pyarrow)'
+    )
+
     return parser.parse_args()
 
 
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+# Compare a new release of the GPS database against the previous release: table1-4 of two data directories, and their Monocle tables if provided
+# Rows of the two releases are matched on their keys with a hash join, and each row is hashed once, so only rows with different hashes are compared column by column
+
+import pandas as pd
+import numpy as np
+import argparse
+import sys
+import os
+
+# Allow shared modules of the GPS Database Processor to be imported
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import bin.table_io as table_io
+
+
+# Key column of each table, on which rows of the two releases are matched
+TABLE_KEYS = {
+    "table1.csv": "Public_name",
+    "table2.csv": "Lane_id",
+    "table3.csv": "Lane_id",
+    "table4.csv": "Public_name",
+    "table_monocle.csv": "Lane_id"
+}
+
+# Columns of the delta file: one row per added or removed row (without Column and values), and one row per changed value of a changed row
+DELTA_COLUMNS = ["Table", "Key", "Change", "Column", "Old_value", "New_value"]
+
+
+def main():
+    args = parse_arguments()
+
+    table_pairs = get_table_pairs(args)
+
+    try:
+        table_io.set_engine(args.io_engine)
+    except ImportError:
+        sys.exit(f"Error: The {args.io_engine} engine requires pyarrow, which is not installed!")
+
+    df_deltas = []
+    for table, key, old_path, new_path in table_pairs:
+        df_delta, summary = diff_table(table, key, old_path, new_path)
+        print_summary(table, key, summary)
+        df_deltas.append(df_delta)
+
+    df_delta = pd.concat(df_deltas, ignore_index=True)
+    table_io.write_csv(df_delta, args.output)
+    print(f"{len(df_delta)} change(s) are saved to {args.output}.")
+
+
+# Get (table name, key column, old path, new path) of the tables to compare, either all tables found in both data directories, or the two tables provided
+def get_table_pairs(args):
+    if os.path.isdir(args.old) and os.path.isdir(args.new):
+        table_pairs = []
+        for table, key in TABLE_KEYS.items():
+            old_path, new_path = (table_io.find_table(path, table) for path in (args.old, args.new))
+            old_exists, new_exists = os.path.isfile(old_path), os.path.isfile(new_path)
+            if old_exists and new_exists:
+                table_pairs.append((table, args.key or key, old_path, new_path))
+            elif old_exists or new_exists:
+                print(f"Warning: {table} is only found in {old_path if old_exists else new_path}, it is not compared.")
+
+        if not table_pairs:
+            sys.exit(f"Error: No table is found in both {args.old} and {args.new}!")
+        return table_pairs
+
+    if os.path.isfile(args.old) and os.path.isfile(args.new):
+        # Tables are named by their file name without the compression extension (e.g. table1.csv.gz is table1.csv)
+        table = os.path.basename(args.new).removesuffix(table_io.COMPRESSIONS.get(table_io.get_compression(args.new), ""))
+        if (key := args.key or TABLE_KEYS.get(table)) is None:
+            sys.exit(f"Error: The key column of {table} is unknown, please provide it with --key!")
+        return [(table, key, args.old, args.new)]
+
+    sys.exit(f"Error: {args.old} and {args.new} must be both data directories or both tables!")
+
+
+# Compare the old and new versions of a table on the key column
+# Return the delta as a dataframe of DELTA_COLUMNS, and a summary dictionary of the row counts, changes per column, and added and removed columns
+def diff_table(table, key, old_path, new_path):
+    df_old, df_new = (read_table(path, key) for path in (old_path, new_path))
+
+    # Only columns in both versions are compared; added and removed columns are reported in the summary
+    columns = [column for column in df_new.columns if column in df_old.columns]
+
+    # Hash each row once over the compared columns
+    old_hashes, new_hashes = (pd.util.hash_pandas_object(df[columns], index=False).to_numpy() for df in (df_old, df_new))
+
+    # Hash join on the key: position of each new row in the old version, -1 if it is added
+    old_positions = pd.Index(df_old[key]).get_indexer(df_new[key])
+    added = old_positions == -1
+    matched_new = np.flatnonzero(~added)
+    matched_old = old_positions[matched_new]
+
+    removed = np.ones(len(df_old), dtype=bool)
+    removed[matched_old] = False
+
+    # Only rows with different hashes are compared column by column
+    changed = old_hashes[matched_old] != new_hashes[matched_new]
+    changed_old, changed_new = matched_old[changed], matched_new[changed]
+
+    column_changes = {}
+    changes = []
+    for column_position, column in enumerate(columns):
+        old_values = df_old[column].to_numpy()[changed_old]
+        new_values = df_new[column].to_numpy()[changed_new]
+        if not (different := old_values != new_values).any():
+            continue
+        column_changes[column] = int(different.sum())
+        changes.append((changed_new[different], np.full(different.sum(), column_position), old_values[different], new_values[different]))
+
+    summary = {
+        "old_rows": len(df_old),
+        "new_rows": len(df_new),
+        "added": int(added.sum()),
+        "removed": int(removed.sum()),
+        "changed": len(changed_new),
+        "unchanged": len(matched_new) - len(changed_new),
+        "column_changes": column_changes,
+        "added_columns": [column for column in df_new.columns if column not in df_old.columns],
+        "removed_columns": [column for column in df_old.columns if column not in df_new.columns]
+    }
+
+    return get_delta(table, key, df_old, df_new, removed, added, changes, columns), summary
+
+
+# Read a table with all values as strings, and ensure its key column exists and is unique
+def read_table(path, key):
+    df = table_io.read_csv(path)
+
+    if key not in df.columns:
+        sys.exit(f"Error: The key column {key} is not found in {path}!")
+    if (duplicated_keys := df.loc[df[key].duplicated(), key].unique().tolist()):
+        sys.exit(f"Error: The following {key}(s) are duplicated in {path}: {', '.join(sorted(duplicated_keys))}")
+
+    return df
+
+
+# Get the delta of a table as a dataframe of DELTA_COLUMNS: removed rows in the order of the old version, then added rows and changed values in the order of the new version
+def get_delta(table, key, df_old, df_new, removed, added, changes, columns):
+    df_removed = pd.DataFrame({"Key": df_old[key].to_numpy()[removed], "Change": "removed"})
+    df_added = pd.DataFrame({"Key": df_new[key].to_numpy()[added], "Change": "added", "_row": np.flatnonzero(added), "_column": -1})
+
+    if changes:
+        rows, column_positions, old_values, new_values = (np.concatenate(arrays) for arrays in zip(*changes))
+    else:
+        rows, column_positions, old_values, new_values = (np.array([], dtype=dtype) for dtype in (int, int, object, object))
+    df_changed = pd.DataFrame({
+        "Key": df_new[key].to_numpy()[rows],
+        "Change": "changed",
+        "Column": np.asarray(columns, dtype=object)[column_positions],
+        "Old_value": old_values,
+        "New_value": new_values,
+        "_row": rows,
+        "_column": column_positions
+    })
+
+    df_new_order = pd.concat([df_added, df_changed], ignore_index=True).sort_values(["_row", "_column"], kind="stable").drop(columns=["_row", "_column"])
+    df_delta = pd.concat([df_removed, df_new_order], ignore_index=True)
+    df_delta.insert(0, "Table", table)
+
+    return df_delta.reindex(columns=DELTA_COLUMNS).fillna("")
+
+
+# Print the summary of the comparison of a table
+def print_summary(table, key, summary):
+    print(f"{table} (matched on {key}): {summary['old_rows']} -> {summary['new_rows']} row(s); {summary['added']} added, {summary['removed']} removed, {summary['changed']} changed, {summary['unchanged']} unchanged")
+    if summary["added_columns"]:
+        print(f"  Added column(s): {', '.join(summary['added_columns'])}")
+    if summary["removed_columns"]:
+        print(f"  Removed column(s): {', '.join(summary['removed_columns'])}")
+    if summary["column_changes"]:
+        column_changes = sorted(summary["column_changes"].items(), key=lambda item: -item[1])
+        print(f"  Changed value(s) per column: {', '.join(f'{column}: {count}' for column, count in column_changes)}")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        allow_abbrev=False,
+        description='Compare a new release of the GPS database against the previous release, reporting added, removed and changed rows of each table with per-column change counts',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        '-o', '--old',
+        required=True,
+        help='path to the data directory of the previous release, or to a table (e.g. table_monocle.csv) of the previous release'
+    )
+
+    parser.add_argument(
+        '-n', '--new',
+        required=True,
+        help='path to the data directory of the new release, or to a table of the new release'
+    )
+
+    parser.add_argument(
+        '-k', '--key',
+        default=None,
+        help=f'key column to match rows on, instead of the key of each table ({", ".join(f"{table}: {key}" for table, key in TABLE_KEYS.items())})'
+    )
+
+    parser.add_argument(
+        '--output',
+        default='release_diff.csv',
+        help='path to save the delta file, with one row per added or removed row and one row per changed value; compressed if the path ends with .gz or .zst'
+    )
+
+    parser.add_argument(
+        '--io-engine',
+        choices=table_io.ENGINES,
+        default='pandas',
+        help='engine for reading and writing tables; arrow uses the multithreaded Arrow CSV reader and writer (requires pyarrow)'
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()